@@ -0,0 +1,111 @@
+"""
+Benchmark for the SSIM frame-deduplication stage.
+
+Runs the reference skimage-based check (is_distinct_frame) and FrameDeduplicator, with and
+without pre-filters, over synthetic face-crop sequences (and optionally the crops of a real
+video), and checks that every variant keeps exactly the same frames at the given threshold.
+
+Usage (from model/src):
+    python ../benchmarks/dedup_benchmark.py [--video PATH] [--ssim-threshold 0.9]
+"""
+import argparse
+import os
+import sys
+import time
+
+import cv2
+import numpy as np
+from skimage import data
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+
+from FrameDeduplication import FrameDeduplicator
+from MediaPipeCropping import CROP_SIZE, is_distinct_frame
+
+def base_faces():
+    """A few 128x128 BGR test images: the astronaut's face and other skimage samples for scene cuts."""
+    astronaut = cv2.cvtColor(data.astronaut(), cv2.COLOR_RGB2BGR)[20:240, 140:320]
+    others = [cv2.cvtColor(data.chelsea(), cv2.COLOR_RGB2BGR), cv2.cvtColor(data.camera(), cv2.COLOR_GRAY2BGR)]
+    return [cv2.resize(image, (CROP_SIZE, CROP_SIZE), interpolation=cv2.INTER_AREA) for image in [astronaut] + others]
+
+def jitter(image, rng, shift, angle, noise):
+    """Small random rigid motion plus sensor noise, like consecutive aligned crops of a talking subject."""
+    matrix = cv2.getRotationMatrix2D((CROP_SIZE / 2, CROP_SIZE / 2), rng.uniform(-angle, angle), 1.0)
+    matrix[:, 2] += rng.uniform(-shift, shift, size=2)
+    moved = cv2.warpAffine(image, matrix, (CROP_SIZE, CROP_SIZE), borderMode=cv2.BORDER_REFLECT)
+    return np.clip(moved + rng.normal(0, noise, moved.shape), 0, 255).astype(np.uint8)
+
+def synthetic_sequences(length=300, seed=0):
+    """Named crop sequences covering steady, moving, relit, duplicated and cut footage."""
+    rng = np.random.default_rng(seed)
+    face, *others = base_faces()
+    sequences = {
+        "steady": [jitter(face, rng, 0.5, 0.5, 2) for _ in range(length)],
+        "moving": [jitter(face, rng, 4, 5, 3) for _ in range(length)],
+        "relit": [cv2.convertScaleAbs(jitter(face, rng, 1, 1, 2), alpha=1.0, beta=40 * np.sin(i / 20))
+                  for i in range(length)],
+        "duplicated": [frame for frame in (jitter(face, rng, 2, 2, 2) for _ in range(length // 3)) for _ in range(3)],
+        "cuts": [jitter([face, *others][(i // 25) % 3], rng, 2, 2, 2) for i in range(length)],
+    }
+    return sequences
+
+def video_crops(video_path):
+    """All aligned face crops of a video, before deduplication."""
+    from MediaPipeCropping import iter_face_crops
+
+    class KeepAll:
+        def accept(self, face_crop):
+            return True
+
+    return list(iter_face_crops(video_path, deduplicator=KeepAll()))
+
+def reference_kept(crops, ssim_threshold):
+    """Indices kept by the original skimage-based comparison chain."""
+    kept, last_face_crop = [], None
+    for idx, face_crop in enumerate(crops):
+        if is_distinct_frame(face_crop, last_face_crop, ssim_threshold):
+            kept.append(idx)
+            last_face_crop = face_crop
+    return kept
+
+def deduplicator_kept(crops, deduplicator):
+    """Indices kept by a FrameDeduplicator."""
+    return [idx for idx, face_crop in enumerate(crops) if deduplicator.accept(face_crop)]
+
+def timed(fn, *args):
+    start = time.perf_counter()
+    result = fn(*args)
+    return result, time.perf_counter() - start
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--video", help="Also benchmark the face crops of this video")
+    parser.add_argument("--ssim-threshold", type=float, default=0.9)
+    args = parser.parse_args()
+
+    sequences = synthetic_sequences()
+    if args.video:
+        sequences[os.path.basename(args.video)] = video_crops(args.video)
+
+    mismatches = 0
+    print(f"{'sequence':<16}{'frames':>8}{'kept':>7}{'skimage ms/f':>14}{'cached ms/f':>13}"
+          f"{'prefilter ms/f':>16}{'prefiltered':>13}  equivalent")
+    for name, crops in sequences.items():
+        expected, reference_time = timed(reference_kept, crops, args.ssim_threshold)
+        cached, cached_time = timed(deduplicator_kept, crops, FrameDeduplicator(args.ssim_threshold, prefilter=False))
+        prefilter = FrameDeduplicator(args.ssim_threshold)
+        filtered, filtered_time = timed(deduplicator_kept, crops, prefilter)
+
+        equivalent = cached == expected and filtered == expected
+        mismatches += not equivalent
+        per_frame = 1000 / len(crops)
+        print(f"{name:<16}{len(crops):>8}{len(expected):>7}{reference_time * per_frame:>14.3f}"
+              f"{cached_time * per_frame:>13.3f}{filtered_time * per_frame:>16.3f}"
+              f"{prefilter.prefiltered:>13}  {'yes' if equivalent else 'NO'}")
+
+    if mismatches:
+        print(f"{mismatches} sequence(s) kept a different frame set than the reference implementation.")
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,153 @@
+"""
+Evaluation of variable-length, early-exit inference (DeepLie.predict_variable_length) against the
+fixed 300-frame pipeline (DeepLie.predict).
+
+For every video and tolerance it reports the deception score of both paths and their difference,
+whether they give the same label, the frames the FER model encoded (300 for the fixed path, the
+real face frames used for the variable one) and the wall time of each. Videos named after an MU3D
+clip (e.g. BF001_1PT.wmv) are also scored against their Veracity in the codebook.
+
+By default it runs on synthetic face videos of several lengths with the benchmark suite's seeded
+models (see pipeline_benchmark.py); pass --videos and --trained-models for a meaningful accuracy.
+
+Usage (from model/src):
+    python ../benchmarks/early_exit_eval.py [--tolerances 0 0.02 0.05] [--json out.json]
+    python ../benchmarks/early_exit_eval.py --trained-models --videos ../data/MU3D/Videos/*.wmv
+"""
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from pipeline_benchmark import load_models, synthetic_video
+
+# (frames, width, height) of the generated videos: shorter than, about and well over 300 frames
+VIDEO_CASES = [(120, 640, 360), (300, 640, 360), (900, 640, 360)]
+
+DEFAULT_TOLERANCES = [0.0, 0.02, 0.05]
+
+def timed(fn):
+    """(result, seconds) of one call."""
+    start = time.perf_counter()
+    result = fn()
+    return result, time.perf_counter() - start
+
+def evaluate_video(path, fer_engine, gru_model, classifier, mean_X, std_X, tolerances):
+    """Scores, frames and times of the fixed path and of the variable-length path at each tolerance."""
+    from DeepLie import NUM_FRAMES, predict, predict_variable_length
+    (prediction, *_), fixed_time = timed(lambda: predict(path, fer_engine, gru_model, mean_X, std_X))
+    fixed_score = float(prediction[0][0])
+    result = {"fixed": {"score": fixed_score, "frames_encoded": NUM_FRAMES, "seconds": fixed_time}, "variable": {}}
+    for tolerance in tolerances:
+        (prediction, *_, usage), variable_time = timed(lambda: predict_variable_length(
+            path, fer_engine, classifier, mean_X, std_X, tolerance))
+        score = float(prediction[0][0])
+        result["variable"][str(tolerance)] = {
+            "score": score,
+            "score_delta": abs(score - fixed_score),
+            "same_label": (score > 0.5) == (fixed_score > 0.5),
+            "frames_encoded": usage["frames_used"],
+            "stopped_early": usage["stopped_early"],
+            "seconds": variable_time,
+        }
+    return result
+
+def is_correct(score, label):
+    """Whether a deception score (over 0.5 is deceptive) matches an MU3D Veracity label (1 is truthful)."""
+    return (score <= 0.5) == bool(label)
+
+def summarize(results, labels, tolerances):
+    """Mean score difference, label agreement, frames and time per tolerance, with codebook accuracy if known."""
+    summary = {}
+    labeled = [video for video in results if video in labels]
+    fixed = [results[video]["fixed"] for video in results]
+    summary["fixed"] = {"mean_frames_encoded": np.mean([r["frames_encoded"] for r in fixed]),
+                        "mean_seconds": np.mean([r["seconds"] for r in fixed])}
+    if labeled:
+        summary["fixed"]["accuracy"] = np.mean([is_correct(results[video]["fixed"]["score"], labels[video])
+                                                for video in labeled])
+    for tolerance in map(str, tolerances):
+        variable = [results[video]["variable"][tolerance] for video in results]
+        summary[tolerance] = {
+            "mean_score_delta": np.mean([r["score_delta"] for r in variable]),
+            "max_score_delta": np.max([r["score_delta"] for r in variable]),
+            "label_agreement": np.mean([r["same_label"] for r in variable]),
+            "mean_frames_encoded": np.mean([r["frames_encoded"] for r in variable]),
+            "stopped_early": np.mean([r["stopped_early"] for r in variable]),
+            "mean_seconds": np.mean([r["seconds"] for r in variable]),
+        }
+        if labeled:
+            summary[tolerance]["accuracy"] = np.mean([is_correct(results[video]["variable"][tolerance]["score"],
+                                                                 labels[video]) for video in labeled])
+    return {name: {key: float(value) for key, value in row.items()} for name, row in summary.items()}
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--videos", nargs="+", help="Videos to evaluate (default: generated face videos)")
+    parser.add_argument("--tolerances", nargs="+", type=float, default=DEFAULT_TOLERANCES,
+                        help="Early-exit tolerances; 0 uses every real frame up to 300")
+    parser.add_argument("--video-dir", default=os.path.join(tempfile.gettempdir(), "deeplie-bench-videos"),
+                        help="Where generated videos are cached")
+    parser.add_argument("--trained-models", action="store_true", help="Load the trained .keras files")
+    parser.add_argument("--codebook", help="MU3D codebook (.xlsx) for the accuracy of MU3D videos")
+    parser.add_argument("--json", help="Write the results to this file")
+    args = parser.parse_args()
+
+    from InferenceEngine import FERInferenceEngine
+    from StreamingInference import StreamingClassifier
+    fer_model, gru_model, mean_X, std_X = load_models(args.trained_models)
+    fer_engine = FERInferenceEngine(fer_model)
+    classifier = StreamingClassifier(gru_model)
+
+    videos = args.videos or [synthetic_video(args.video_dir, *case) for case in VIDEO_CASES]
+    labels = {}
+    if args.codebook or args.videos:
+        from constants import MU3D_CODEBOOK_PATH
+        from FeatureStore import load_codebook
+        codebook_path = args.codebook or MU3D_CODEBOOK_PATH
+        if os.path.exists(codebook_path):
+            labels = {video_id: entry["label"] for video_id, entry in load_codebook(codebook_path).items()}
+
+    # One untimed run so that graph tracing is not charged to the first video
+    evaluate_video(videos[0], fer_engine, gru_model, classifier, mean_X, std_X, args.tolerances[:1])
+
+    results = {}
+    print(f"{'video':<28}{'path':>10}{'score':>8}{'dScore':>8}{'label':>7}{'frames':>8}{'early':>7}{'seconds':>9}")
+    for path in videos:
+        video = os.path.splitext(os.path.basename(path))[0]
+        results[video] = evaluate_video(path, fer_engine, gru_model, classifier, mean_X, std_X, args.tolerances)
+        fixed = results[video]["fixed"]
+        print(f"{video:<28}{'fixed':>10}{fixed['score']:>8.3f}{'':>8}{'':>7}{fixed['frames_encoded']:>8}"
+              f"{'':>7}{fixed['seconds']:>9.2f}")
+        for tolerance, row in results[video]["variable"].items():
+            print(f"{'':<28}{'tol ' + tolerance:>10}{row['score']:>8.3f}{row['score_delta']:>8.3f}"
+                  f"{'same' if row['same_label'] else 'diff':>7}{row['frames_encoded']:>8}"
+                  f"{'yes' if row['stopped_early'] else 'no':>7}{row['seconds']:>9.2f}")
+
+    summary = summarize(results, labels, args.tolerances)
+    print()
+    print(f"{'path':<12}{'mean dScore':>13}{'max dScore':>12}{'labels':>8}{'frames':>8}{'early':>7}{'seconds':>9}"
+          f"{'accuracy':>10}")
+    for name, row in summary.items():
+        accuracy = f"{row['accuracy']:.1%}" if "accuracy" in row else "-"
+        if name == "fixed":
+            print(f"{'fixed':<12}{'':>13}{'':>12}{'':>8}{row['mean_frames_encoded']:>8.0f}{'':>7}"
+                  f"{row['mean_seconds']:>9.2f}{accuracy:>10}")
+        else:
+            print(f"{'tol ' + name:<12}{row['mean_score_delta']:>13.4f}{row['max_score_delta']:>12.4f}"
+                  f"{row['label_agreement']:>8.0%}{row['mean_frames_encoded']:>8.0f}{row['stopped_early']:>7.0%}"
+                  f"{row['mean_seconds']:>9.2f}{accuracy:>10}")
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({"videos": results, "summary": summary}, f, indent=2)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,350 @@
+"""
+Reproducible, in-process benchmark suite for the analysis pipeline.
+
+Generates synthetic face videos (a moving, rotating, relit face on a textured background) of
+several lengths and resolutions, then times:
+  process_video   cropping to PNG files, per video
+  fer             FER encoding of 300 normalized frames
+  gru             GRU scoring of one (300, 4608) sequence
+  predict         DeepLie.predict() end to end, per video
+and the micro-benchmarks
+  alignment       crop_face_from_landmarks per frame, and FaceTracker landmarks per frame
+                  with Face Mesh on every frame versus tracked between keyframes
+  ssim_dedup      FrameDeduplicator per crop on the dedup_benchmark sequences
+  batching        FER frames/s by batch size and GRU sequences/s by batch size
+Each case reports p50/p95 latency, throughput and the peak resident memory it added.
+
+By default the models have the trained architectures (fer.json, create_gru_model in DeepLie.ipynb)
+with fixed random weights, so results do not depend on the Git LFS model files and are comparable
+between checkouts; pass --trained-models to load the .keras files instead.
+
+--baseline compares against a JSON written by --save-baseline and exits with status 1 if any
+case's p50 latency or peak memory grew by more than --tolerance. Baselines are only meaningful
+on the machine they were recorded on; the suite warns when the machine differs.
+
+Usage (from model/src):
+    python ../benchmarks/pipeline_benchmark.py [--quick] [--only fer predict ...] [--json out.json]
+    python ../benchmarks/pipeline_benchmark.py --quick --save-baseline ../benchmarks/baseline.json
+    python ../benchmarks/pipeline_benchmark.py --quick --baseline ../benchmarks/baseline.json
+"""
+import argparse
+import json
+import os
+import platform
+import shutil
+import sys
+import tempfile
+import threading
+import time
+
+import cv2
+import numpy as np
+from skimage import data
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+
+from constants import FER_MODEL_PATH, MAIN_MODEL_PATH, MEAN_X_PATH, NOTEBOOKS_PATH, STD_X_PATH
+from ModelRegistry import current_rss_mb, peak_rss_mb
+
+BENCHMARKS = ("process_video", "fer", "gru", "predict", "alignment", "ssim_dedup", "batching")
+
+# (frames, width, height) of the generated videos
+VIDEO_CASES = [(150, 640, 360), (600, 640, 360), (150, 1280, 720), (600, 1280, 720)]
+QUICK_VIDEO_CASES = [(150, 640, 360)]
+
+DEFAULT_REPEATS = 5
+QUICK_REPEATS = 3
+
+# Relative growth of p50 latency or peak memory reported as a regression; run-to-run noise
+# on a loaded machine reaches about 30%, the regressions worth catching are 2x and more
+DEFAULT_TOLERANCE = 0.5
+
+# Memory growth below this many MB is noise and never reported as a regression
+MEMORY_NOISE_MB = 16
+
+FER_ARCHITECTURE_PATH = NOTEBOOKS_PATH + "deeplie/content/fer2013/fer.json"
+SEQUENCE_LENGTH = 300
+ENCODING_DIM = 4608
+
+def synthetic_frames(frames, width, height, seed=0):
+    """
+    BGR frames of the astronaut's head and shoulders drifting, rotating, scaling and changing
+    brightness over a fixed textured background, with sensor noise. Face Mesh finds the face in
+    nearly every frame, so cropping does the same work as on a real interview.
+    """
+    rng = np.random.default_rng(seed)
+    subject = cv2.cvtColor(data.astronaut(), cv2.COLOR_RGB2BGR)[0:300, 100:380]
+    texture = rng.integers(0, 256, (height // 8 + 1, width // 8 + 1, 3), dtype=np.uint8)
+    background = cv2.resize(cv2.GaussianBlur(texture, (3, 3), 0), (width, height), interpolation=cv2.INTER_CUBIC)
+    size = int(height * 0.6)
+    subject = cv2.resize(subject, (size * subject.shape[1] // subject.shape[0], size), interpolation=cv2.INTER_AREA)
+    h, w = subject.shape[:2]
+    for idx in range(frames):
+        t = idx / 30
+        matrix = cv2.getRotationMatrix2D((w / 2, h / 2), 6 * np.sin(0.9 * t), 1 + 0.05 * np.sin(0.5 * t))
+        matrix[:, 2] += (width / 2 + width * 0.1 * np.sin(0.7 * t) - w / 2,
+                         height / 2 + height * 0.05 * np.sin(1.1 * t) - h / 2)
+        mask = cv2.warpAffine(np.full((h, w), 255, np.uint8), matrix, (width, height))
+        frame = np.where(mask[..., None] > 0, cv2.warpAffine(subject, matrix, (width, height)), background)
+        frame = cv2.convertScaleAbs(frame, alpha=1.0, beta=15 * np.sin(0.3 * t))
+        yield np.clip(frame + rng.normal(0, 2, frame.shape), 0, 255).astype(np.uint8)
+
+def synthetic_video(video_dir, frames, width, height):
+    """Path of a generated MJPG .avi at 30 fps, written on first use and reused afterwards."""
+    path = os.path.join(video_dir, f"face_{frames}f_{width}x{height}.avi")
+    if not os.path.exists(path):
+        os.makedirs(video_dir, exist_ok=True)
+        temp_path = path + ".tmp.avi"
+        writer = cv2.VideoWriter(temp_path, cv2.VideoWriter_fourcc(*"MJPG"), 30, (width, height))
+        for frame in synthetic_frames(frames, width, height):
+            writer.write(frame)
+        writer.release()
+        os.replace(temp_path, path)
+    return path
+
+def create_gru_model(input_shape):
+    """create_gru_model from DeepLie.ipynb."""
+    import tensorflow as tf
+    layers = tf.keras.layers
+    X_input = layers.Input(shape=input_shape)
+    X = layers.Conv1D(filters=196, kernel_size=15, strides=4)(X_input)
+    X = layers.MaxPooling1D(pool_size=30, strides=15, padding='same')(X)
+    X = layers.BatchNormalization()(X)
+    X = layers.Activation("relu")(X)
+    X = layers.Dropout(rate=0.8)(X)
+    X = layers.GRU(units=128, return_sequences=True)(X)
+    X = layers.Dropout(rate=0.8)(X)
+    X = layers.BatchNormalization()(X)
+    X = layers.GRU(units=128, return_sequences=False)(X)
+    X = layers.Dropout(rate=0.8)(X)
+    X = layers.BatchNormalization()(X)
+    X = layers.Dropout(rate=0.8)(X)
+    X = layers.Dense(1, activation="sigmoid")(X)
+    return tf.keras.models.Model(inputs=X_input, outputs=X)
+
+def load_models(trained):
+    """(FER model, GRU model, mean_X, std_X): the trained files, or the same architectures with seeded weights."""
+    import tensorflow as tf
+    mean_X, std_X = np.load(MEAN_X_PATH), np.load(STD_X_PATH)
+    if trained:
+        custom_objects = {"categorical_crossentropy": tf.keras.losses.categorical_crossentropy}
+        return (tf.keras.models.load_model(FER_MODEL_PATH, custom_objects=custom_objects),
+                tf.keras.models.load_model(MAIN_MODEL_PATH), mean_X, std_X)
+    tf.keras.utils.set_random_seed(0)
+    with open(FER_ARCHITECTURE_PATH) as f:
+        fer_model = tf.keras.models.model_from_json(f.read())
+    return fer_model, create_gru_model((SEQUENCE_LENGTH, ENCODING_DIM)), mean_X, std_X
+
+class PeakMemory:
+    """Highest resident memory while the block runs, sampled every few milliseconds, relative to its start."""
+
+    def __init__(self, interval=0.005):
+        self.interval = interval
+        self.added_mb = None
+
+    def __enter__(self):
+        self.start_mb = current_rss_mb()
+        self.peak_mb = self.start_mb
+        self._stop = threading.Event()
+        self._thread = None
+        if self.start_mb is None:
+            self.start_mb = self.peak_mb = peak_rss_mb()  # No /proc: fall back to the process high-water mark
+        else:
+            self._thread = threading.Thread(target=self._sample, daemon=True)
+            self._thread.start()
+        return self
+
+    def _sample(self):
+        while not self._stop.wait(self.interval):
+            self.peak_mb = max(self.peak_mb, current_rss_mb())
+
+    def __exit__(self, *exc_info):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self.peak_mb = max(self.peak_mb, current_rss_mb())
+        else:
+            self.peak_mb = peak_rss_mb()
+        self.added_mb = self.peak_mb - self.start_mb
+
+def measure(fn, repeats, items=1):
+    """
+    Time fn() repeats times after one untimed warm-up call. items is the number of frames (or
+    sequences) one call processes, for the throughput column.
+    """
+    fn()
+    times = []
+    with PeakMemory() as memory:
+        for _ in range(repeats):
+            start = time.perf_counter()
+            fn()
+            times.append(time.perf_counter() - start)
+    p50, p95 = np.percentile(times, [50, 95])
+    return {
+        "p50_ms": p50 * 1000,
+        "p95_ms": p95 * 1000,
+        "items_per_second": items / p50,
+        "peak_rss_added_mb": memory.added_mb,
+        "repeats": repeats,
+    }
+
+def video_label(frames, width, height):
+    return f"{frames}f@{width}x{height}"
+
+def bench_process_video(context, results):
+    from MediaPipeCropping import process_video
+    output_dir = tempfile.mkdtemp(prefix="deeplie-bench-frames-")
+    try:
+        for frames, width, height, path in context["videos"]:
+            results[f"process_video[{video_label(frames, width, height)}]"] = measure(
+                lambda: process_video(path, output_dir), context["repeats"], frames)
+    finally:
+        shutil.rmtree(output_dir, ignore_errors=True)
+
+def bench_fer(context, results):
+    frames = context["frames"]
+    results["fer[300 frames]"] = measure(lambda: context["fer_engine"].run(frames), context["repeats"], len(frames))
+
+def bench_gru(context, results):
+    sequence = context["sequences"][:1]
+    results["gru[1x300x4608]"] = measure(lambda: context["gru_model"].predict(sequence, verbose=0),
+                                         context["repeats"], 1)
+
+def bench_predict(context, results):
+    from DeepLie import predict
+    for frames, width, height, path in context["videos"]:
+        results[f"predict[{video_label(frames, width, height)}]"] = measure(
+            lambda: predict(path, context["fer_engine"], context["gru_model"], context["mean_X"], context["std_X"]),
+            context["repeats"], frames)
+
+def bench_alignment(context, results):
+    from MediaPipeCropping import FaceTracker, crop_face_from_landmarks, initialize_face_mesh
+    frames = list(synthetic_frames(90, 640, 360, seed=1))
+    face_mesh = initialize_face_mesh()
+    try:
+        tracker = FaceTracker(face_mesh, keyframe_interval=1)
+        landmarks = next(landmarks for landmarks in map(tracker.update, frames) if landmarks is not None)
+        results["alignment[crop_face_from_landmarks]"] = measure(
+            lambda: [crop_face_from_landmarks(frame, landmarks) for frame in frames], context["repeats"], len(frames))
+        for interval in (1, 5):
+            def track(interval=interval):
+                tracker = FaceTracker(face_mesh, keyframe_interval=interval)
+                for frame in frames:
+                    tracker.update(frame)
+            results[f"alignment[landmarks keyframe_interval={interval}]"] = measure(
+                track, context["repeats"], len(frames))
+    finally:
+        face_mesh.close()
+
+def bench_ssim_dedup(context, results):
+    from dedup_benchmark import synthetic_sequences
+    from FrameDeduplication import FrameDeduplicator
+    for name, crops in synthetic_sequences().items():
+        def deduplicate(crops=crops):
+            deduplicator = FrameDeduplicator()
+            for face_crop in crops:
+                deduplicator.accept(face_crop)
+        results[f"ssim_dedup[{name}]"] = measure(deduplicate, context["repeats"], len(crops))
+
+def bench_batching(context, results):
+    from InferenceEngine import FERInferenceEngine
+    frames = context["frames"]
+    for batch_size in (32, 100, 300):
+        engine = FERInferenceEngine(context["fer_model"], batch_size=batch_size)
+        results[f"batching[fer batch={batch_size}]"] = measure(lambda: engine.run(frames), context["repeats"],
+                                                              len(frames))
+    for batch_size in (1, 4, 8):
+        sequences = context["sequences"][:batch_size]
+        results[f"batching[gru batch={batch_size}]"] = measure(
+            lambda: context["gru_model"].predict(sequences, verbose=0), context["repeats"], batch_size)
+
+BENCHMARK_FUNCTIONS = {
+    "process_video": bench_process_video,
+    "fer": bench_fer,
+    "gru": bench_gru,
+    "predict": bench_predict,
+    "alignment": bench_alignment,
+    "ssim_dedup": bench_ssim_dedup,
+    "batching": bench_batching,
+}
+
+def machine_info():
+    return {"platform": platform.platform(), "processor": platform.processor() or platform.machine(),
+            "cpu_count": os.cpu_count(), "python": platform.python_version()}
+
+def compare(results, baseline, tolerance):
+    """Regression messages for cases whose p50 latency or peak memory grew by more than tolerance."""
+    regressions = []
+    for name, current in results.items():
+        previous = baseline["results"].get(name)
+        if previous is None:
+            continue
+        if current["p50_ms"] > previous["p50_ms"] * (1 + tolerance):
+            regressions.append(f"{name}: p50 {previous['p50_ms']:.1f} ms -> {current['p50_ms']:.1f} ms "
+                               f"({current['p50_ms'] / previous['p50_ms'] - 1:+.0%})")
+        added, previous_added = current["peak_rss_added_mb"], previous["peak_rss_added_mb"]
+        if added > max(previous_added * (1 + tolerance), previous_added + MEMORY_NOISE_MB):
+            regressions.append(f"{name}: peak memory +{previous_added:.0f} MB -> +{added:.0f} MB")
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--only", nargs="+", choices=BENCHMARKS, default=list(BENCHMARKS), help="Benchmarks to run")
+    parser.add_argument("--quick", action="store_true", help="One short video and fewer repeats (for CI)")
+    parser.add_argument("--repeats", type=int, help="Timed runs per case")
+    parser.add_argument("--video-dir", default=os.path.join(tempfile.gettempdir(), "deeplie-bench-videos"),
+                        help="Where generated videos are kept between runs")
+    parser.add_argument("--trained-models", action="store_true", help="Load the trained .keras files")
+    parser.add_argument("--json", help="Write the results to this file")
+    parser.add_argument("--save-baseline", help="Write the results as a baseline to this file")
+    parser.add_argument("--baseline", help="Compare with this baseline and exit 1 on regressions")
+    parser.add_argument("--tolerance", type=float, default=DEFAULT_TOLERANCE)
+    args = parser.parse_args()
+
+    from InferenceEngine import FERInferenceEngine, preprocess_frames
+    fer_model, gru_model, mean_X, std_X = load_models(args.trained_models)
+    rng = np.random.default_rng(0)
+    context = {
+        "repeats": args.repeats or (QUICK_REPEATS if args.quick else DEFAULT_REPEATS),
+        "videos": [(frames, width, height, synthetic_video(args.video_dir, frames, width, height))
+                   for frames, width, height in (QUICK_VIDEO_CASES if args.quick else VIDEO_CASES)],
+        "fer_model": fer_model,
+        "fer_engine": FERInferenceEngine(fer_model),
+        "gru_model": gru_model,
+        "mean_X": mean_X,
+        "std_X": std_X,
+        "frames": preprocess_frames(list(synthetic_frames(SEQUENCE_LENGTH, 128, 128)), mean_X, std_X),
+        "sequences": rng.random((8, SEQUENCE_LENGTH, ENCODING_DIM), dtype=np.float32),
+    }
+
+    results = {}
+    print(f"{'case':<48}{'p50 ms':>10}{'p95 ms':>10}{'items/s':>10}{'+RSS MB':>9}")
+    for name in args.only:
+        start = len(results)
+        BENCHMARK_FUNCTIONS[name](context, results)
+        for case, result in list(results.items())[start:]:
+            print(f"{case:<48}{result['p50_ms']:>10.1f}{result['p95_ms']:>10.1f}"
+                  f"{result['items_per_second']:>10.1f}{result['peak_rss_added_mb']:>9.0f}")
+
+    report = {"machine": machine_info(), "trained_models": args.trained_models, "results": results}
+    for path in (args.json, args.save_baseline):
+        if path:
+            with open(path, "w") as f:
+                json.dump(report, f, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        if baseline.get("machine") != report["machine"] or baseline.get("trained_models") != args.trained_models:
+            print(f"Warning: {args.baseline} was recorded with a different machine or models; "
+                  f"differences may not be regressions.")
+        regressions = compare(results, baseline, args.tolerance)
+        if regressions:
+            print(f"\nPERFORMANCE REGRESSION against {args.baseline} (tolerance {args.tolerance:.0%}):")
+            for message in regressions:
+                print(f"  {message}")
+            sys.exit(1)
+        print(f"\nNo regressions against {args.baseline}.")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,129 @@
+"""
+Accuracy-parity and throughput report for the TFLite backends against the float Keras models.
+
+For every converted quantization mode it compares, on the same normalized frames:
+emotion argmax agreement and softmax error of the FER CNN, relative error of the encodings,
+and the end-to-end deception score (FER encodings fed to the GRU) against the Keras pipeline.
+Throughput is FER frames/s in batches of 300 and GRU sequences/s.
+
+Convert the models first (python QuantizedInference.py --mode ...), then run from model/src:
+    python ../benchmarks/quantization_report.py [--modes dynamic int8] [--video PATH] [--json report.json]
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+import numpy as np
+import tensorflow as tf
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+
+from constants import FER_MODEL_PATH, MAIN_MODEL_PATH, MEAN_X_PATH, STD_X_PATH
+from InferenceEngine import FERInferenceEngine, preprocess_frames
+from QuantizedInference import (QUANTIZATION_MODES, TFLiteFERInferenceEngine, TFLiteSequenceClassifier,
+                                representative_frames, tflite_model_path)
+
+def evaluation_frames(mean_X, std_X, count, video_path=None):
+    """Held-out synthetic frames (a different seed than calibration), plus a video's face crops if given."""
+    frames = [representative_frames(mean_X, std_X, count, seed=1)]
+    if video_path:
+        from MediaPipeCropping import extract_face_crops
+        _, crops = extract_face_crops(video_path)
+        frames.append(preprocess_frames(crops, mean_X, std_X))
+    return np.concatenate(frames)
+
+def best_time(fn, repeats):
+    """Fastest of several timed calls, after one untimed warm-up call."""
+    fn()
+    times = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+def evaluate(fer_engine, main_model, frames, sequence_indices, repeats):
+    """Outputs and throughput of one backend."""
+    emotion_preds, encodings = fer_engine.run(frames)
+    sequences = encodings[sequence_indices]
+    scores = main_model.predict(sequences, verbose=0)[:, 0]
+    batch = frames[:300]
+    fer_time = best_time(lambda: fer_engine.run(batch), repeats)
+    gru_time = best_time(lambda: main_model.predict(sequences[:1], verbose=0), repeats)
+    return {
+        "emotion_preds": emotion_preds,
+        "encodings": encodings,
+        "scores": scores,
+        "fer_frames_per_second": len(batch) / fer_time,
+        "gru_sequences_per_second": 1 / gru_time,
+    }
+
+def compare(reference, candidate):
+    """Parity metrics of a candidate backend against the float reference."""
+    encoding_error = (np.linalg.norm(candidate["encodings"] - reference["encodings"], axis=1)
+                      / (np.linalg.norm(reference["encodings"], axis=1) + 1e-8))
+    score_delta = np.abs(candidate["scores"] - reference["scores"])
+    return {
+        "emotion_argmax_agreement": float(np.mean(candidate["emotion_preds"].argmax(1)
+                                                  == reference["emotion_preds"].argmax(1))),
+        "emotion_max_abs_error": float(np.abs(candidate["emotion_preds"] - reference["emotion_preds"]).max()),
+        "encoding_mean_relative_error": float(encoding_error.mean()),
+        "score_mean_abs_delta": float(score_delta.mean()),
+        "score_max_abs_delta": float(score_delta.max()),
+        "label_agreement": float(np.mean((candidate["scores"] > 0.5) == (reference["scores"] > 0.5))),
+        "fer_speedup": candidate["fer_frames_per_second"] / reference["fer_frames_per_second"],
+        "gru_speedup": candidate["gru_sequences_per_second"] / reference["gru_sequences_per_second"],
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--modes", nargs="+", choices=QUANTIZATION_MODES, default=list(QUANTIZATION_MODES))
+    parser.add_argument("--frames", type=int, default=600, help="Synthetic evaluation frames")
+    parser.add_argument("--sequences", type=int, default=8, help="300-frame sequences scored by the GRU")
+    parser.add_argument("--video", help="Also evaluate on this video's face crops")
+    parser.add_argument("--repeats", type=int, default=5)
+    parser.add_argument("--json", help="Write the report to this file")
+    args = parser.parse_args()
+
+    custom_objects = {"categorical_crossentropy": tf.keras.losses.categorical_crossentropy}
+    fer_model = tf.keras.models.load_model(FER_MODEL_PATH, custom_objects=custom_objects)
+    main_model = tf.keras.models.load_model(MAIN_MODEL_PATH)
+    mean_X, std_X = np.load(MEAN_X_PATH), np.load(STD_X_PATH)
+
+    frames = evaluation_frames(mean_X, std_X, args.frames, args.video)
+    sequence_length = main_model.inputs[0].shape[1]
+    rng = np.random.default_rng(2)
+    sequence_indices = np.sort(rng.integers(0, len(frames), (args.sequences, sequence_length)), axis=1)
+
+    reference = evaluate(FERInferenceEngine(fer_model), main_model, frames, sequence_indices, args.repeats)
+    report = {"keras": {"fer_frames_per_second": reference["fer_frames_per_second"],
+                        "gru_sequences_per_second": reference["gru_sequences_per_second"]}}
+
+    print(f"{'backend':<16}{'FER f/s':>10}{'GRU seq/s':>11}{'argmax agree':>14}{'max dP':>9}"
+          f"{'enc rel err':>13}{'mean dScore':>13}{'max dScore':>12}{'labels':>8}")
+    print(f"{'keras float32':<16}{reference['fer_frames_per_second']:>10.0f}"
+          f"{reference['gru_sequences_per_second']:>11.1f}")
+    for mode in args.modes:
+        fer_path, main_path = tflite_model_path(FER_MODEL_PATH, mode), tflite_model_path(MAIN_MODEL_PATH, mode)
+        if not (os.path.exists(fer_path) and os.path.exists(main_path)):
+            print(f"{'tflite ' + mode:<16}  not converted; run python QuantizedInference.py --mode {mode}")
+            continue
+        candidate = evaluate(TFLiteFERInferenceEngine(fer_path), TFLiteSequenceClassifier(main_path),
+                             frames, sequence_indices, args.repeats)
+        metrics = compare(reference, candidate)
+        report[f"tflite-{mode}"] = {"fer_frames_per_second": candidate["fer_frames_per_second"],
+                                    "gru_sequences_per_second": candidate["gru_sequences_per_second"], **metrics}
+        print(f"{'tflite ' + mode:<16}{candidate['fer_frames_per_second']:>10.0f}"
+              f"{candidate['gru_sequences_per_second']:>11.1f}{metrics['emotion_argmax_agreement']:>13.1%}"
+              f"{metrics['emotion_max_abs_error']:>10.4f}{metrics['encoding_mean_relative_error']:>13.4f}"
+              f"{metrics['score_mean_abs_delta']:>13.4f}{metrics['score_max_abs_delta']:>12.4f}"
+              f"{metrics['label_agreement']:>8.0%}")
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(report, f, indent=2)
+
+if __name__ == "__main__":
+    main()
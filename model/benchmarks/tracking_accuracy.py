@@ -0,0 +1,109 @@
+"""
+How far landmark tracking between Face Mesh keyframes (MediaPipeCropping.FaceTracker with
+keyframe_interval > 1) moves the pipeline's output from running Face Mesh on every frame, which is
+how the GRU's training crops were made.
+
+For each keyframe interval it reports, against keyframe_interval=1 on the same frames:
+  landmarks   mean and max distance (pixels) of the 478 landmarks, and the Face Mesh calls made
+  crops       mean absolute difference (gray levels) of the aligned 128x128 crops
+  score       deception score of the 300 sampled crops with the benchmark suite's seeded models
+              (see pipeline_benchmark.py), or the trained ones with --trained-models
+
+Usage (from model/src):
+    python ../benchmarks/tracking_accuracy.py [--intervals 2 5 10] [--json out.json]
+    python ../benchmarks/tracking_accuracy.py --trained-models --videos ../data/MU3D/Videos/BF001_1PT.wmv
+"""
+import argparse
+import json
+import os
+import sys
+import tempfile
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from pipeline_benchmark import load_models, synthetic_video
+
+DEFAULT_INTERVALS = [2, 5, 10]
+
+def track_video(path, keyframe_interval):
+    """(landmarks per frame (None without a face), aligned crops per frame, Face Mesh calls) of a video."""
+    import cv2
+    from MediaPipeCropping import FaceTracker, crop_face_from_landmarks, initialize_face_mesh
+    video = cv2.VideoCapture(path)
+    face_mesh = initialize_face_mesh()
+    tracker = FaceTracker(face_mesh, keyframe_interval)
+    landmarks, crops = [], []
+    try:
+        while True:
+            ret, frame = video.read()
+            if not ret:
+                break
+            frame_landmarks = tracker.update(frame)
+            landmarks.append(frame_landmarks)
+            crops.append(None if frame_landmarks is None else crop_face_from_landmarks(frame, frame_landmarks))
+    finally:
+        video.release()
+        face_mesh.close()
+    return landmarks, crops, tracker.detections
+
+def deception_score(path, keyframe_interval, fer_engine, gru_model, mean_X, std_X):
+    """Score of DeepLie's cropping, encoding and GRU steps on a video with the given keyframe interval."""
+    from DeepLie import NUM_FRAMES, SSIM_THRESHOLD
+    from InferenceEngine import preprocess_frames
+    from MediaPipeCropping import extract_face_crops
+    _, frames = extract_face_crops(path, NUM_FRAMES, SSIM_THRESHOLD, keyframe_interval)
+    _, encodings = fer_engine.run(preprocess_frames(frames, mean_X, std_X))
+    return float(gru_model.predict(encodings[np.newaxis], verbose=0)[0][0])
+
+def compare(reference, tracked):
+    """Landmark and crop differences on the frames where both runs found the face."""
+    (ref_landmarks, ref_crops, _), (landmarks, crops, detections) = reference, tracked
+    both = [idx for idx in range(len(ref_landmarks)) if ref_landmarks[idx] is not None and landmarks[idx] is not None
+            and ref_crops[idx] is not None and crops[idx] is not None]
+    distances = np.concatenate([np.linalg.norm(landmarks[idx] - ref_landmarks[idx], axis=1) for idx in both])
+    crop_diffs = [np.abs(crops[idx].astype(np.float32) - ref_crops[idx].astype(np.float32)).mean() for idx in both]
+    return {"frames_compared": len(both), "face_mesh_calls": detections,
+            "landmark_mean_px": float(distances.mean()), "landmark_max_px": float(distances.max()),
+            "crop_mean_abs_diff": float(np.mean(crop_diffs)), "crop_max_abs_diff": float(np.max(crop_diffs))}
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--videos", nargs="+", help="Videos to evaluate (default: a generated 300-frame face video)")
+    parser.add_argument("--intervals", nargs="+", type=int, default=DEFAULT_INTERVALS, help="Keyframe intervals to compare")
+    parser.add_argument("--video-dir", default=os.path.join(tempfile.gettempdir(), "deeplie-bench-videos"),
+                        help="Where generated videos are cached")
+    parser.add_argument("--trained-models", action="store_true", help="Load the trained .keras files")
+    parser.add_argument("--json", help="Write the results to this file")
+    args = parser.parse_args()
+
+    from InferenceEngine import FERInferenceEngine
+    fer_model, gru_model, mean_X, std_X = load_models(args.trained_models)
+    fer_engine = FERInferenceEngine(fer_model)
+
+    videos = args.videos or [synthetic_video(args.video_dir, 300, 640, 360)]
+    results = {}
+    print(f"{'video':<24}{'interval':>9}{'FM calls':>10}{'lm mean':>9}{'lm max':>8}{'crop':>7}{'score':>8}{'dScore':>8}")
+    for path in videos:
+        video = os.path.splitext(os.path.basename(path))[0]
+        reference = track_video(path, 1)
+        reference_score = deception_score(path, 1, fer_engine, gru_model, mean_X, std_X)
+        results[video] = {"1": {"face_mesh_calls": reference[2], "score": reference_score}}
+        print(f"{video:<24}{1:>9}{reference[2]:>10}{'':>9}{'':>8}{'':>7}{reference_score:>8.3f}")
+        for interval in args.intervals:
+            row = compare(reference, track_video(path, interval))
+            row["score"] = deception_score(path, interval, fer_engine, gru_model, mean_X, std_X)
+            row["score_delta"] = abs(row["score"] - reference_score)
+            results[video][str(interval)] = row
+            print(f"{'':<24}{interval:>9}{row['face_mesh_calls']:>10}{row['landmark_mean_px']:>9.2f}"
+                  f"{row['landmark_max_px']:>8.2f}{row['crop_mean_abs_diff']:>7.2f}{row['score']:>8.3f}"
+                  f"{row['score_delta']:>8.3f}")
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,109 @@
+"""
+Throughput of the tf.data training pipelines (TrainingPipeline.py) against the per-frame Python
+augmentation of HOF_100.ipynb, and the input-pipeline stall while the FER CNN and the GRU train.
+
+  augmentation   images/s of apply_augmentations looped over the frames, and of fer_dataset
+                 iterated on its own (prepare, shuffle, batched augmentation, normalization)
+  fer_training   one epoch of the fer.json architecture on fer_dataset
+  gru_training   one epoch of create_gru_model on sequence_dataset over (300, 4608) sequences
+The training cases report the epoch time and how much of it was spent waiting for input.
+
+Usage (from model/src):
+    python ../benchmarks/training_pipeline_benchmark.py [--images 4096] [--sequences 64] [--json out.json]
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import time
+
+import cv2
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from pipeline_benchmark import ENCODING_DIM, FER_ARCHITECTURE_PATH, SEQUENCE_LENGTH, create_gru_model
+
+def apply_augmentations(frame):
+    """apply_augmentations from HOF_100.ipynb, with the noise kept signed."""
+    if random.random() < 0.5:
+        frame = cv2.flip(frame, 1)
+    if random.random() < 0.5:
+        frame = np.clip(frame * random.uniform(0.8, 1.2), 0, 255).astype(np.uint8)
+    if random.random() < 0.5:
+        frame = np.clip(frame + np.random.normal(0, 10, frame.shape), 0, 255).astype(np.uint8)
+    if random.random() < 0.5:
+        h, w = frame.shape[:2]
+        frame = cv2.warpAffine(frame, cv2.getRotationMatrix2D((w // 2, h // 2), random.uniform(-10, 10), 1), (w, h))
+    return frame
+
+def python_loop(images, labels, mean_X, std_X, batch_size):
+    """The notebooks' way: augment and normalize frame by frame, then stack the batches."""
+    order = np.random.permutation(len(images))
+    for start in range(0, len(order), batch_size):
+        batch = [apply_augmentations(images[idx]) for idx in order[start:start + batch_size]]
+        yield (np.stack(batch).reshape(-1, 48, 48, 1) - mean_X) / std_X, labels[order[start:start + batch_size]]
+
+def images_per_second(batches):
+    start = time.perf_counter()
+    count = sum(len(x) for x, _ in batches)
+    return count / (time.perf_counter() - start)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--images", type=int, default=4096, help="Synthetic 48x48 training images")
+    parser.add_argument("--sequences", type=int, default=64, help="Synthetic (300, 4608) training sequences")
+    parser.add_argument("--batch-size", type=int, default=64)
+    parser.add_argument("--json", help="Write the results to this file")
+    args = parser.parse_args()
+
+    import tensorflow as tf
+    from FeatureStore import Features
+    from TrainingPipeline import fer_dataset, sequence_dataset, train
+
+    rng = np.random.default_rng(0)
+    images = rng.integers(0, 256, (args.images, 48, 48), dtype=np.uint8)
+    labels = np.eye(7, dtype=np.float32)[rng.integers(0, 7, args.images)]
+    mean_X, std_X = np.full((48, 48, 1), 128, np.float32), np.full((48, 48, 1), 60, np.float32)
+    results = {}
+
+    dataset = fer_dataset(images[..., np.newaxis], labels, mean_X, std_X, args.batch_size, training=True)
+    images_per_second(dataset)  # Fills the cache
+    results["augmentation"] = {
+        "python_loop_images_per_second": images_per_second(python_loop(images, labels, mean_X, std_X, args.batch_size)),
+        "tf_data_images_per_second": images_per_second(dataset),
+    }
+    print(f"augmentation   python loop {results['augmentation']['python_loop_images_per_second']:>9.0f} images/s"
+          f"   tf.data {results['augmentation']['tf_data_images_per_second']:>9.0f} images/s")
+
+    tf.keras.utils.set_random_seed(0)
+    with open(FER_ARCHITECTURE_PATH) as f:
+        fer_model = tf.keras.models.model_from_json(f.read())
+    fer_model.compile(loss="categorical_crossentropy", optimizer="adam", metrics=["accuracy"])
+    train(fer_model, dataset.take(2), epochs=1, log=None)  # Traces the train step
+    epoch = train(fer_model, dataset, epochs=1, log=None)[0]
+    results["fer_training"] = epoch
+
+    encodings = rng.normal(size=(args.sequences, SEQUENCE_LENGTH, ENCODING_DIM)).astype(np.float32)
+    sequence_labels = rng.integers(0, 2, args.sequences)
+    features = Features([str(idx) for idx in range(args.sequences)], ["S"] * args.sequences, encodings, None,
+                        sequence_labels, sequence_labels)
+    gru_model = create_gru_model((SEQUENCE_LENGTH, ENCODING_DIM))
+    gru_model.compile(loss="binary_crossentropy", optimizer="adam", metrics=["accuracy"])
+    sequences = sequence_dataset(features, args.batch_size, training=True)
+    train(gru_model, sequences.take(1), epochs=1, log=None)
+    results["gru_training"] = train(gru_model, sequences, epochs=1, log=None)[0]
+
+    for name in ("fer_training", "gru_training"):
+        epoch = results[name]
+        print(f"{name:<14} {epoch['steps']:>4} steps in {epoch['seconds']:.2f} s, waiting for input"
+              f" {epoch['input_stall_seconds']:.3f} s ({epoch['input_stall_seconds'] / epoch['seconds']:.1%})")
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+
+if __name__ == "__main__":
+    main()
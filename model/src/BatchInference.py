@@ -0,0 +1,292 @@
+"""
+Offline scoring of many videos, e.g. a folder of interview recordings, without going through /api/predict.
+
+Face cropping runs in a pool of CPU worker processes, several videos ahead of inference. The crops of
+--batch-size videos are then encoded by the FER CNN together and the GRU scores the stacked
+(batch, 300, 4608) sequences in one call, so model overhead is paid per batch rather than per video.
+Rows go to a CSV, JSONL or Parquet file (picked by extension) as batches finish.
+
+Run from model/src:
+    python BatchInference.py VIDEO_OR_DIR [...] --output results.csv [--batch-size 8] [--workers N]
+"""
+import argparse
+import csv
+import json
+import multiprocessing
+import os
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from constants import EMOTION_LABELS
+from MediaPipeCropping import extract_face_crops
+
+VIDEO_EXTENSIONS = (".avi", ".mkv", ".mov", ".mp4", ".webm", ".wmv")
+
+# Videos per crop worker cropped ahead of inference (and at least one batch); bounds the crops held in memory
+CROP_PREFETCH_PER_WORKER = 2
+
+DEFAULT_VIDEO_BATCH_SIZE = 8
+
+RESULT_FORMATS = (".csv", ".jsonl", ".parquet")
+RESULT_COLUMNS = ["video", "status", "result", "confidence", "score", "cached", "error"]
+
+def default_crop_workers():
+    """One crop process per core, leaving one core for inference."""
+    return max(1, (os.cpu_count() or 2) - 1)
+
+def find_videos(inputs, recursive=False):
+    """Video files among inputs, expanding directories (recursively if asked) in sorted order."""
+    videos = []
+    for path in inputs:
+        if not os.path.isdir(path):
+            videos.append(path)
+            continue
+        if recursive:
+            found = [os.path.join(root, name) for root, _, names in os.walk(path) for name in names]
+        else:
+            found = [os.path.join(path, name) for name in os.listdir(path)]
+        videos += sorted(name for name in found if name.lower().endswith(VIDEO_EXTENSIONS))
+    return videos
+
+def crop_video(video_path, preprocessing):
+    """
+    Worker body: (video_path, (num_frames, 128, 128, 3) crops or None, error message or None).
+    preprocessing is DeepLie.PREPROCESSING_PARAMS, the same dict that goes into the cache key.
+    """
+    if not os.path.isfile(video_path):
+        return video_path, None, "Video file not found."
+    try:
+        _, frames = extract_face_crops(video_path, target_frames=preprocessing["num_frames"],
+                                       ssim_threshold=preprocessing["ssim_threshold"],
+                                       keyframe_interval=preprocessing["keyframe_interval"],
+                                       drift_threshold=preprocessing["drift_threshold"],
+                                       decode_oversample=preprocessing["decode_oversample"])
+    except Exception as e:
+        return video_path, None, str(e)
+    if len(frames) == 0:
+        return video_path, None, "No faces detected in the video."
+    return video_path, frames, None
+
+def iter_crops(video_paths, preprocessing, workers, prefetch=0):
+    """
+    Yield crop_video results in input order. With workers > 0 the videos are cropped in that many
+    spawned processes, up to max(prefetch, CROP_PREFETCH_PER_WORKER * workers) videos ahead of the
+    consumer, so cropping continues while it runs inference; with 0 they are cropped in this process.
+    """
+    if workers <= 0:
+        for video_path in video_paths:
+            yield crop_video(video_path, preprocessing)
+        return
+
+    remaining = iter(video_paths)
+    with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn")) as pool:
+        pending = deque()
+
+        def submit_next():
+            video_path = next(remaining, None)
+            if video_path is not None:
+                pending.append(pool.submit(crop_video, video_path, preprocessing))
+
+        for _ in range(max(prefetch, workers * CROP_PREFETCH_PER_WORKER)):
+            submit_next()
+        while pending:
+            result = pending.popleft().result()
+            submit_next()
+            yield result
+
+def iter_batches(items, batch_size):
+    """Group an iterable into lists of at most batch_size items."""
+    batch = []
+    for item in items:
+        batch.append(item)
+        if len(batch) == batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+def encode_batch(crops, fer_engine, mean_X, std_X):
+    """
+    One FER pass over the frames of several videos' crops.
+    Returns per-video lists of frames_processed, emotion_preds and (frames, 4608) encodings.
+    """
+    from InferenceEngine import preprocess_frames
+    frames_processed = preprocess_frames(np.concatenate(crops), mean_X, std_X)
+    emotion_preds, encodings = fer_engine.run(frames_processed)
+    splits = np.cumsum([len(frames) for frames in crops])[:-1]
+    return np.split(frames_processed, splits), np.split(emotion_preds, splits), np.split(encodings, splits)
+
+def score_batch(crops, fer_engine, main_model, mean_X, std_X):
+    """
+    Run several videos' crops through the models together: one FER pass over all their frames and
+    one GRU call over the stacked (videos, frames, 4608) encodings.
+    Returns per-video (frames_processed, emotion_preds, encodings) lists and the (videos,) scores.
+    """
+    frames_processed, emotion_preds, encodings = encode_batch(crops, fer_engine, mean_X, std_X)
+    sequences = np.stack(encodings)
+    scores = main_model.predict(sequences, verbose=0)[:, 0]
+    return (frames_processed, emotion_preds, list(sequences)), scores
+
+def result_row(video_path, result=None, error=None, cached=False):
+    """One output row from an /api/predict style result payload, or from the error that stopped the video."""
+    row = {"video": video_path, "status": "failed" if error else "done", "result": None, "confidence": None,
+           "score": None, "cached": cached, "error": error,
+           "emotions": {label: 0.0 for label in EMOTION_LABELS}}
+    if result is not None:
+        row.update(result=result["result"], confidence=result["confidence"], score=result["prediction"][0][0])
+        row["emotions"].update({emotion["name"]: emotion["value"] for emotion in result["emotions"]})
+    return row
+
+def flatten_row(row):
+    """Row with the emotion percentages as emotion_<label> columns, for tabular formats."""
+    flat = {column: row[column] for column in RESULT_COLUMNS}
+    flat.update({f"emotion_{label.lower()}": value for label, value in row["emotions"].items()})
+    return flat
+
+class ResultWriter:
+    """
+    Writes result rows to a .csv, .jsonl or .parquet file. CSV and JSONL rows are flushed as they
+    are written, so an interrupted run keeps its finished videos; Parquet (which needs pandas with
+    pyarrow or fastparquet) is written on close.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.format = os.path.splitext(path)[1].lower()
+        if self.format not in RESULT_FORMATS:
+            raise ValueError(f"Unsupported results file {path}; use one of {', '.join(RESULT_FORMATS)}")
+        self._rows = []
+        self._file = None if self.format == ".parquet" else open(path, "w", newline="")
+        self._csv = None
+        if self.format == ".csv":
+            fields = RESULT_COLUMNS + [f"emotion_{label.lower()}" for label in EMOTION_LABELS]
+            self._csv = csv.DictWriter(self._file, fieldnames=fields)
+            self._csv.writeheader()
+
+    def write(self, row):
+        if self.format == ".csv":
+            self._csv.writerow(flatten_row(row))
+        elif self.format == ".jsonl":
+            self._file.write(json.dumps(row) + "\n")
+        else:
+            self._rows.append(flatten_row(row))
+            return
+        self._file.flush()
+
+    def close(self):
+        if self.format == ".parquet":
+            import pandas as pd
+            pd.DataFrame(self._rows).to_parquet(self.path, index=False)
+        else:
+            self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+def run_batch(video_paths, writer, batch_size=DEFAULT_VIDEO_BATCH_SIZE, workers=None, backend=None,
+              use_cache=True, log=print):
+    """
+    Score video_paths and write one row per video. Uses the server's models, preprocessing parameters
+    and, if enabled, its result cache, so videos already analysed by either are not processed again
+    and results computed here are served by /api/predict.
+    Returns a summary with counts and throughput.
+    """
+    import DeepLie
+    from ResultCache import cache_key, hash_file
+    from Visualization import select_tiles
+
+    backend = backend or DeepLie.INFERENCE_BACKEND
+    workers = default_crop_workers() if workers is None else workers
+    cache = DeepLie.result_cache if use_cache else None
+    started = time.perf_counter()
+    summary = {"videos": len(video_paths), "done": 0, "failed": 0, "cached": 0}
+
+    def write(row):
+        writer.write(row)
+        summary[row["status"]] += 1
+        summary["cached"] += row["cached"]
+
+    keys, uncached = {}, []
+    for video_path in video_paths:
+        if cache is not None:
+            try:
+                keys[video_path] = cache_key(hash_file(video_path), DeepLie.analysis_params(backend),
+                                             DeepLie.model_registry.get("model_digest"))
+            except OSError as e:
+                write(result_row(video_path, error=str(e)))
+                continue
+            cached = cache.get(keys[video_path])
+            if cached is not None:
+                write(result_row(video_path, cached, cached=True))
+                continue
+        uncached.append(video_path)
+
+    # Models load once the first batch is cropped, so that an all-cached run never loads them
+    # and otherwise loading overlaps the first crops
+    models = None
+    # Cropped with the parameters the cache key records, so the server can serve these results
+    crops = iter_crops(uncached, DeepLie.PREPROCESSING_PARAMS, workers, prefetch=batch_size)
+    for batch in iter_batches(crops, batch_size):
+        for video_path, _, error in batch:
+            if error is not None:
+                write(result_row(video_path, error=error))
+        batch = [(video_path, frames) for video_path, frames, error in batch if error is None]
+        if not batch:
+            continue
+
+        if models is None:
+            models = DeepLie.inference_models(backend) + DeepLie.model_registry.get("normalization")
+        fer_engine, main_model, mean_X, std_X = models
+        (frames_processed, emotion_preds, encodings), scores = score_batch(
+            [frames for _, frames in batch], fer_engine, main_model, mean_X, std_X)
+        for idx, (video_path, _) in enumerate(batch):
+            result = {
+                "prediction": [[float(scores[idx])]],
+                **DeepLie.format_prediction(float(scores[idx])),
+                "emotions": DeepLie.process_emotions(emotion_preds[idx]),
+                "time": "Analysis Complete",
+            }
+            if video_path in keys:
+                tiles = select_tiles(frames_processed[idx], emotion_preds[idx], encodings[idx])
+                cache.put(keys[video_path], result, encodings[idx],
+                          arrays={"tile_" + name: array for name, array in tiles.items()})
+            write(result_row(video_path, result))
+
+        elapsed = time.perf_counter() - started
+        finished = summary["done"] + summary["failed"]
+        log(f"{finished}/{len(video_paths)} videos, {finished / elapsed:.2f} videos/s")
+
+    summary["seconds"] = time.perf_counter() - started
+    summary["videos_per_second"] = len(video_paths) / summary["seconds"] if summary["seconds"] else 0.0
+    return summary
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("inputs", nargs="+", help="Video files or directories of videos")
+    parser.add_argument("--output", "-o", required=True, help="Results file (.csv, .jsonl or .parquet)")
+    parser.add_argument("--recursive", "-r", action="store_true", help="Also search subdirectories")
+    parser.add_argument("--batch-size", type=int, default=DEFAULT_VIDEO_BATCH_SIZE, help="Videos per model call")
+    parser.add_argument("--workers", type=int, default=None,
+                        help="Crop processes (default: cores - 1; 0 crops in this process)")
+    parser.add_argument("--backend", choices=("keras", "tflite"), default=None,
+                        help="Inference backend (default: DEEPLIE_BACKEND or keras)")
+    parser.add_argument("--no-cache", action="store_true", help="Neither read nor fill the result cache")
+    args = parser.parse_args()
+
+    video_paths = find_videos(args.inputs, args.recursive)
+    if not video_paths:
+        parser.error("No videos found")
+    with ResultWriter(args.output) as writer:
+        summary = run_batch(video_paths, writer, max(1, args.batch_size), args.workers, args.backend,
+                            use_cache=not args.no_cache)
+    print(f"{summary['done']} scored ({summary['cached']} from cache), {summary['failed']} failed "
+          f"in {summary['seconds']:.1f}s ({summary['videos_per_second']:.2f} videos/s) -> {args.output}")
+
+if __name__ == "__main__":
+    main()
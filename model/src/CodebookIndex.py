@@ -0,0 +1,151 @@
+"""
+The MU3D codebook as in-memory tables behind the /api/codebook JSON API, so that clients fetch the
+rows they show instead of downloading and parsing the whole workbook.
+
+Each data sheet is parsed once, and again whenever the file's modification time or size changes,
+into JSON-ready rows and an index from every value of every column to the rows holding it. Filters
+are answered from the index; a query's ETag depends only on the file's contents and the query, so
+it can be checked before any rows are selected.
+"""
+import hashlib
+import json
+import math
+import os
+import threading
+
+from constants import MU3D_CODEBOOK_PATH, subject_of
+from ResultCache import hash_file
+
+# Sheets served, by the name requests use for them
+CODEBOOK_SHEETS = {"videos": "Video-Level Data", "targets": "Target-Level Data"}
+
+# Other names columns can be requested and filtered by, per sheet ("Subject" is added to the videos sheet)
+COLUMN_ALIASES = {"targets": {"subject": "TargetID"}}
+
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 500
+
+def value_key(value):
+    """
+    Index key of a cell: numbers by value (so 18.0 and 18 are the same), text ignoring case and
+    surrounding spaces, and empty cells as "".
+    """
+    if value is None:
+        return ""
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return str(int(value)) if float(value).is_integer() else repr(float(value))
+    return str(value).strip().lower()
+
+def query_key(text):
+    """Index key of a filter value given as text."""
+    try:
+        number = float(text)
+    except ValueError:
+        return value_key(text)
+    return value_key(number) if math.isfinite(number) else value_key(text)
+
+def json_value(value):
+    """A pandas cell as a JSON value: numpy scalars as Python numbers and NaN as None."""
+    if hasattr(value, "item"):
+        value = value.item()
+    if isinstance(value, float) and math.isnan(value):
+        return None
+    return value
+
+class CodebookTable:
+    """Rows of one sheet, as {column: value} dicts, with an index from each column's value keys to row numbers."""
+
+    def __init__(self, columns, rows, aliases=None):
+        self.columns = list(columns)
+        self.rows = rows
+        self._names = {column.lower(): column for column in self.columns}
+        self._names.update({alias.lower(): column for alias, column in (aliases or {}).items()})
+        self.index = {column: {} for column in self.columns}
+        for row_idx, row in enumerate(rows):
+            for column in self.columns:
+                self.index[column].setdefault(value_key(row[column]), []).append(row_idx)
+
+    @classmethod
+    def from_dataframe(cls, frame, aliases=None):
+        rows = [{column: json_value(value) for column, value in zip(frame.columns, values)}
+                for values in frame.itertuples(index=False)]
+        return cls(frame.columns, rows, aliases)
+
+    def column(self, name):
+        """The column called name (or an alias of it), ignoring case."""
+        try:
+            return self._names[name.strip().lower()]
+        except KeyError:
+            raise ValueError(f"Unknown column {name!r}; expected one of {', '.join(self.columns)}") from None
+
+    def normalize_query(self, columns=None, filters=None, offset=0, limit=DEFAULT_PAGE_SIZE):
+        """
+        A query with column names resolved, filter values as index keys and the page clamped to
+        0 <= offset and 1 <= limit <= MAX_PAGE_SIZE, as keyword arguments of select_page.
+        Raises ValueError for unknown columns.
+        """
+        normalized_filters = {}
+        for name, values in (filters or {}).items():
+            keys = normalized_filters.setdefault(self.column(name), set())
+            keys.update(query_key(value) for value in values)
+        return {
+            "columns": [self.column(name) for name in columns] if columns else list(self.columns),
+            "filters": {column: sorted(keys) for column, keys in sorted(normalized_filters.items())},
+            "offset": max(0, offset),
+            "limit": min(max(1, limit), MAX_PAGE_SIZE),
+        }
+
+    def select(self, filters):
+        """Numbers of the rows matching every filter ({column: value keys}, any key of which matches), in sheet order."""
+        selected = None
+        for column, keys in filters.items():
+            matching = set()
+            for key in keys:
+                matching.update(self.index[column].get(key, ()))
+            selected = matching if selected is None else selected & matching
+        return list(range(len(self.rows))) if selected is None else sorted(selected)
+
+    def select_page(self, columns, filters, offset, limit):
+        """One page of the rows matching a normalized query, with the number of matches as "total"."""
+        selected = self.select(filters)
+        rows = [{column: self.rows[row_idx][column] for column in columns} for row_idx in selected[offset:offset + limit]]
+        return {"columns": columns, "total": len(selected), "offset": offset, "limit": limit, "rows": rows}
+
+def load_tables(path):
+    """{sheet name: CodebookTable} of the codebook's CODEBOOK_SHEETS; the videos sheet gains a Subject column."""
+    import pandas as pd
+    sheets = pd.read_excel(path, sheet_name=list(CODEBOOK_SHEETS.values()))
+    videos = sheets[CODEBOOK_SHEETS["videos"]]
+    videos.insert(1, "Subject", videos["VideoID"].map(subject_of))
+    return {name: CodebookTable.from_dataframe(sheets[sheet], COLUMN_ALIASES.get(name))
+            for name, sheet in CODEBOOK_SHEETS.items()}
+
+def query_etag(version, sheet, query):
+    """ETag of a normalized query on a version of the codebook."""
+    return hashlib.sha256(json.dumps([version, sheet, query], sort_keys=True).encode()).hexdigest()[:32]
+
+class Codebook:
+    """
+    The codebook file's tables, parsed on first use and again whenever the file's modification
+    time or size changes. version is the sha256 digest of the parsed file.
+    """
+
+    def __init__(self, path=MU3D_CODEBOOK_PATH):
+        self.path = path
+        self.version = None
+        self.loads = 0
+        self._tables = None
+        self._signature = None
+        self._lock = threading.Lock()
+
+    def tables(self):
+        """({sheet name: CodebookTable}, version); raises FileNotFoundError if the file is missing."""
+        stat = os.stat(self.path)
+        signature = (stat.st_mtime_ns, stat.st_size)
+        with self._lock:
+            if signature != self._signature:
+                self._tables = load_tables(self.path)
+                self.version = hash_file(self.path)
+                self._signature = signature
+                self.loads += 1
+            return self._tables, self.version
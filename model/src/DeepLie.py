@@ -1,85 +1,205 @@
+import time
+startup_started = time.perf_counter()
+
 import os
 os.environ["KMP_DUPLICATE_LIB_OK"] = "TRUE"
 
-import tensorflow as tf
-import tensorflow.keras.backend as K
 import cv2
 import numpy as np
 import os
-from flask import Flask, request, jsonify, send_file
+from flask import Flask, Response, request, jsonify, send_file
 from flask_cors import CORS
-from constants import NOTEBOOKS_PATH, DATA_PATH
+from CodebookIndex import Codebook, DEFAULT_PAGE_SIZE, query_etag
+from constants import EMOTION_LABELS, FER_MODEL_PATH, MAIN_MODEL_PATH, MEAN_X_PATH, MU3D_CODEBOOK_PATH, STD_X_PATH
 import tempfile
-from MediaPipeCropping import process_video, initialize_face_mesh
-import matplotlib
-# Force matplotlib to use non-interactive backend to avoid GUI thread issues
-matplotlib.use('Agg')
-import matplotlib.pyplot as plt
-import base64
+from contextlib import nullcontext
+from ParallelCropping import extract_face_crops_parallel
+from MediaPipeCropping import DEFAULT_KEYFRAME_INTERVAL, DEFAULT_DRIFT_THRESHOLD, initialize_face_mesh, iter_face_crops
+from FrameSampling import DEFAULT_DECODE_OVERSAMPLE
+from JobQueue import JobQueue, QueueFullError, JOB_CANCELLED, JOB_DONE, JOB_FAILED, JOB_QUEUED, JOB_RUNNING
+from Metrics import DEFAULT_PROFILE_INTERVAL, add_stage_time, metrics, profiler, record, stage
+from ModelRegistry import ModelRegistry
+from MultiSubject import extract_subject_crops
+from ResultCache import ResultCache, cache_key, model_identity, save_and_hash
+from UploadIngestion import UploadAbortedError, UploadBuffer, open_upload_capture, streaming_decode_available
+from Visualization import render_png, render_width, select_tiles
 from io import BytesIO
 
 app = Flask(__name__)
 CORS(app)
 
-# Global progress tracker
-progress_value = 0
+# Larger request bodies are refused with 413 while they are read (DEEPLIE_MAX_UPLOAD_MB)
+MAX_UPLOAD_MB = int(os.environ.get("DEEPLIE_MAX_UPLOAD_MB", 1024))
+app.config["MAX_CONTENT_LENGTH"] = MAX_UPLOAD_MB << 20
+
+# Streamed uploads past this size spill from memory to a temporary file (DEEPLIE_UPLOAD_MEMORY_MB)
+UPLOAD_MEMORY_MB = int(os.environ.get("DEEPLIE_UPLOAD_MEMORY_MB", 32))
+
+# /api/profiler exposes the server's call stacks and can add sampling overhead, so it is off unless
+# DEEPLIE_PROFILER_API=1
+PROFILER_API = os.environ.get("DEEPLIE_PROFILER_API") == "1"
+
+# Raw request bodies with these content types are read as the video itself rather than as a form
+RAW_UPLOAD_MIMETYPES = ("application/octet-stream",)
+
+# MU3D codebook served by /api/codebook, parsed on first request and whenever the file changes
+codebook = Codebook(MU3D_CODEBOOK_PATH)
+
+# /api/codebook arguments that are not column filters
+CODEBOOK_QUERY_ARGS = ("sheet", "columns", "offset", "limit", "format")
+
+# Bounded worker pool running analysis jobs off the request thread
+job_queue = JobQueue()
+
+# Inference backend: "keras" runs the float32 models, "tflite" the models converted by
+# QuantizedInference.py in the DEEPLIE_TFLITE_MODE quantization mode. /api/predict requests
+# can pick a backend with a "backend" form field; DEEPLIE_BACKEND sets the default.
+INFERENCE_BACKENDS = ("keras", "tflite")
+INFERENCE_BACKEND = os.environ.get("DEEPLIE_BACKEND", "keras")
+TFLITE_MODE = os.environ.get("DEEPLIE_TFLITE_MODE", "dynamic")
+
+# Repeated uploads of the same video are answered from an on-disk cache keyed by its bytes,
+# the preprocessing parameters and the model files (see ResultCache.from_env for settings)
+result_cache = ResultCache.from_env()
+
+# Default tolerance of variable-length /api/predict requests ("variable_length" field): the analysis
+# stops once the running score moves less than this over the last chunks (see StreamingInference.EarlyExit)
+EARLY_EXIT_TOLERANCE = float(os.environ.get("DEEPLIE_EARLY_EXIT_TOLERANCE", 0.02))
 
-# Define emotion labels
-EMOTION_LABELS = ['Angry', 'Disgust', 'Fear', 'Happy', 'Sad', 'Surprise', 'Neutral']
+# Most subjects a multi-subject /api/predict request ("max_subjects" field) may ask for
+MAX_SUBJECTS_LIMIT = 8
 
-# Load the models
-custom_objects = {"categorical_crossentropy": tf.keras.losses.categorical_crossentropy}
-fer_model_path = NOTEBOOKS_PATH + 'deeplie/content/fer2013/fer.keras'
-fer_model = tf.keras.models.load_model(fer_model_path, custom_objects=custom_objects)
+# Preprocessing parameters of /api/predict; they are part of the cache key
+NUM_FRAMES = 300
+SSIM_THRESHOLD = 0.9
+# Face Mesh runs on every frame, as for the training crops; a larger interval tracks landmarks in between
+KEYFRAME_INTERVAL = int(os.environ.get("DEEPLIE_KEYFRAME_INTERVAL", DEFAULT_KEYFRAME_INTERVAL))
+PREPROCESSING_PARAMS = {
+    "num_frames": NUM_FRAMES,
+    "ssim_threshold": SSIM_THRESHOLD,
+    "keyframe_interval": KEYFRAME_INTERVAL,
+    "drift_threshold": DEFAULT_DRIFT_THRESHOLD,
+    "decode_oversample": DEFAULT_DECODE_OVERSAMPLE,
+}
 
-# Verify the model's structure
-layer_names = [layer.name for layer in fer_model.layers]
+# Models are loaded on first use, or in the background once the server starts (see /api/ready).
+# TensorFlow is only imported by the loaders, so importing this module stays cheap.
+model_registry = ModelRegistry(started_at=startup_started)
 
-main_model_path = NOTEBOOKS_PATH + 'deeplie/content/deep-lie/project/gru_model/gru_model_(LOOCV)_64.0 (+- 48.0).keras'
-main_model = tf.keras.models.load_model(main_model_path)
+def load_fer_engine(registry):
+    """Single-pass emotion + encoding engine around the FER model."""
+    import tensorflow as tf
+    from InferenceEngine import FERInferenceEngine
+    custom_objects = {"categorical_crossentropy": tf.keras.losses.categorical_crossentropy}
+    fer_model = tf.keras.models.load_model(FER_MODEL_PATH, custom_objects=custom_objects)
+    return FERInferenceEngine(fer_model)
 
-# Load mean and std for normalization
-mean_X = np.load(NOTEBOOKS_PATH + 'deeplie/content/fer2013/mean_x.npy')
-std_X = np.load(NOTEBOOKS_PATH + 'deeplie/content/fer2013/std_x.npy')
+def load_main_model(registry):
+    import tensorflow as tf
+    return tf.keras.models.load_model(MAIN_MODEL_PATH)
 
-def extract_frames_mediapipe(video_path, num_frames=300):
+def load_tflite_fer_engine(registry):
+    from QuantizedInference import TFLiteFERInferenceEngine, tflite_model_path
+    return TFLiteFERInferenceEngine(tflite_model_path(FER_MODEL_PATH, TFLITE_MODE))
+
+def load_tflite_main_model(registry):
+    from QuantizedInference import TFLiteSequenceClassifier, tflite_model_path
+    return TFLiteSequenceClassifier(tflite_model_path(MAIN_MODEL_PATH, TFLITE_MODE))
+
+def inference_models(backend=INFERENCE_BACKEND):
+    """The (FER engine, GRU model) pair of an inference backend."""
+    suffix = "_tflite" if backend == "tflite" else ""
+    return model_registry.get("fer_engine" + suffix), model_registry.get("main_model" + suffix)
+
+def load_stream_classifier(registry):
+    """Incremental view of the GRU model for the streaming endpoint."""
+    from StreamingInference import StreamingClassifier
+    return StreamingClassifier(registry.get("main_model"))
+
+def load_stream_sessions(registry):
+    from StreamingInference import StreamSessions
+    return StreamSessions()
+
+def load_normalization(registry):
+    """Mean and std of the FER training images."""
+    return np.load(MEAN_X_PATH), np.load(STD_X_PATH)
+
+def tflite_model_paths():
+    """Paths of the FER and GRU models converted in TFLITE_MODE (see QuantizedInference.py)."""
+    from QuantizedInference import tflite_model_path
+    return [tflite_model_path(FER_MODEL_PATH, TFLITE_MODE), tflite_model_path(MAIN_MODEL_PATH, TFLITE_MODE)]
+
+def load_model_digest(registry):
+    """Digest of the model files, including the converted models of TFLITE_MODE if they exist."""
+    paths = [FER_MODEL_PATH, MAIN_MODEL_PATH, MEAN_X_PATH, STD_X_PATH]
+    paths += [path for path in tflite_model_paths() if os.path.exists(path)]
+    return model_identity(paths)
+
+def warm_up_models(registry):
+    """
+    Run each model once on dummy input so that graph tracing and kernel selection happen at
+    startup rather than on the first request.
+    """
+    fer_engine, main_model = inference_models(INFERENCE_BACKEND)
+    mean_X, _ = registry.get("normalization")
+    _, encodings = fer_engine.run(np.zeros((NUM_FRAMES,) + mean_X.shape, dtype=np.float32))
+    main_model.predict(np.expand_dims(encodings, axis=0), verbose=0)
+    if INFERENCE_BACKEND == "keras":
+        classifier = registry.get("stream_classifier")
+        state = classifier.new_state()
+        classifier.push(state, encodings[:classifier.conv_kernel])  # Enough for one Conv1D output
+        classifier.score(state)
+    # Importing MediaPipe and building the Face Mesh graph also takes seconds
+    initialize_face_mesh().close()
+
+model_registry.register("fer_engine", load_fer_engine, preload=INFERENCE_BACKEND == "keras")
+# The Keras GRU model also backs the streaming classifier; with the tflite backend both load on first use
+model_registry.register("main_model", load_main_model, preload=INFERENCE_BACKEND == "keras")
+model_registry.register("fer_engine_tflite", load_tflite_fer_engine, preload=INFERENCE_BACKEND == "tflite")
+model_registry.register("main_model_tflite", load_tflite_main_model, preload=INFERENCE_BACKEND == "tflite")
+model_registry.register("stream_classifier", load_stream_classifier, preload=INFERENCE_BACKEND == "keras")
+model_registry.register("stream_sessions", load_stream_sessions)
+model_registry.register("normalization", load_normalization)
+if result_cache is not None:
+    model_registry.register("model_digest", load_model_digest)
+model_registry.add_warmup(warm_up_models)
+
+# Scrape-time gauges next to the pipeline metrics of /metrics
+metrics.add_gauge("models_ready", "1 once the models are loaded and warmed up.", lambda: model_registry.ready)
+metrics.add_gauge("jobs_queued", "Analysis jobs waiting for a worker.", lambda: job_queue.count(JOB_QUEUED))
+metrics.add_gauge("jobs_running", "Analysis jobs being processed.", lambda: job_queue.count(JOB_RUNNING))
+if result_cache is not None:
+    metrics.add_gauge("result_cache_hits", "Result cache hits since startup.", lambda: result_cache.hits)
+    metrics.add_gauge("result_cache_misses", "Result cache misses since startup.", lambda: result_cache.misses)
+
+def ignore_progress(stage, value):
+    """Default progress callback for callers that do not track progress."""
+
+def extract_frames_mediapipe(video_path, num_frames=NUM_FRAMES, progress_callback=ignore_progress):
     """
     Extract frames using MediaPipeCropping which:
     1. Detects faces using MediaPipe
     2. Aligns the faces based on eye positions
     3. Crops the face region
-    4. Enhances the image quality
+    Frames are handed over in memory as a (num_frames, 128, 128, 3) uint8 array.
+    Long videos are split across DEEPLIE_PREPROCESS_WORKERS processes when it is set.
     """
-    global progress_value
-    progress_value = 5
+    progress_callback("cropping", 5)
     
-    # Create a temporary directory to store processed frames
-    with tempfile.TemporaryDirectory() as temp_dir:
-        # Process video using MediaPipeCropping
-        frame_count, saved_frame_count = process_video(
-            video_path, 
-            temp_dir, 
-            target_frames=num_frames, 
-            ssim_threshold=0.9
-        )
-        progress_value = 15
-        
-        if saved_frame_count == 0:
-            raise ValueError("No faces detected in the video.")
-        
-        # Load the processed frames
-        frames = []
-        for i in range(saved_frame_count):
-            frame_path = os.path.join(temp_dir, f'frame_{i:04d}.png')
-            if os.path.exists(frame_path):
-                frame = cv2.imread(frame_path)
-                frames.append(frame)
+    # Process video using MediaPipeCropping
+    frame_count, frames = extract_face_crops_parallel(
+        video_path,
+        target_frames=num_frames,
+        ssim_threshold=SSIM_THRESHOLD,
+        keyframe_interval=KEYFRAME_INTERVAL
+    )
+    progress_callback("cropping", 15)
+    
+    if len(frames) == 0:
+        raise ValueError("No faces detected in the video.")
         
-        if len(frames) < num_frames:
-            print(f"Warning: Only {len(frames)} frames were extracted (requested {num_frames})")
-            
-        progress_value = 20
-        return frames
+    progress_callback("cropping", 20)
+    return frames
 
 def process_emotions(emotion_preds):
     """
@@ -105,220 +225,589 @@ def process_emotions(emotion_preds):
     
     return emotion_data
 
-def create_frames_visualization(frames, emotion_preds, num_frames=8, encodings=None):
+def predict(video_path, fer_engine, main_model, mean_X, std_X, num_frames=NUM_FRAMES,
+            progress_callback=ignore_progress, inference_lock=None):
     """
-    Creates a visualization of frames with emotion predictions and encoding heatmaps
-    Returns the image as a base64-encoded string
+    Run the full analysis pipeline on one video.
+    progress_callback(stage, value) receives the current stage name and overall progress (0-100).
+    inference_lock, if given, is held while the TensorFlow models run.
+    Returns the prediction, the emotion distribution, the visualization tiles (see Visualization.select_tiles)
+    and the (num_frames, 4608) encodings.
     """
-    try:
-        # Select evenly spaced frames
-        if len(frames) < num_frames:
-            num_frames = len(frames)
-        
-        indices = np.linspace(0, len(frames) - 1, num_frames, dtype=int)
-        
-        # Create figure with two rows
-        fig, axs = plt.subplots(2, num_frames, figsize=(num_frames*2, 5))
-        plt.ioff()  # Turn off interactive mode
-        
-        for j, idx in enumerate(indices):
-            try:
-                # Top row: Original frame
-                frame = frames[idx].copy()  # Make a copy to avoid modifying original
-                
-                # Handle different frame formats safely
-                if len(frame.shape) == 3 and frame.shape[2] == 1:
-                    frame = frame.reshape(frame.shape[0], frame.shape[1])
-                elif len(frame.shape) == 3 and frame.shape[2] > 1:
-                    # If RGB, convert to grayscale for display consistency
-                    frame = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY) if frame.shape[2] == 3 else frame[:,:,0]
-                
-                # Ensure frame data is valid for plotting
-                if np.isnan(frame).any() or np.isinf(frame).any():
-                    frame = np.nan_to_num(frame, nan=0.0, posinf=1.0, neginf=0.0)
-                
-                axs[0, j].imshow(frame, cmap='gray')
-                axs[0, j].axis('off')
-                
-                # Get emotion prediction for the frame
-                if idx < len(emotion_preds):
-                    emotion_idx = np.argmax(emotion_preds[idx])
-                    emotion_label = EMOTION_LABELS[emotion_idx]
-                    confidence = emotion_preds[idx][emotion_idx] * 100
-                    axs[0, j].set_title(f"{emotion_label}")
-                else:
-                    axs[0, j].set_title(f"Frame {idx}")
-                
-                # Bottom row: Encoding heatmap
-                if encodings is not None and idx < len(encodings):
-                    # Reshape encoding to a square-ish shape for visualization
-                    # Default reshape to approximately square dimensions
-                    encoding = encodings[idx]
-                    encoding_dim = int(np.sqrt(encoding.shape[0]))
-                    
-                    # Reshape to square-ish dimensions - find best fit
-                    if encoding.shape[0] == 4608:  # Common size in these models
-                        encoding_reshaped = encoding.reshape(64, 72)  # 64×72=4608
-                    else:
-                        # Try to make it as square as possible
-                        encoding_reshaped = encoding.reshape(encoding_dim, -1)
-                    
-                    # Display as heatmap
-                    im = axs[1, j].imshow(encoding_reshaped, cmap='viridis')
-                    axs[1, j].axis('off')
-                    axs[1, j].set_title(f"Encoding")
-                else:
-                    axs[1, j].axis('off')
-                    axs[1, j].text(0.5, 0.5, "No encoding available", 
-                                 horizontalalignment='center', verticalalignment='center')
-            except Exception as e:
-                print(f"Error processing frame {idx}: {e}")
-                # Draw placeholder for error frames
-                axs[0, j].text(0.5, 0.5, f"Error: {str(e)[:20]}...", 
-                              horizontalalignment='center', verticalalignment='center')
-                axs[0, j].axis('off')
-                axs[1, j].axis('off')
-        
-        plt.tight_layout()
-        
-        # Save to memory buffer
-        buf = BytesIO()
-        plt.savefig(buf, format='png', dpi=100)
-        plt.close(fig)
-        buf.seek(0)
-        
-        # Convert to base64 for embedding in response
-        img_str = base64.b64encode(buf.getvalue()).decode('utf-8')
-        
-        return img_str
-    except Exception as e:
-        print(f"Visualization generation failed: {e}")
-        # Return a simple error image
-        fig, ax = plt.subplots(1, 1, figsize=(8, 4))
-        ax.text(0.5, 0.5, f"Visualization Error: {str(e)}", 
-               horizontalalignment='center', verticalalignment='center')
-        ax.axis('off')
-        
-        buf = BytesIO()
-        plt.savefig(buf, format='png', dpi=100)
-        plt.close(fig)
-        buf.seek(0)
-        
-        return base64.b64encode(buf.getvalue()).decode('utf-8')
-
-def predict(video_path, fer_model, main_model, mean_X, std_X, num_frames=300):
-    global progress_value
-    progress_value = 0
+    inference_lock = inference_lock or nullcontext()
     
-    try:
-        # Extract frames from the video using MediaPipeCropping
-        frames = extract_frames_mediapipe(video_path, num_frames)
-        
-        # Convert and preprocess frames
-        frames_processed = [cv2.cvtColor(cv2.resize(f, (48, 48)), cv2.COLOR_BGR2GRAY) for f in frames]
-        frames_processed = np.array(frames_processed).astype('float32')
-        frames_processed = np.expand_dims(frames_processed, axis=-1)
-        frames_processed = (frames_processed - mean_X) / (std_X + 1e-8)
-        progress_value = 30
+    # Extract frames from the video using MediaPipeCropping
+    frames = extract_frames_mediapipe(video_path, num_frames, progress_callback)
+    
+    # Convert and preprocess frames
+    from InferenceEngine import preprocess_frames
+    with stage("preprocess"):
+        frames_processed = preprocess_frames(frames, mean_X, std_X)
+    progress_callback("encoding", 30)
+    
+    wait_started = time.perf_counter()
+    with inference_lock:
+        add_stage_time("inference_wait", time.perf_counter() - wait_started)
         
-        # Get emotion predictions
-        emotion_preds = fer_model.predict(frames_processed)
+        # Get emotion predictions and encodings in a single forward pass
+        with stage("fer"):
+            emotion_preds, all_features = fer_engine.run(
+                frames_processed,
+                progress_callback=lambda fraction: progress_callback("encoding", 30 + int(fraction * 60))
+            )
         emotion_data = process_emotions(emotion_preds)
-        progress_value = 50
         
-        # Extract features using encoding model
-        encoding_model = tf.keras.Model(
-            inputs=fer_model.layers[0].input,
-            outputs=fer_model.get_layer('flatten').output
-        )
-        
-        # Process in chunks to avoid memory issues
-        chunk_size = 30
-        all_features = []
-        total_chunks = len(frames_processed) // chunk_size
-        
-        for i in range(0, len(frames_processed), chunk_size):
-            chunk = frames_processed[i : i + chunk_size]
-            features_chunk = encoding_model.predict(chunk)
-            all_features.append(features_chunk)
-            
-            # Update progress
-            chunk_index = (i // chunk_size) + 1
-            progress_value = 50 + int((chunk_index / total_chunks) * 40)
-        
-        # Concatenate and prepare features
-        all_features = np.concatenate(all_features, axis=0)
+        # Prepare features
         all_features = np.expand_dims(all_features, axis=0)  # Add batch dimension
         
-        # Create visualization of frames with emotions and encodings
-        visualization_img = create_frames_visualization(frames_processed, emotion_preds, encodings=all_features[0])
-        
         # Get deception prediction
-        prediction = main_model.predict(all_features)
-        progress_value = 100
-        
-        # Return prediction, emotions, and visualization
-        return prediction, emotion_data, visualization_img
-        
-    except Exception as e:
-        progress_value = 100  # Reset progress
-        raise e
+        progress_callback("classifying", 90)
+        with stage("gru"):
+            prediction = main_model.predict(all_features)
+    
+    # Keep only what the visualization needs; it is rendered when a client asks for it
+    tiles = select_tiles(frames_processed, emotion_preds, all_features[0])
+    
+    # Return prediction, emotions, visualization tiles and the encodings the GRU saw
+    return prediction, emotion_data, tiles, all_features[0]
 
-@app.route("/api/predict", methods=["POST"])
-def predict_route():
-    global progress_value
-    # Save file to a temporary path
-    uploaded_file = request.files.get("video")
-    if not uploaded_file:
-        return jsonify({"error": "No video file provided"}), 400
+def predict_variable_length(video_path, fer_engine, classifier, mean_X, std_X, tolerance=EARLY_EXIT_TOLERANCE,
+                            max_frames=NUM_FRAMES, progress_callback=ignore_progress, inference_lock=None):
+    """
+    Variable-length counterpart of predict: the kept crops of at most max_frames evenly spaced frames
+    are encoded and fed to the GRU (as a StreamingClassifier) as they are cropped, without being
+    resampled to max_frames, and the analysis stops once the running score is stable within
+    tolerance (see StreamingInference.EarlyExit; 0 uses every frame).
+    Returns the prediction, the emotion distribution, the visualization tiles, the encodings of the
+    frames used and {"frames_used", "stopped_early"}.
+    """
+    from StreamingInference import EarlyExit, score_crops
+    progress_callback("cropping", 5)
+    crops = iter_face_crops(video_path, SSIM_THRESHOLD, KEYFRAME_INTERVAL, max_decoded_frames=max_frames)
+    with stage("variable_length"):
+        scored = score_crops(crops, fer_engine, classifier, mean_X, std_X, max_frames, early_exit=EarlyExit(tolerance),
+                             inference_lock=inference_lock,
+                             progress_callback=lambda frames_used: progress_callback(
+                                 "encoding", 20 + int(70 * frames_used / max_frames)))
+    if scored["frames_used"] == 0:
+        raise ValueError("No faces detected in the video.")
+    if scored["score"] is None:
+        raise ValueError("Too few frames with a face in the video to score it.")
 
-    # Use a temporary file to save the uploaded video
-    with tempfile.NamedTemporaryFile(delete=False, suffix=".mp4") as temp_file:
-        temp_path = temp_file.name
-        uploaded_file.save(temp_path)
+    emotion_data = process_emotions(scored["emotion_preds"])
+    tiles = select_tiles(scored["frames_processed"], scored["emotion_preds"], scored["encodings"])
+    usage = {"frames_used": scored["frames_used"], "stopped_early": scored["stopped_early"]}
+    return np.array([[scored["score"]]]), emotion_data, tiles, scored["encodings"], usage
 
-    try:
-        # Run prediction with visualization
-        preds, emotion_data, visualization_img = predict(temp_path, fer_model, main_model, mean_X, std_X)
-        
-        # Format the prediction results
-        prediction_value = float(preds[0][0])
-        is_deceptive = prediction_value > 0.5
-        confidence = abs(prediction_value - 0.5) * 2 * 100  # Convert to percentage and scale
-        
-        # Prepare the response with visualization
+def predict_subjects(video_path, fer_engine, main_model, mean_X, std_X, max_subjects, num_frames=NUM_FRAMES,
+                     progress_callback=ignore_progress, inference_lock=None):
+    """
+    Multi-subject counterpart of predict: crop up to max_subjects faces in one decode, then encode
+    every subject's frames in one FER pass and score all subjects in one GRU call.
+    Returns the subject ids, the (subjects,) predictions, each subject's emotion distribution and
+    the (subjects, num_frames, 4608) encodings.
+    """
+    inference_lock = inference_lock or nullcontext()
+    progress_callback("cropping", 5)
+    _, subjects = extract_subject_crops(video_path, num_frames, SSIM_THRESHOLD, max_subjects, KEYFRAME_INTERVAL)
+    if not subjects:
+        raise ValueError("No faces detected in the video.")
+    progress_callback("cropping", 20)
+
+    from InferenceEngine import preprocess_frames
+    with stage("preprocess"):
+        frames_processed = preprocess_frames(np.concatenate(list(subjects.values())), mean_X, std_X)
+    progress_callback("encoding", 30)
+
+    wait_started = time.perf_counter()
+    with inference_lock:
+        add_stage_time("inference_wait", time.perf_counter() - wait_started)
+        with stage("fer"):
+            emotion_preds, all_features = fer_engine.run(
+                frames_processed,
+                progress_callback=lambda fraction: progress_callback("encoding", 30 + int(fraction * 60))
+            )
+        all_features = all_features.reshape(len(subjects), num_frames, -1)
+        progress_callback("classifying", 90)
+        with stage("gru"):
+            predictions = main_model.predict(all_features, verbose=0)[:, 0]
+
+    emotion_data = [process_emotions(preds) for preds in np.split(emotion_preds, len(subjects))]
+    return list(subjects), predictions, emotion_data, all_features
+
+def format_prediction(prediction_value):
+    """Turn the model's sigmoid output into the label and confidence shown to the user."""
+    is_deceptive = prediction_value > 0.5
+    confidence = abs(prediction_value - 0.5) * 2 * 100  # Convert to percentage and scale
+    return {
+        "result": "Deceptive" if is_deceptive else "Truthful",
+        "confidence": f"{confidence:.1f}%",
+    }
+
+def analysis_params(backend, max_subjects=1, tolerance=None):
+    """Everything besides the video and model files that determines an analysis result; part of the cache key."""
+    params = dict(PREPROCESSING_PARAMS, backend=backend)
+    if backend == "tflite":
+        params["tflite_mode"] = TFLITE_MODE
+    if max_subjects > 1:
+        params["max_subjects"] = max_subjects
+    if tolerance is not None:
+        params["variable_length_tolerance"] = tolerance
+    return params
+
+def run_analysis(job, video_path, key=None, backend=INFERENCE_BACKEND, include_timings=False, max_subjects=1,
+                 tolerance=None):
+    """
+    Job body: analyse the uploaded video and format the response payload, caching it under key if given.
+    video_path may be an opened capture, and key a function returning the key once the analysis is done
+    (for uploads whose digest is only known once they have arrived).
+    With max_subjects > 1 every face is analysed (see predict_subjects) and the payload holds a
+    "subjects" list of per-subject results instead; those analyses have no visualization.
+    With a tolerance, the single subject is scored on a variable number of frames with early exit
+    (see predict_variable_length) and the payload reports "frames_used" and "stopped_early".
+    Stage timings and frame counters go to /metrics and, with include_timings, into the payload as "timings".
+    """
+    tiles, usage = {}, {}
+    with record() as timings:
+        add_stage_time("queued", time.time() - job.created_at)
+        try:
+            with stage("model_load"):  # Only takes time while the models are still loading
+                mean_X, std_X = model_registry.get("normalization")
+                fer_engine, main_model = inference_models(backend)
+            if max_subjects > 1:
+                subject_ids, predictions, subject_emotions, encodings = predict_subjects(
+                    video_path, fer_engine, main_model, mean_X, std_X, max_subjects,
+                    progress_callback=job.update,
+                    inference_lock=job_queue.inference_lock
+                )
+            elif tolerance is not None:
+                # The streaming classifier wraps the Keras GRU model whatever the backend
+                preds, emotion_data, tiles, encodings, usage = predict_variable_length(
+                    video_path, fer_engine, model_registry.get("stream_classifier"), mean_X, std_X, tolerance,
+                    progress_callback=job.update,
+                    inference_lock=job_queue.inference_lock
+                )
+            else:
+                preds, emotion_data, tiles, encodings = predict(
+                    video_path, fer_engine, main_model, mean_X, std_X,
+                    progress_callback=job.update,
+                    inference_lock=job_queue.inference_lock
+                )
+        except UploadAbortedError:
+            raise  # Answered from the cache or abandoned by the client; not a failed analysis
+        except Exception:
+            metrics.observe_analysis("failed")
+            raise
+    
+    # Format the prediction results
+    if max_subjects > 1:
+        result = {
+            "subjects": [
+                {"subject": subject_id, "prediction": [[float(prediction)]], **format_prediction(float(prediction)),
+                 "emotions": emotion_data}
+                for subject_id, prediction, emotion_data in zip(subject_ids, predictions, subject_emotions)
+            ],
+            "time": "Analysis Complete",
+        }
+    else:
         result = {
             "prediction": preds.tolist(),
-            "result": "Deceptive" if is_deceptive else "Truthful",
-            "confidence": f"{confidence:.1f}%",
+            **format_prediction(float(preds[0][0])),
             "emotions": emotion_data,
+            **usage,
             "time": "Analysis Complete",
-            "visualization": visualization_img
         }
-        
-        return jsonify(result)
-    except Exception as e:
-        print(e)
-        return jsonify({"error": str(e)}), 500
-    finally:
+    if callable(key):
+        key = key()
+    if key is not None:
+        result_cache.put(key, result, encodings, arrays={"tile_" + name: array for name, array in tiles.items()})
+    metrics.observe_analysis("done", timings)
+    if tiles:
+        job.artifacts["tiles"] = tiles
+        result = with_visualization_url(result, job)
+    if include_timings:
+        result["timings"] = timings.to_dict()
+    return result
+
+def run_upload_analysis(job, upload, model_digest=None, backend=INFERENCE_BACKEND, include_timings=False,
+                        max_subjects=1, tolerance=None):
+    """
+    Job body for a raw-body upload: decode it while it arrives, then cache the result under the key
+    of its digest and model_digest (if caching is enabled).
+    """
+    job.update("uploading", 0)
+    try:
+        capture = open_upload_capture(upload)
+    except UploadAbortedError:
+        raise
+    except Exception:
+        metrics.observe_analysis("failed")
+        raise
+
+    def key():
+        if result_cache is None:
+            return None
+        # An early exit can finish the analysis before the rest of the upload, and with it the digest, has arrived
+        try:
+            upload.wait()
+        except UploadAbortedError:
+            return None  # Answered from the cache or abandoned by the client; nothing to store
+        return cache_key(upload.digest, analysis_params(backend, max_subjects, tolerance), model_digest)
+
+    return run_analysis(job, capture, key, backend, include_timings, max_subjects, tolerance)
+
+def with_visualization_url(result, job):
+    """The result payload with the URL its visualization is rendered at."""
+    return dict(result, visualization_url=f"/api/visualization/{job.job_id}")
+
+def cached_response(key):
+    """Response for a video whose result is cached under key: a finished job holding it, or None on a miss."""
+    cached = result_cache.get(key)
+    if cached is None:
+        return None
+    arrays = result_cache.get_arrays(key) or {}
+    tiles = {name[len("tile_"):]: array for name, array in arrays.items() if name.startswith("tile_")}
+    job = job_queue.complete(cached, artifacts={"tiles": tiles} if tiles else None)
+    if tiles:
+        job.result = with_visualization_url(cached, job)
+    metrics.observe_analysis("cached")
+    return jsonify({"job_id": job.job_id, "status": job.status, "cached": True, "result": job.result})
+
+def submit_streamed_upload(backend, include_timings, max_subjects=1, tolerance=None):
+    """
+    Queue the analysis of a raw-body upload before reading the body, so the job decodes and crops
+    the first frames while the rest arrives, then receive it here, hashing it in the same pass.
+    """
+    # A declared length over MAX_CONTENT_LENGTH is refused (413) when the stream is opened; a longer
+    # body than declared, or a chunked one, fails while it is received, which aborts the job's reads
+    stream = request.stream
+    # Resolved before the job starts, so the two threads never import the models' modules at once
+    model_digest = model_registry.get("model_digest") if result_cache is not None else None
+    upload = UploadBuffer(memory_limit=UPLOAD_MEMORY_MB << 20, expected_size=request.content_length)
+    try:
+        job = job_queue.submit(run_upload_analysis, upload, model_digest, backend, include_timings, max_subjects,
+                               tolerance, cleanup=upload.close)
+    except QueueFullError as e:
+        return jsonify({"error": str(e)}), 503
+    video_digest = upload.receive(stream)
+    if upload.size == 0:
+        upload.abort()
+        return jsonify({"error": "No video file provided"}), 400
+
+    if result_cache is not None:
+        response = cached_response(cache_key(video_digest, analysis_params(backend, max_subjects, tolerance),
+                                             model_digest))
+        if response is not None:
+            upload.abort(UploadAbortedError("Answered from the result cache."))
+            return response
+    return jsonify({"job_id": job.job_id, "status": job.status}), 202
+
+@app.route("/api/predict", methods=["POST"])
+def predict_route():
+    """
+    Queue an analysis of the uploaded video and answer 202 with its job id. A video analysed
+    before with the same parameters and models is answered at once with 200, the finished job's
+    id and its cached result. An optional "backend" field selects the inference backend,
+    "timings=1" adds a per-stage timing breakdown to the result, and "max_subjects=N" analyses up
+    to N faces in the video, answering with a "subjects" list of per-subject results.
+    "variable_length=1" scores only the video's real frames and stops once the score is stable
+    within "tolerance" (default EARLY_EXIT_TOLERANCE; 0 never stops early).
+    The video is either the "video" file of a multipart form, or the raw request body (Content-Type
+    video/* or application/octet-stream, fields in the query string). With PyAV installed a raw
+    body is decoded while it arrives; otherwise, and for forms, it is saved to a file first.
+    """
+    raw_upload = request.mimetype.startswith("video/") or request.mimetype in RAW_UPLOAD_MIMETYPES
+    fields = request.args if raw_upload else request.form
+    uploaded_file = None if raw_upload else request.files.get("video")
+    if not raw_upload and not uploaded_file:
+        return jsonify({"error": "No video file provided"}), 400
+    backend = fields.get("backend", INFERENCE_BACKEND)
+    if backend not in INFERENCE_BACKENDS:
+        return jsonify({"error": f"Unknown backend {backend!r}; expected one of {', '.join(INFERENCE_BACKENDS)}"}), 400
+    if backend == "tflite" and not all(os.path.exists(path) for path in tflite_model_paths()):
+        return jsonify({"error": f"The tflite backend is not available: convert the models first "
+                                 f"(python QuantizedInference.py --mode {TFLITE_MODE})"}), 400
+    include_timings = fields.get("timings", request.args.get("timings", "0")) not in ("", "0", "false")
+    max_subjects = fields.get("max_subjects", "1")
+    if not max_subjects.isdigit() or not 1 <= int(max_subjects) <= MAX_SUBJECTS_LIMIT:
+        return jsonify({"error": f"max_subjects must be a whole number from 1 to {MAX_SUBJECTS_LIMIT}"}), 400
+    max_subjects = int(max_subjects)
+    tolerance = None
+    if fields.get("variable_length", "0") not in ("", "0", "false"):
+        tolerance = fields.get("tolerance", EARLY_EXIT_TOLERANCE, type=float)
+        if not 0 <= tolerance < 1 or max_subjects > 1:
+            return jsonify({"error": "variable_length needs a tolerance from 0 to 1 and a single subject"}), 400
+    if raw_upload and streaming_decode_available():
+        return submit_streamed_upload(backend, include_timings, max_subjects, tolerance)
+
+    # Use a temporary file to save the uploaded video; the job removes it when done.
+    # The upload is hashed while it is written, for the result cache.
+    with tempfile.NamedTemporaryFile(delete=False, suffix=".mp4") as temp_file:
+        temp_path = temp_file.name
+    try:
+        video_digest = save_and_hash(request.stream if raw_upload else uploaded_file.stream, temp_path)
+    except Exception:
+        os.remove(temp_path)
+        raise
+
+    def remove_upload():
         if os.path.exists(temp_path):
             os.remove(temp_path)
 
-@app.route("/api/progress", methods=["GET"])
-def get_progress():
-    global progress_value
-    return jsonify({"progress": progress_value})
+    if os.path.getsize(temp_path) == 0:
+        remove_upload()
+        return jsonify({"error": "No video file provided"}), 400
+
+    key = None
+    if result_cache is not None:
+        key = cache_key(video_digest, analysis_params(backend, max_subjects, tolerance), model_registry.get("model_digest"))
+        response = cached_response(key)
+        if response is not None:
+            remove_upload()
+            return response
+
+    try:
+        job = job_queue.submit(run_analysis, temp_path, key, backend, include_timings, max_subjects, tolerance,
+                               cleanup=remove_upload)
+    except QueueFullError as e:
+        remove_upload()
+        return jsonify({"error": str(e)}), 503
+
+    return jsonify({"job_id": job.job_id, "status": job.status}), 202
+
+@app.errorhandler(413)
+def upload_too_large(error):
+    return jsonify({"error": f"The video is larger than the {MAX_UPLOAD_MB} MB upload limit."}), 413
+
+@app.route("/api/progress/<job_id>", methods=["GET"])
+def get_progress(job_id):
+    job = job_queue.get(job_id)
+    if job is None:
+        return jsonify({"error": "Unknown job"}), 404
+    return jsonify(job.to_dict())
+
+@app.route("/api/result/<job_id>", methods=["GET"])
+def get_result(job_id):
+    """
+    Return the finished analysis. While the job is still running this answers 202 with
+    its progress; pass ?wait=<seconds> to hold the request open until the job finishes.
+    A job cancelled because its upload was abandoned or answered from the cache answers 410.
+    """
+    job = job_queue.get(job_id)
+    if job is None:
+        return jsonify({"error": "Unknown job"}), 404
+
+    wait = min(request.args.get("wait", 0, type=float), 60)
+    if wait > 0:
+        job.wait(wait)
+
+    if job.status == JOB_DONE:
+        return jsonify(job.result)
+    if job.status == JOB_FAILED:
+        return jsonify({"error": job.error}), 500
+    if job.status == JOB_CANCELLED:
+        return jsonify({"error": job.error}), 410
+    return jsonify(job.to_dict()), 202
+
+@app.route("/api/visualization/<job_id>", methods=["GET"])
+def get_visualization(job_id):
+    """
+    PNG of the job's frames with their emotions and encoding heatmaps, rendered on first request
+    and cached with the job. Pass ?width=<pixels> for a smaller or larger render.
+    """
+    job = job_queue.get(job_id)
+    if job is None:
+        return jsonify({"error": "Unknown job"}), 404
+    if job.status == JOB_FAILED:
+        return jsonify({"error": job.error}), 500
+    if job.status == JOB_CANCELLED:
+        return jsonify({"error": job.error}), 410
+    if job.status != JOB_DONE:
+        return jsonify(job.to_dict()), 202
+    tiles = job.artifacts.get("tiles")
+    if tiles is None:
+        return jsonify({"error": "No visualization for this job"}), 404
+
+    width = render_width(request.args.get("width", type=int))
+    renders = job.artifacts.setdefault("renders", {})
+    if width not in renders:
+        with stage("visualization"):
+            renders[width] = render_png(tiles, width)
+    return send_file(BytesIO(renders[width]), mimetype="image/png", max_age=job_queue.result_ttl)
+
+def format_stream_update(snapshot):
+    """Format a streaming session snapshot like the /api/result payload, plus frame counters."""
+    update = {
+        "frames_received": snapshot["frames_received"],
+        "frames_used": snapshot["frames_used"],
+        "clip": snapshot["clip"],
+        "emotions": process_emotions(snapshot["emotion_preds"]) if len(snapshot["emotion_preds"]) else [],
+    }
+    if snapshot["score"] is not None:
+        update["prediction"] = [[snapshot["score"]]]
+        update.update(format_prediction(snapshot["score"]))
+    return update
+
+@app.route("/api/stream", methods=["POST"])
+def open_stream():
+    """Open a streaming session; frames are then posted to /api/stream/<session_id>/frames."""
+    options = request.get_json(silent=True) or {}
+    emit_every = max(1, int(options.get("emit_every", 10)))
+    from StreamingInference import StreamSession
+    mean_X, std_X = model_registry.get("normalization")
+    session = StreamSession(inference_models()[0], model_registry.get("stream_classifier"),
+                            mean_X, std_X, emit_every=emit_every, inference_lock=job_queue.inference_lock)
+    try:
+        model_registry.get("stream_sessions").add(session)
+    except RuntimeError as e:
+        return jsonify({"error": str(e)}), 503
+    return jsonify({"session_id": session.session_id, "emit_every": emit_every}), 201
+
+@app.route("/api/stream/<session_id>/frames", methods=["POST"])
+def push_stream_frames(session_id):
+    """
+    Accept one or more encoded images (multipart field "frames", in capture order).
+    Answers with a rolling update every emit_every frames, otherwise just the counters.
+    """
+    session = model_registry.get("stream_sessions").get(session_id)
+    if session is None:
+        return jsonify({"error": "Unknown stream"}), 404
+
+    frames = []
+    for uploaded_frame in request.files.getlist("frames"):
+        buffer = np.frombuffer(uploaded_frame.read(), dtype=np.uint8)
+        frame = cv2.imdecode(buffer, cv2.IMREAD_COLOR)
+        if frame is None:
+            return jsonify({"error": "Frames must be encoded images (JPEG or PNG)"}), 400
+        frames.append(frame)
+
+    snapshot = session.push_frames(frames)
+    if snapshot is None:
+        return jsonify({"frames_received": session.frames_received, "frames_used": session.frames_used})
+    return jsonify(format_stream_update(snapshot))
+
+@app.route("/api/stream/<session_id>/clip", methods=["POST"])
+def end_stream_clip(session_id):
+    """
+    End the current clip of a stream (e.g. one recorded webcam segment) and return its update;
+    the following frames are scored as a new clip from a fresh state.
+    """
+    session = model_registry.get("stream_sessions").get(session_id)
+    if session is None:
+        return jsonify({"error": "Unknown stream"}), 404
+    return jsonify(format_stream_update(session.end_clip()))
+
+@app.route("/api/stream/<session_id>", methods=["DELETE"])
+def close_stream(session_id):
+    """Close a streaming session and return its final update."""
+    session = model_registry.get("stream_sessions").remove(session_id)
+    if session is None:
+        return jsonify({"error": "Unknown stream"}), 404
+    return jsonify(format_stream_update(session.snapshot()))
+
+@app.route("/api/ready", methods=["GET"])
+def get_ready():
+    """
+    Readiness probe: 200 once the models are loaded and warmed up, 503 while they are still
+    loading or if loading failed. The body reports per-model load times, time to ready and memory.
+    """
+    status = model_registry.status()
+    return jsonify(status), 200 if status["ready"] else 503
+
+@app.route("/metrics", methods=["GET"])
+def get_metrics():
+    """Pipeline stage timings, frame counters and job/cache gauges in the Prometheus text format."""
+    return Response(metrics.render(), mimetype="text/plain; version=0.0.4")
+
+def profiler_api_disabled():
+    return jsonify({"error": "The profiler API is disabled; start the server with DEEPLIE_PROFILER_API=1"}), 404
+
+@app.route("/api/profiler", methods=["GET"])
+def get_profile():
+    """
+    Stacks sampled by the profiler so far, in the folded format of flamegraph.pl and speedscope.
+    Pass ?format=json for the profiler's status instead.
+    """
+    if not PROFILER_API:
+        return profiler_api_disabled()
+    if request.args.get("format") == "json":
+        return jsonify(profiler.status())
+    return Response(profiler.collapsed(), mimetype="text/plain")
+
+@app.route("/api/profiler", methods=["POST"])
+def switch_profiler():
+    """Start ({"enabled": true, "interval": seconds}) or stop ({"enabled": false}) the sampling profiler."""
+    if not PROFILER_API:
+        return profiler_api_disabled()
+    options = request.get_json(silent=True) or {}
+    if options.get("enabled", True):
+        try:
+            interval = float(options.get("interval", DEFAULT_PROFILE_INTERVAL))
+        except (TypeError, ValueError):
+            interval = None
+        if interval is None or not 0.001 <= interval <= 1:
+            return jsonify({"error": "interval must be between 0.001 and 1 seconds"}), 400
+        profiler.start(interval)
+    else:
+        profiler.stop()
+    return jsonify(profiler.status())
 
 @app.route("/api/codebook", methods=["GET"])
 def get_codebook():
-    codebook_path = os.path.join(DATA_PATH, "MU3D", "MU3D Codebook.xlsx")
-    if not os.path.exists(codebook_path):
+    """
+    A page of MU3D codebook rows as JSON. ?sheet= picks "videos" (default, one row per video, with
+    its Subject) or "targets" (one row per person); ?columns=VideoID,Veracity keeps only those
+    columns; any other argument filters on a column, e.g. ?veracity=1&subject=BF001,BF002
+    (comma-separated values match any of them); ?offset= and ?limit= page through the matches.
+    Responses carry an ETag and answer a matching If-None-Match with 304.
+    ?format=xlsx downloads the workbook itself.
+    """
+    if not os.path.exists(codebook.path):
         return jsonify({"error": "Codebook file not found"}), 404
-    
-    return send_file(codebook_path, 
-                    mimetype='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
-                    as_attachment=True,
-                    download_name='MU3D_Codebook.xlsx')
+    if request.args.get("format") == "xlsx":
+        return send_file(codebook.path,
+                        mimetype='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
+                        as_attachment=True,
+                        download_name='MU3D_Codebook.xlsx')
+
+    tables, version = codebook.tables()
+    sheet = request.args.get("sheet", "videos")
+    if sheet not in tables:
+        return jsonify({"error": f"Unknown sheet {sheet!r}; expected one of {', '.join(tables)}"}), 400
+    columns = request.args.get("columns")
+    filters = {name: [value for text in texts for value in text.split(",")]
+               for name, texts in request.args.lists() if name not in CODEBOOK_QUERY_ARGS}
+    try:
+        query = tables[sheet].normalize_query(columns.split(",") if columns else None, filters,
+                                              request.args.get("offset", 0, type=int),
+                                              request.args.get("limit", DEFAULT_PAGE_SIZE, type=int))
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    etag = query_etag(version, sheet, query)
+    if request.if_none_match.contains(etag):
+        response = Response(status=304)
+    else:
+        response = jsonify(dict(tables[sheet].select_page(**query), sheet=sheet))
+    response.set_etag(etag)
+    response.cache_control.no_cache = True  # Revalidated on every use, since the file can change
+    return response
+
+@app.before_request
+def start_model_loading():
+    """
+    Start loading the models in the background with the first request of each serving process, so
+    /api/ready becomes ready under any WSGI server (gunicorn, flask run) and not only under __main__.
+    Loading at import instead would load them in the tools that import this module as a library, and
+    in the debug reloader's watcher process, which never serves.
+    """
+    model_registry.start_background_loading()
 
 if __name__ == '__main__':
-    app.run(debug=True, host="0.0.0.0", port=5001)
\ No newline at end of file
+    debug = True
+    # The debug reloader serves from a child process; only load the models there
+    if not debug or os.environ.get("WERKZEUG_RUN_MAIN") == "true":
+        start_model_loading()
+        if os.environ.get("DEEPLIE_PROFILE") == "1":
+            profiler.start()
+    app.run(debug=debug, host="0.0.0.0", port=5001)
\ No newline at end of file
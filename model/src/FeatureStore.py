@@ -0,0 +1,364 @@
+"""
+Persistent store of the per-video features the GRU models are trained on, so that experiments and
+leave-one-subject-out folds over MU3D stop cropping and encoding every video again.
+
+For each video the store keeps the (300, 4608) FER encodings and the (300, 7) emotion softmax
+sequence that /api/predict computes, with the Veracity (label) and Valence of the MU3D codebook.
+Videos are grouped into one chunk per subject, the target ID before the underscore (BF001 of BF001_1PT):
+
+    index.json                           parameters, model digest, videos and the chunk of each subject
+    chunks/<subject>.<n>.encodings.npy   (videos, 300, 4608) float32
+    chunks/<subject>.<n>.emotions.npy    (videos, 300, 7) float32
+
+Chunks are opened with np.load(mmap_mode="r"), so a subject's features are views of the page cache
+rather than copies, and several subjects' (e.g. the training side of a fold) are a StackedArray of
+those views. Updates are incremental: only videos that are new or whose contents changed are
+processed, and only the chunks of their subjects are rewritten. Changing the preprocessing parameters
+or the FER model recomputes everything.
+
+Build or update a store from model/src:
+    python FeatureStore.py STORE_DIR [--videos ../data/MU3D/Videos] [--workers N] [--batch-size 8]
+"""
+import argparse
+import json
+import os
+import tempfile
+from collections import Counter, namedtuple
+
+import numpy as np
+
+from constants import FER_MODEL_PATH, MEAN_X_PATH, MU3D_CODEBOOK_PATH, MU3D_VIDEOS_PATH, STD_X_PATH, subject_of
+from ResultCache import hash_file, model_identity
+
+# Bump when the layout changes; a store of another version is rebuilt
+STORE_VERSION = 1
+
+INDEX_FILE = "index.json"
+CHUNK_DIR = "chunks"
+CHUNK_ARRAYS = ("encodings", "emotions")
+
+# Features of a list of videos; the arrays share the video order of video_ids
+Features = namedtuple("Features", ["video_ids", "subjects", "encodings", "emotions", "labels", "valence"])
+
+class StackedArray:
+    """
+    Read-only concatenation along the first axis of arrays with the same trailing shape, such as the
+    memory-mapped chunks of several subjects, without copying them. Indexing the first axis with an
+    integer returns a view of the part holding that row; slices, boolean masks and index arrays
+    gather just the selected rows into a new array, like np.concatenate(parts)[key] would.
+    """
+
+    def __init__(self, parts):
+        if not parts:
+            raise ValueError("A StackedArray needs at least one part")
+        self.parts = list(parts)
+        self.offsets = np.cumsum([0] + [len(part) for part in self.parts])
+        self.shape = (int(self.offsets[-1]),) + self.parts[0].shape[1:]
+        self.dtype = self.parts[0].dtype
+        self.ndim = len(self.shape)
+
+    def __len__(self):
+        return self.shape[0]
+
+    def __getitem__(self, key):
+        rows, rest = (key[0], key[1:]) if isinstance(key, tuple) else (key, ())
+        if isinstance(rows, (int, np.integer)):
+            row = rows + len(self) if rows < 0 else rows
+            if not 0 <= row < len(self):
+                raise IndexError(f"index {rows} is out of bounds for axis 0 with size {len(self)}")
+            part = np.searchsorted(self.offsets, row, side="right") - 1
+            return self.parts[part][(row - self.offsets[part],) + rest]
+
+        indices = np.arange(len(self))[rows]
+        trailing = np.empty((0,) + self.shape[1:], dtype=self.dtype)[(slice(None),) + rest].shape[1:]
+        out = np.empty((len(indices),) + trailing, dtype=self.dtype)
+        part_of_row = np.searchsorted(self.offsets, indices, side="right") - 1
+        for part in np.unique(part_of_row):
+            selected = part_of_row == part
+            out[selected] = self.parts[part][(indices[selected] - self.offsets[part],) + rest]
+        return out
+
+    def __array__(self, dtype=None, copy=None):
+        array = self[:]
+        return array if dtype is None else array.astype(dtype, copy=False)
+
+def load_codebook(path=MU3D_CODEBOOK_PATH):
+    """{video_id: {"label": Veracity (1 truthful), "valence": Valence (1 positive)}} from the MU3D codebook."""
+    import pandas as pd
+    video_data = pd.read_excel(path, sheet_name="Video-Level Data")
+    return {row.VideoID: {"label": int(row.Veracity), "valence": int(row.Valence)} for row in video_data.itertuples()}
+
+def empty_index(params=None, model_digest=None):
+    return {"version": STORE_VERSION, "params": params, "model_digest": model_digest, "generation": 0,
+            "videos": {}, "subjects": {}}
+
+class FeatureStore:
+    """
+    A store directory (see the module docstring). Reading needs only numpy; update() fills it
+    from any encoder, and build_store() from the videos and codebook with the server's models.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._chunks = {}
+        try:
+            with open(os.path.join(path, INDEX_FILE)) as f:
+                self.index = json.load(f)
+        except FileNotFoundError:
+            self.index = empty_index()
+        if self.index.get("version") != STORE_VERSION:
+            self.index = empty_index()
+
+    def __len__(self):
+        return sum(len(chunk["videos"]) for chunk in self.index["subjects"].values())
+
+    @property
+    def subjects(self):
+        """Subjects with at least one stored video, sorted."""
+        return sorted(self.index["subjects"])
+
+    @property
+    def failed(self):
+        """{video_id: error} of the videos that could not be encoded (e.g. no face found)."""
+        return {video_id: entry["error"] for video_id, entry in self.index["videos"].items() if "error" in entry}
+
+    def _chunk_path(self, chunk, name):
+        return os.path.join(self.path, CHUNK_DIR, f"{chunk}.{name}.npy")
+
+    def _chunk_arrays(self, subject):
+        chunk = self.index["subjects"][subject]["chunk"]
+        if chunk not in self._chunks:
+            self._chunks[chunk] = {name: np.load(self._chunk_path(chunk, name), mmap_mode="r") for name in CHUNK_ARRAYS}
+        return self._chunks[chunk]
+
+    def subject(self, subject):
+        """Features of one subject's videos; encodings and emotions are read-only memory maps, nothing is copied."""
+        video_ids = self.index["subjects"][subject]["videos"]
+        arrays = self._chunk_arrays(subject)
+        entries = [self.index["videos"][video_id] for video_id in video_ids]
+        return Features(list(video_ids), [subject] * len(video_ids), arrays["encodings"], arrays["emotions"],
+                        np.array([entry["label"] for entry in entries]),
+                        np.array([entry["valence"] for entry in entries]))
+
+    def features(self, subjects=None):
+        """Features of the videos of subjects (default: all), by subject, gathered into in-memory arrays."""
+        parts = [self.subject(subject) for subject in (self.subjects if subjects is None else subjects)]
+        if not parts:
+            raise ValueError("No stored videos to gather")
+        return Features([video_id for part in parts for video_id in part.video_ids],
+                        [subject for part in parts for subject in part.subjects],
+                        np.concatenate([part.encodings for part in parts]),
+                        np.concatenate([part.emotions for part in parts]),
+                        np.concatenate([part.labels for part in parts]),
+                        np.concatenate([part.valence for part in parts]))
+
+    def stacked(self, subjects=None):
+        """
+        Features of the videos of subjects (default: all), by subject, whose encodings and emotions are
+        StackedArrays of the subjects' memory maps: nothing but the labels is copied.
+        """
+        parts = [self.subject(subject) for subject in (self.subjects if subjects is None else subjects)]
+        if not parts:
+            raise ValueError("No stored videos to gather")
+        return Features([video_id for part in parts for video_id in part.video_ids],
+                        [subject for part in parts for subject in part.subjects],
+                        StackedArray([part.encodings for part in parts]),
+                        StackedArray([part.emotions for part in parts]),
+                        np.concatenate([part.labels for part in parts]),
+                        np.concatenate([part.valence for part in parts]))
+
+    def leave_one_subject_out(self, subjects=None):
+        """
+        Yield (subject, train, test) for each subject: test holds that subject's memory-mapped
+        features and train those of every other subject, stacked without copying (see stacked()).
+        """
+        subjects = self.subjects if subjects is None else list(subjects)
+        for held_out in subjects:
+            yield held_out, self.stacked([subject for subject in subjects if subject != held_out]), self.subject(held_out)
+
+    def update(self, videos, params, model_digest, encode, log=print):
+        """
+        Bring the store up to date with videos, {video_id: {"path", "label", "valence"}}.
+        encode(paths) must yield (path, encodings, emotions, error) for each path in order, with
+        error set instead of the arrays when a video cannot be used. Only new and changed videos
+        are passed to it; videos no longer listed are dropped. The index is saved after each
+        subject's chunk is written, so an interrupted update resumes where it stopped.
+        Returns counts of computed, failed, unchanged and removed videos.
+        """
+        if (self.index["params"], self.index["model_digest"]) != (params, model_digest):
+            if self.index["videos"]:
+                log("Preprocessing parameters or models changed; recomputing every video")
+            self._clear(params, model_digest)
+        known = self.index["videos"]
+
+        # Files are unchanged if their size and modification time, or else their contents, are
+        stale = {}
+        for video_id, video in videos.items():
+            stat = os.stat(video["path"])
+            entry = known.get(video_id)
+            if entry is not None and (entry["size"], entry["mtime_ns"]) == (stat.st_size, stat.st_mtime_ns):
+                continue
+            digest = hash_file(video["path"])
+            if entry is not None and entry["sha256"] == digest:
+                entry.update(size=stat.st_size, mtime_ns=stat.st_mtime_ns)
+                continue
+            stale[video_id] = {"subject": subject_of(video_id), "label": video["label"], "valence": video["valence"],
+                               "size": stat.st_size, "mtime_ns": stat.st_mtime_ns, "sha256": digest}
+        removed = [video_id for video_id in known if video_id not in videos]
+        summary = {"computed": 0, "failed": 0, "unchanged": len(videos) - len(stale), "removed": len(removed)}
+
+        for subject in {subject_of(video_id) for video_id in removed} - {entry["subject"] for entry in stale.values()}:
+            self._write_subject(subject, videos, {}, {})
+
+        # Videos are encoded by subject, so each subject's chunk is rewritten once its last video is done
+        order = sorted(stale, key=lambda video_id: (subject_of(video_id), video_id))
+        pending = Counter(subject_of(video_id) for video_id in order)
+        ids_by_path = {videos[video_id]["path"]: video_id for video_id in order}
+        computed = {}
+        for path, encodings, emotions, error in encode([videos[video_id]["path"] for video_id in order]):
+            video_id = ids_by_path[path]
+            if error is None:
+                computed[video_id] = {"encodings": encodings, "emotions": emotions}
+                summary["computed"] += 1
+            else:
+                stale[video_id]["error"] = error
+                summary["failed"] += 1
+                log(f"{video_id}: {error}")
+            subject = subject_of(video_id)
+            pending[subject] -= 1
+            if pending[subject] == 0:
+                done = {other: entry for other, entry in stale.items() if entry["subject"] == subject}
+                self._write_subject(subject, videos, done, computed)
+                computed = {}
+
+        # Codebook corrections only change the index
+        for video_id, video in videos.items():
+            known[video_id].update(label=video["label"], valence=video["valence"])
+        self._save_index()
+        return summary
+
+    def _write_subject(self, subject, videos, new_entries, computed):
+        """Rewrite a subject's chunk with its kept and newly computed videos, then point the index at it."""
+        known = self.index["videos"]
+        previous = self.index["subjects"].get(subject)
+        previous_rows = {video_id: row for row, video_id in enumerate(previous["videos"])} if previous else {}
+        video_ids = sorted(video_id for video_id in videos if subject_of(video_id) == subject and (
+            video_id in computed or (video_id not in new_entries and video_id in previous_rows)))
+
+        if video_ids:
+            self.index["generation"] += 1
+            chunk = f"{subject}.{self.index['generation']}"
+            os.makedirs(os.path.join(self.path, CHUNK_DIR), exist_ok=True)
+            old_arrays = self._chunk_arrays(subject) if previous else None
+            for name in CHUNK_ARRAYS:
+                first = computed[video_ids[0]][name] if video_ids[0] in computed else old_arrays[name][0]
+                out = np.lib.format.open_memmap(self._chunk_path(chunk, name), mode="w+", dtype=np.float32,
+                                                shape=(len(video_ids),) + np.shape(first))
+                for row, video_id in enumerate(video_ids):
+                    out[row] = computed[video_id][name] if video_id in computed else old_arrays[name][previous_rows[video_id]]
+                out.flush()
+                del out
+            self.index["subjects"][subject] = {"chunk": chunk, "videos": video_ids}
+        else:
+            self.index["subjects"].pop(subject, None)
+
+        for video_id in [video_id for video_id, entry in known.items()
+                         if entry["subject"] == subject and video_id not in videos]:
+            del known[video_id]
+        known.update(new_entries)
+        self._save_index()
+        if previous:
+            self._remove_chunk(previous["chunk"])
+
+    def _remove_chunk(self, chunk):
+        self._chunks.pop(chunk, None)
+        for name in CHUNK_ARRAYS:
+            try:
+                os.remove(self._chunk_path(chunk, name))
+            except FileNotFoundError:
+                pass
+
+    def _clear(self, params, model_digest):
+        chunks = [entry["chunk"] for entry in self.index["subjects"].values()]
+        self.index = empty_index(params, model_digest)
+        os.makedirs(self.path, exist_ok=True)
+        self._save_index()
+        for chunk in chunks:
+            self._remove_chunk(chunk)
+
+    def _save_index(self):
+        # Written to a temporary file and renamed, so readers never see a partial index
+        fd, temp_path = tempfile.mkstemp(dir=self.path, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "w") as f:
+                json.dump(self.index, f, indent=1, sort_keys=True)
+            os.replace(temp_path, os.path.join(self.path, INDEX_FILE))
+        except BaseException:
+            os.remove(temp_path)
+            raise
+
+def encode_videos(paths, workers=None, batch_size=None):
+    """
+    Crop and encode videos with the server's preprocessing and FER model, yielding
+    (path, encodings, emotions, error) in order; cropping runs in BatchInference's worker pool.
+    """
+    import DeepLie
+    from BatchInference import DEFAULT_VIDEO_BATCH_SIZE, default_crop_workers, encode_batch, iter_batches, iter_crops
+
+    batch_size = batch_size or DEFAULT_VIDEO_BATCH_SIZE
+    workers = default_crop_workers() if workers is None else workers
+    crops = iter_crops(paths, DeepLie.PREPROCESSING_PARAMS, workers, prefetch=batch_size)
+    models = None
+    for batch in iter_batches(crops, batch_size):
+        cropped = [(path, frames) for path, frames, error in batch if error is None]
+        features = {}
+        if cropped:
+            if models is None:
+                models = (DeepLie.model_registry.get("fer_engine"),) + DeepLie.model_registry.get("normalization")
+            _, emotion_preds, encodings = encode_batch([frames for _, frames in cropped], *models)
+            features = {path: (encodings[idx], emotion_preds[idx]) for idx, (path, _) in enumerate(cropped)}
+        for path, _, error in batch:
+            yield (path, *features[path], None) if error is None else (path, None, None, error)
+
+def store_params():
+    """Preprocessing parameters and FER model digest the store's features depend on."""
+    import DeepLie
+    return DeepLie.analysis_params("keras"), model_identity([FER_MODEL_PATH, MEAN_X_PATH, STD_X_PATH])
+
+def build_store(store_dir, videos_dir=MU3D_VIDEOS_PATH, codebook_path=MU3D_CODEBOOK_PATH, workers=None,
+                batch_size=None, log=print):
+    """Create or update the store at store_dir from the codebook's videos found in videos_dir."""
+    from BatchInference import find_videos
+
+    codebook = load_codebook(codebook_path)
+    videos, unlabeled = {}, 0
+    for path in find_videos([videos_dir]):
+        video_id = os.path.splitext(os.path.basename(path))[0]
+        if video_id in codebook:
+            videos[video_id] = dict(codebook[video_id], path=path)
+        else:
+            unlabeled += 1
+    if unlabeled:
+        log(f"Skipping {unlabeled} videos that are not in the codebook")
+
+    store = FeatureStore(store_dir)
+    params, model_digest = store_params()
+    summary = store.update(videos, params, model_digest, lambda paths: encode_videos(paths, workers, batch_size), log)
+    return store, summary
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("store", help="Store directory (created if missing)")
+    parser.add_argument("--videos", default=MU3D_VIDEOS_PATH, help="Directory of MU3D videos")
+    parser.add_argument("--codebook", default=MU3D_CODEBOOK_PATH, help="MU3D codebook (.xlsx)")
+    parser.add_argument("--workers", type=int, default=None,
+                        help="Crop processes (default: cores - 1; 0 crops in this process)")
+    parser.add_argument("--batch-size", type=int, default=None, help="Videos per FER call")
+    args = parser.parse_args()
+
+    store, summary = build_store(args.store, args.videos, args.codebook, args.workers, args.batch_size)
+    print(f"{summary['computed']} encoded, {summary['unchanged']} unchanged, {summary['failed']} failed, "
+          f"{summary['removed']} removed; {len(store)} videos of {len(store.subjects)} subjects in {args.store}")
+
+if __name__ == "__main__":
+    main()
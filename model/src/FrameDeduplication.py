@@ -0,0 +1,110 @@
+import cv2
+import numpy as np
+
+# SSIM parameters matching skimage.metrics.structural_similarity defaults for uint8 grayscale images
+SSIM_WIN_SIZE = 7
+SSIM_DATA_RANGE = 255
+SSIM_C1 = (0.01 * SSIM_DATA_RANGE) ** 2
+SSIM_C2 = (0.03 * SSIM_DATA_RANGE) ** 2
+SSIM_COV_NORM = SSIM_WIN_SIZE ** 2 / (SSIM_WIN_SIZE ** 2 - 1)  # Sample covariance, as skimage uses by default
+
+# Side length of the thumbnails compared by the pre-filter
+THUMBNAIL_SIZE = 16
+
+# Mean-removed thumbnail difference (gray levels) above which frames are kept without computing SSIM
+DEFAULT_DIFFERENT_MAD = 48.0
+
+# Window centres whose 7x7 window lies inside the image; skimage averages the SSIM map over these only
+SSIM_PAD = (SSIM_WIN_SIZE - 1) // 2
+SSIM_INTERIOR = (slice(SSIM_PAD, -SSIM_PAD), slice(SSIM_PAD, -SSIM_PAD))
+
+class SSIMReference:
+    """
+    Grayscale image with the local statistics SSIM needs, computed once and reused for every comparison.
+    The statistics are kept for the interior window centres only, the part of the SSIM map that is averaged.
+    """
+
+    def __init__(self, gray):
+        self.gray = gray
+        self.image = gray.astype(np.float64)
+        self.mean = box_filter(self.image)[SSIM_INTERIOR]
+        self.mean_sq = self.mean * self.mean
+        self.variance = SSIM_COV_NORM * (box_filter(self.image * self.image)[SSIM_INTERIOR] - self.mean_sq)
+        thumbnail = cv2.resize(gray, (THUMBNAIL_SIZE, THUMBNAIL_SIZE), interpolation=cv2.INTER_AREA).astype(np.float32)
+        self.thumbnail = thumbnail - thumbnail.mean()
+
+    def ssim(self, other):
+        """
+        Mean SSIM against another SSIMReference, equal to skimage's structural_similarity. Only the
+        interior of the SSIM map is computed, in place, and reduced straight to its mean.
+        """
+        # 2 * covariance + C2
+        contrast = box_filter(self.image * other.image)[SSIM_INTERIOR]
+        luminance = self.mean * other.mean
+        contrast -= luminance
+        contrast *= 2 * SSIM_COV_NORM
+        contrast += SSIM_C2
+        # (2 * mean_x * mean_y + C1) * (2 * covariance + C2)
+        luminance *= 2
+        luminance += SSIM_C1
+        luminance *= contrast
+        # (mean_x^2 + mean_y^2 + C1) * (variance_x + variance_y + C2)
+        np.add(self.variance, other.variance, out=contrast)
+        contrast += SSIM_C2
+        denominator = self.mean_sq + other.mean_sq
+        denominator += SSIM_C1
+        denominator *= contrast
+        luminance /= denominator
+        return luminance.mean()
+
+    def thumbnail_difference(self, other):
+        """Mean absolute difference between the mean-removed 16x16 thumbnails of both images."""
+        return np.abs(self.thumbnail - other.thumbnail).mean()
+
+def box_filter(image):
+    """Uniform 7x7 local mean, as used by SSIM."""
+    return cv2.boxFilter(image, -1, (SSIM_WIN_SIZE, SSIM_WIN_SIZE), borderType=cv2.BORDER_REFLECT)
+
+class FrameDeduplicator:
+    """
+    Keeps a face crop only if its SSIM against the last kept crop is below ssim_threshold.
+    The last kept crop's grayscale and local statistics are cached, and the SSIM map is
+    reduced to its mean without being returned. Two pre-filters skip SSIM entirely:
+    byte-identical crops are dropped, and crops whose mean-removed thumbnails differ by more
+    than different_mad gray levels are kept. Set prefilter=False to always compute SSIM.
+    """
+
+    def __init__(self, ssim_threshold=0.9, prefilter=True, different_mad=DEFAULT_DIFFERENT_MAD):
+        self.ssim_threshold = ssim_threshold
+        self.prefilter = prefilter
+        self.different_mad = different_mad
+        self.reference = None
+        self.ssim_computed = 0
+        self.prefiltered = 0
+
+    def reset(self):
+        """Forget the last kept crop, e.g. at the start of a new video."""
+        self.reference = None
+
+    def accept(self, face_crop):
+        """Return True if the BGR crop should be kept; a kept crop becomes the new reference."""
+        gray = cv2.cvtColor(face_crop, cv2.COLOR_BGR2GRAY)
+        if self.reference is None:
+            self.reference = SSIMReference(gray)
+            return True
+
+        if self.prefilter and np.array_equal(gray, self.reference.gray):
+            self.prefiltered += 1
+            return False
+
+        candidate = SSIMReference(gray)
+        if self.prefilter and self.reference.thumbnail_difference(candidate) > self.different_mad:
+            self.prefiltered += 1
+            keep = True
+        else:
+            self.ssim_computed += 1
+            keep = self.reference.ssim(candidate) < self.ssim_threshold
+
+        if keep:
+            self.reference = candidate
+        return keep
@@ -0,0 +1,52 @@
+import math
+
+import numpy as np
+
+# Decode at most this many times target_frames frames; the rest are skipped with grab()
+DEFAULT_DECODE_OVERSAMPLE = 4
+
+class FrameSampler:
+    """
+    Bounded-memory stand-in for collecting every kept crop and resampling with np.linspace.
+    Offered frames go into a preallocated buffer of 2 * target_frames slots. When it fills up,
+    every other stored frame is dropped and from then on only every stride-th offered frame is
+    stored, so the buffer always holds a uniform subsample of the whole stream. Memory stays
+    O(target_frames) regardless of video length; for streams that never fill the buffer the
+    result is identical to resampling the full list.
+    """
+
+    def __init__(self, target_frames, frame_shape=(128, 128, 3), dtype=np.uint8):
+        self.target_frames = target_frames
+        self.buffer = np.empty((2 * target_frames,) + tuple(frame_shape), dtype=dtype)
+        self.size = 0
+        self.stride = 1
+        self.offered = 0
+
+    def add(self, frame):
+        """Offer the next kept frame in stream order."""
+        if self.offered % self.stride == 0:
+            if self.size == len(self.buffer):
+                # The buffer holds frames 0, s, ..., (2T - 1)s, so this frame (2Ts) also lands on the doubled stride
+                half = self.size // 2
+                self.buffer[:half] = self.buffer[0:self.size:2]
+                self.size = half
+                self.stride *= 2
+            self.buffer[self.size] = frame
+            self.size += 1
+        self.offered += 1
+
+    def frames(self):
+        """The stored frames in stream order (a view into the buffer)."""
+        return self.buffer[:self.size]
+
+    def __len__(self):
+        return self.size
+
+def decode_stride(frame_count, max_decoded_frames):
+    """
+    Decode every decode_stride-th frame so that at most max_decoded_frames frames are decoded.
+    Returns 1 when the container does not report a frame count.
+    """
+    if frame_count <= 0:
+        return 1
+    return max(1, math.ceil(frame_count / max_decoded_frames))
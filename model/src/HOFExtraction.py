@@ -0,0 +1,192 @@
+"""
+Histogram-of-optical-flow (HOF) features of consecutive face crops.
+
+Each pair of frames gets a dense Farneback flow, and each cell of a 4x4 grid over it gets a histogram
+of flow magnitude (over 0 to the cell's largest magnitude) and one of flow direction (over 0-360
+degrees), each normalised to sum to 1. The features are the same as the precomputed_hof_100 arrays
+made by notebooks/cnn/preprocess/HOF_100.ipynb, but every frame is converted to grayscale once
+instead of once per pair, and the histograms of all cells are binned together with np.bincount
+instead of one np.histogram call per cell.
+
+Run from model/src to write <sample>_hof.npy for every folder of frame_XXXX.png crops (the output
+of process_video), or with --videos for every video, cropped in memory:
+    python HOFExtraction.py DATASET_DIR OUTPUT_DIR [--videos] [--target-frames 100]
+"""
+import argparse
+import functools
+import os
+
+import cv2
+import numpy as np
+
+from Metrics import stage
+
+DEFAULT_MAG_BINS = 30
+DEFAULT_ANGLE_BINS = 36
+DEFAULT_GRID_SIZE = (4, 4)
+
+# cv2.calcOpticalFlowFarneback parameters used for the precomputed datasets
+FARNEBACK_PARAMS = dict(pyr_scale=0.5, levels=3, winsize=15, iterations=3, poly_n=5, poly_sigma=1.2, flags=0)
+
+@functools.lru_cache(maxsize=8)
+def grid_cell_index(height, width, grid_size=DEFAULT_GRID_SIZE):
+    """
+    (cells, pixels per cell) flat pixel indices of every grid cell, cells in row-major order.
+    Rows and columns past the last whole cell, when the frame size is not a multiple of the grid, belong to no cell.
+    """
+    cell_h, cell_w = height // grid_size[0], width // grid_size[1]
+    rows = np.arange(grid_size[0] * cell_h).reshape(grid_size[0], 1, cell_h, 1)
+    cols = np.arange(grid_size[1] * cell_w).reshape(1, grid_size[1], 1, cell_w)
+    index = rows * width + cols
+    index.flags.writeable = False
+    return index.reshape(grid_size[0] * grid_size[1], cell_h * cell_w)
+
+def uniform_bin_index(values, first_edge, last_edge, bins):
+    """
+    Index of each value among bins equal bins from first_edge to last_edge, the last bin including
+    last_edge. values is (cells, n) float32 and the edges are (cells,) float32, one range per cell.
+    Uses np.histogram's float32 arithmetic and edge corrections, so the counts equal its own.
+    """
+    first_edge, last_edge = first_edge[:, None], last_edge[:, None]
+    edges = np.linspace(first_edge.astype(np.float64), last_edge.astype(np.float64), bins + 1, axis=1)
+    edges = edges[..., 0].astype(np.float32)
+    index = ((values - first_edge) / (last_edge - first_edge) * np.float32(bins)).astype(np.intp)
+    index[index == bins] -= 1
+
+    # The division can land one bin off within an ULP of an edge
+    rows = np.arange(len(values))[:, None]
+    index[values < edges[rows, index]] -= 1
+    index[(values >= edges[rows, index + 1]) & (index != bins - 1)] += 1
+    return index
+
+def cell_histograms(bin_index, bins):
+    """(cells, bins) counts of per-cell bin indices, from one np.bincount over cell * bins + bin."""
+    cells = len(bin_index)
+    offsets = np.arange(cells)[:, None] * bins
+    return np.bincount((bin_index + offsets).ravel(), minlength=cells * bins).reshape(cells, bins)
+
+def spatial_histograms(flow, num_mag_bins=DEFAULT_MAG_BINS, num_angle_bins=DEFAULT_ANGLE_BINS,
+                       grid_size=DEFAULT_GRID_SIZE):
+    """
+    HOF features of one (H, W, 2) flow: for each grid cell, num_mag_bins magnitude then num_angle_bins
+    angle frequencies, as a (cells * (num_mag_bins + num_angle_bins),) float32 array.
+    """
+    height, width, _ = flow.shape
+    cell_index = grid_cell_index(height, width, tuple(grid_size))
+    magnitude, angle = cv2.cartToPolar(flow[..., 0], flow[..., 1])
+    magnitude = magnitude.ravel()[cell_index]
+    angle = np.degrees(angle.ravel()[cell_index]) % 360
+
+    # Magnitudes are binned up to each cell's maximum; np.histogram widens an empty range to +-0.5
+    top = magnitude.max(axis=1)
+    flat = top == 0
+    mag_bins = uniform_bin_index(magnitude, np.where(flat, -0.5, 0).astype(np.float32),
+                                 np.where(flat, 0.5, top).astype(np.float32), num_mag_bins)
+    cells = len(cell_index)
+    angle_bins = uniform_bin_index(angle, np.zeros(cells, np.float32), np.full(cells, 360, np.float32),
+                                   num_angle_bins)
+
+    # Every pixel of a cell falls in one bin, so each histogram sums to the cell's pixel count
+    pixels = np.float32(cell_index.shape[1])
+    features = np.concatenate([cell_histograms(mag_bins, num_mag_bins).astype(np.float32) / pixels,
+                               cell_histograms(angle_bins, num_angle_bins).astype(np.float32) / pixels], axis=1)
+    return features.ravel()
+
+class HOFExtractor:
+    """
+    Streams HOF features over frames: push() each BGR frame in order and get the features of the
+    flow from the previous frame, or None for the first. The previous frame is kept in grayscale,
+    so each frame is converted once.
+    """
+
+    def __init__(self, num_mag_bins=DEFAULT_MAG_BINS, num_angle_bins=DEFAULT_ANGLE_BINS, grid_size=DEFAULT_GRID_SIZE):
+        self.num_mag_bins = num_mag_bins
+        self.num_angle_bins = num_angle_bins
+        self.grid_size = tuple(grid_size)
+        self.previous = None
+
+    @property
+    def feature_size(self):
+        return self.grid_size[0] * self.grid_size[1] * (self.num_mag_bins + self.num_angle_bins)
+
+    def reset(self):
+        """Forget the previous frame, e.g. at the start of a new video."""
+        self.previous = None
+
+    def push(self, frame):
+        gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+        previous, self.previous = self.previous, gray
+        if previous is None:
+            return None
+        with stage("optical_flow"):
+            flow = cv2.calcOpticalFlowFarneback(previous, gray, None, **FARNEBACK_PARAMS)
+        with stage("hof"):
+            return spatial_histograms(flow, self.num_mag_bins, self.num_angle_bins, self.grid_size)
+
+def iter_hof_features(frames, **params):
+    """Yield the HOF features of each consecutive pair of an iterable of BGR frames, e.g. a crop generator."""
+    extractor = HOFExtractor(**params)
+    for frame in frames:
+        features = extractor.push(frame)
+        if features is not None:
+            yield features
+
+def extract_hof_features(frames, **params):
+    """(len(frames) - 1, features) float32 HOF array of a sequence of BGR frames; empty with fewer than two."""
+    extractor = HOFExtractor(**params)
+    features = np.empty((max(0, len(frames) - 1), extractor.feature_size), dtype=np.float32)
+    for idx, frame in enumerate(frames):
+        pair_features = extractor.push(frame)
+        if pair_features is not None:
+            features[idx - 1] = pair_features
+    return features
+
+def video_hof_features(video_path, target_frames=100, **params):
+    """HOF features of the target_frames face crops that extract_face_crops samples from a video."""
+    from MediaPipeCropping import extract_face_crops
+    _, frames = extract_face_crops(video_path, target_frames=target_frames)
+    return extract_hof_features(frames, **params)
+
+def frame_folder_hof_features(frame_folder, **params):
+    """HOF features of a folder of frames read in sorted filename order, or None if it has fewer than two."""
+    frame_files = sorted(os.listdir(frame_folder))
+    if len(frame_files) < 2:
+        print(f"Skipping {frame_folder}, not enough frames.")
+        return None
+    frames = (cv2.imread(os.path.join(frame_folder, name)) for name in frame_files)
+    features = list(iter_hof_features((frame for frame in frames if frame is not None), **params))
+    return np.array(features, dtype=np.float32)
+
+def preprocess_dataset(dataset_path, output_path, videos=False, target_frames=100, **params):
+    """Save <sample>_hof.npy in output_path for every frame folder (or, with videos, every video) in dataset_path."""
+    os.makedirs(output_path, exist_ok=True)
+    for name in sorted(os.listdir(dataset_path)):
+        sample_path = os.path.join(dataset_path, name)
+        if videos:
+            if not os.path.isfile(sample_path):
+                continue
+            features = video_hof_features(sample_path, target_frames, **params)
+            name = os.path.splitext(name)[0]
+        elif os.path.isdir(sample_path):
+            features = frame_folder_hof_features(sample_path, **params)
+        else:
+            continue
+        if features is not None and len(features):
+            np.save(os.path.join(output_path, f"{name}_hof.npy"), features)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("dataset", help="Directory of frame folders, or of videos with --videos")
+    parser.add_argument("output", help="Directory for the <sample>_hof.npy files")
+    parser.add_argument("--videos", action="store_true", help="Crop faces from videos instead of reading frame folders")
+    parser.add_argument("--target-frames", type=int, default=100, help="Crops sampled per video with --videos")
+    parser.add_argument("--mag-bins", type=int, default=DEFAULT_MAG_BINS)
+    parser.add_argument("--angle-bins", type=int, default=DEFAULT_ANGLE_BINS)
+    args = parser.parse_args()
+
+    preprocess_dataset(args.dataset, args.output, args.videos, args.target_frames,
+                       num_mag_bins=args.mag_bins, num_angle_bins=args.angle_bins)
+    print("HOF preprocessing completed!")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,66 @@
+import cv2
+import numpy as np
+import tensorflow as tf
+
+# Frames per forward pass; 300 keeps a standard request to a single pass
+DEFAULT_BATCH_SIZE = 300
+
+# Side length of the grayscale frames the FER CNN was trained on
+FER_INPUT_SIZE = 48
+
+def preprocess_frames(frames, mean_X, std_X):
+    """Convert BGR face crops to normalized (N, 48, 48, 1) float32 FER inputs."""
+    frames_processed = np.empty((len(frames), FER_INPUT_SIZE, FER_INPUT_SIZE, 1), dtype=np.float32)
+    for idx, frame in enumerate(frames):
+        resized = cv2.resize(frame, (FER_INPUT_SIZE, FER_INPUT_SIZE))
+        frames_processed[idx, :, :, 0] = cv2.cvtColor(resized, cv2.COLOR_BGR2GRAY)
+    return (frames_processed - mean_X) / (std_X + 1e-8)
+
+def fer_multi_output_model(fer_model, encoding_layer='flatten'):
+    """The FER model with a second output exposing the encoding layer: (emotion softmax, encodings)."""
+    return tf.keras.Model(
+        inputs=fer_model.inputs,
+        outputs=[fer_model.outputs[0], fer_model.get_layer(encoding_layer).output]
+    )
+
+class FERInferenceEngine:
+    """
+    Persistent FER inference engine, built once at load time.
+    A single compiled forward pass returns both the emotion softmax and the
+    flatten-layer encodings, so the convolutional trunk only runs once per frame.
+    """
+
+    def __init__(self, fer_model, encoding_layer='flatten', batch_size=DEFAULT_BATCH_SIZE):
+        self.batch_size = batch_size
+        self.input_shape = tuple(fer_model.inputs[0].shape[1:])
+        self.num_emotions = fer_model.outputs[0].shape[-1]
+        self.encoding_dim = fer_model.get_layer(encoding_layer).output.shape[-1]
+
+        multi_output_model = fer_multi_output_model(fer_model, encoding_layer)
+
+        @tf.function(input_signature=[tf.TensorSpec(shape=(None,) + self.input_shape, dtype=tf.float32)])
+        def forward(frames):
+            return multi_output_model(frames, training=False)
+
+        self._forward = forward
+
+    def run(self, frames_processed, progress_callback=None):
+        """
+        Run normalized (N, 48, 48, 1) frames through the FER CNN.
+        Returns (emotion_preds, encodings) as (N, 7) and (N, 4608) float32 arrays.
+        progress_callback, if given, is called with the fraction of frames done after each batch.
+        """
+        total = len(frames_processed)
+        emotion_preds = np.empty((total, self.num_emotions), dtype=np.float32)
+        encodings = np.empty((total, self.encoding_dim), dtype=np.float32)
+
+        for start in range(0, total, self.batch_size):
+            end = min(start + self.batch_size, total)
+            batch = tf.convert_to_tensor(frames_processed[start:end], dtype=tf.float32)
+            batch_emotions, batch_encodings = self._forward(batch)
+            emotion_preds[start:end] = batch_emotions.numpy()
+            encodings[start:end] = batch_encodings.numpy()
+            if progress_callback is not None:
+                progress_callback(end / total)
+
+        return emotion_preds, encodings
@@ -0,0 +1,147 @@
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+# Job lifecycle states
+JOB_QUEUED = "queued"
+JOB_RUNNING = "running"
+JOB_DONE = "done"
+JOB_FAILED = "failed"
+JOB_CANCELLED = "cancelled"
+
+def default_worker_count():
+    """
+    Number of concurrent pipeline workers. TensorFlow and MediaPipe already spread each
+    stage over several cores, so only use about half the cores unless DEEPLIE_WORKERS is set.
+    """
+    configured = os.environ.get("DEEPLIE_WORKERS")
+    if configured:
+        return max(1, int(configured))
+    return max(1, (os.cpu_count() or 2) // 2)
+
+class QueueFullError(Exception):
+    """Raised when the number of pending jobs has reached the queue bound."""
+
+class JobCancelledError(Exception):
+    """Raised by a job body that stopped because its result is no longer needed; the job ends cancelled, not failed."""
+
+class Job:
+    """State of one analysis job: its current stage, progress, and result or error."""
+
+    def __init__(self, job_id):
+        self.job_id = job_id
+        self.status = JOB_QUEUED
+        self.stage = JOB_QUEUED
+        self.progress = 0
+        self.result = None
+        self.error = None
+        self.created_at = time.time()
+        self.finished_at = None
+        self.done_event = threading.Event()
+        # Data kept with the job for follow-up requests but not part of its JSON result
+        self.artifacts = {}
+
+    def update(self, stage, progress):
+        """Record the stage the job is in and its overall progress (0-100)."""
+        self.stage = stage
+        self.progress = int(progress)
+
+    def wait(self, timeout=None):
+        """Block until the job has finished or the timeout expires; returns True if finished."""
+        return self.done_event.wait(timeout)
+
+    def to_dict(self):
+        """Progress snapshot for the /api/progress/<job_id> endpoint."""
+        return {
+            "job_id": self.job_id,
+            "status": self.status,
+            "stage": self.stage,
+            "progress": self.progress,
+        }
+
+class JobQueue:
+    """
+    Bounded worker pool running analysis jobs off the request thread.
+    Each job carries its own progress, so concurrent uploads never share state.
+    inference_lock serialises the TensorFlow stages between workers so that
+    concurrent jobs overlap preprocessing without oversubscribing cores on inference.
+    """
+
+    def __init__(self, max_workers=None, max_pending=None, inference_slots=1, result_ttl=3600):
+        self.max_workers = max_workers or default_worker_count()
+        self.max_pending = max_pending or self.max_workers * 4
+        self.result_ttl = result_ttl
+        self.inference_lock = threading.BoundedSemaphore(inference_slots)
+        self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="deeplie-job")
+        self._jobs = {}
+        self._lock = threading.Lock()
+
+    def submit(self, fn, *args, cleanup=None, **kwargs):
+        """
+        Queue fn(job, *args, **kwargs) and return its Job immediately.
+        cleanup, if given, is called once the job has finished, whether it succeeded or not.
+        """
+        with self._lock:
+            self._evict_expired()
+            pending = sum(1 for job in self._jobs.values() if job.status in (JOB_QUEUED, JOB_RUNNING))
+            if pending >= self.max_pending:
+                raise QueueFullError(f"Too many jobs in progress ({pending}); try again shortly.")
+            job = Job(uuid.uuid4().hex)
+            self._jobs[job.job_id] = job
+
+        self._executor.submit(self._run, job, fn, args, kwargs, cleanup)
+        return job
+
+    def complete(self, result, artifacts=None):
+        """Register an already finished job holding result, e.g. one answered from a cache."""
+        job = Job(uuid.uuid4().hex)
+        job.result = result
+        job.artifacts.update(artifacts or {})
+        job.status = JOB_DONE
+        job.update(JOB_DONE, 100)
+        job.finished_at = time.time()
+        job.done_event.set()
+        with self._lock:
+            self._evict_expired()
+            self._jobs[job.job_id] = job
+        return job
+
+    def count(self, status):
+        """Number of jobs currently in the given state."""
+        with self._lock:
+            return sum(1 for job in self._jobs.values() if job.status == status)
+
+    def get(self, job_id):
+        """Return the Job with this id, or None if it is unknown or has expired."""
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def _run(self, job, fn, args, kwargs, cleanup):
+        job.status = JOB_RUNNING
+        try:
+            job.result = fn(job, *args, **kwargs)
+            job.status = JOB_DONE
+            job.update(JOB_DONE, 100)
+        except JobCancelledError as e:
+            job.error = str(e)
+            job.status = JOB_CANCELLED
+            job.update(JOB_CANCELLED, 100)
+        except Exception as e:
+            print(f"Job {job.job_id} failed: {e}")
+            job.error = str(e)
+            job.status = JOB_FAILED
+            job.update(JOB_FAILED, 100)
+        finally:
+            job.finished_at = time.time()
+            job.done_event.set()
+            if cleanup is not None:
+                cleanup()
+
+    def _evict_expired(self):
+        now = time.time()
+        expired = [job_id for job_id, job in self._jobs.items()
+                   if job.finished_at is not None and now - job.finished_at > self.result_ttl]
+        for job_id in expired:
+            del self._jobs[job_id]
@@ -1,30 +1,46 @@
 import cv2
 import numpy as np
 import os
+from contextlib import closing
 from skimage.metrics import structural_similarity as ssim
-import mediapipe as mp
 from PIL import Image
-import torch
 # from RealESRGAN import RealESRGAN
 from constants import DATA_PATH
+from FrameDeduplication import FrameDeduplicator
+from FrameSampling import FrameSampler, decode_stride, DEFAULT_DECODE_OVERSAMPLE
+from Metrics import count, stage
 
-# Initialize Real-ESRGAN
-# Check if MPS is available and set the device
-if torch.backends.mps.is_available():
-    device = torch.device('mps')
-else:
-    device = torch.device('cuda' if torch.cuda.is_available() else 'cpu')
+# Real-ESRGAN enhancement is disabled (see process_video). Re-enabling it needs torch and a device:
+# import torch
+# device = torch.device('mps' if torch.backends.mps.is_available() else 'cuda' if torch.cuda.is_available() else 'cpu')
 
-print('device:', device)
+# Side length of the square aligned face crops
+CROP_SIZE = 128
+
+# Run full Face Mesh every this many frames; landmarks are tracked with optical flow in between.
+# 1 (Face Mesh on every frame) gives the crops the GRU was trained on; tracking is opt-in, see
+# benchmarks/tracking_accuracy.py for how far tracked crops and scores move from those
+DEFAULT_KEYFRAME_INTERVAL = 1
+
+# Forward-backward optical flow error (pixels) above which tracking is abandoned for a full detection
+DEFAULT_DRIFT_THRESHOLD = 1.5
+
+# Stable landmarks followed between keyframes: eye corners, nose bridge and tip, mouth corners, forehead, chin, cheeks
+ANCHOR_LANDMARKS = [33, 133, 263, 362, 168, 1, 4, 61, 291, 10, 152, 234, 454]
+
+# Fewest anchors that must be tracked to trust the propagated landmarks
+MIN_TRACKED_ANCHORS = 6
 
 # model_scale = 2
 # model = RealESRGAN(device, scale=model_scale)
 # model.load_weights(f'weights/RealESRGAN_x{model_scale}.pth')
 
-def initialize_face_mesh():
-    """Initialize and return the MediaPipe Face Mesh object."""
+def initialize_face_mesh(max_num_faces=1):
+    """Initialize and return the MediaPipe Face Mesh object, finding up to max_num_faces faces per frame."""
+    # Imported here: the mediapipe package imports TensorFlow and matplotlib, which takes seconds
+    import mediapipe as mp
     mp_face_mesh = mp.solutions.face_mesh
-    return mp_face_mesh.FaceMesh(static_image_mode=False, max_num_faces=1, refine_landmarks=True)
+    return mp_face_mesh.FaceMesh(static_image_mode=False, max_num_faces=max_num_faces, refine_landmarks=True)
 
 def create_output_directory(video_path):
     """Create output directory based on video filename within the current working directory."""
@@ -60,8 +76,7 @@ def transform_landmarks(landmarks, rotation_matrix):
 def calculate_face_bounding_box(transformed_landmarks, forehead_y, chin_y, img_w, img_h):
     """Calculate face bounding box with margins."""
     x_coords = transformed_landmarks[:, 0]
-    y_coords = transformed_landmarks[:, 1]
-    x_min, x_max = min(x_coords), max(x_coords)
+    x_min, x_max = x_coords.min(), x_coords.max()
     # Add a margin for forehead and chin
     forehead_margin = int(0.08 * img_h)
     chin_margin = int(0.01 * img_h)
@@ -104,67 +119,321 @@ def align_face(frame, face_landmarks, img_w, img_h):
     aligned_frame = draw_landmarks_and_box(aligned_frame, x_min, y_min, x_max, y_max, t_left_eye, t_right_eye, t_nose_tip)
     return aligned_frame
 
-def process_video(video_path, output_folder, target_frames=300, ssim_threshold=0.9):
-    """Process video frames, align faces, crop the face, enhance quality, and save results."""
-    os.makedirs(output_folder, exist_ok=True)
-    video = cv2.VideoCapture(video_path)
-    face_mesh = initialize_face_mesh()  # Initialize face landmark detector
-    saved_frames = []
-    last_face_crop = None
-    frame_count = 0
-
-    while video.isOpened():
-        ret, frame = video.read()
-        if not ret:
-            break
+def landmarks_to_array(face_landmarks, img_w, img_h):
+    """Convert MediaPipe face landmarks to a (478, 2) array of pixel coordinates."""
+    return np.array([(lm.x * img_w, lm.y * img_h) for lm in face_landmarks.landmark])
+
+def compute_crop_matrix(landmarks, img_w, img_h):
+    """
+    Affine matrix mapping the source frame straight onto the aligned 128x128 face crop:
+    eye-line rotation, then the face bounding box in the rotated frame scaled to the crop.
+    Returns None if the bounding box is empty.
+    """
+    pixel_landmarks = landmarks.astype(int)
+    left_eye, right_eye = pixel_landmarks[33], pixel_landmarks[263]
+    forehead_y, chin_y = pixel_landmarks[10][1], pixel_landmarks[152][1]
+    rotation_matrix = compute_rotation_matrix(left_eye, right_eye, img_w, img_h)
+    transformed_landmarks = transform_landmarks(pixel_landmarks, rotation_matrix)
+    x_min, y_min, x_max, y_max = calculate_face_bounding_box(transformed_landmarks, forehead_y, chin_y, img_w, img_h)
+    if x_max <= x_min or y_max <= y_min:
+        return None
+
+    # Scale the box to the crop using the same pixel-centre convention as cv2.resize
+    scale_x = CROP_SIZE / (x_max - x_min)
+    scale_y = CROP_SIZE / (y_max - y_min)
+    crop_matrix = rotation_matrix * np.array([[scale_x], [scale_y]])
+    crop_matrix[0, 2] += (0.5 - x_min) * scale_x - 0.5
+    crop_matrix[1, 2] += (0.5 - y_min) * scale_y - 0.5
+    return crop_matrix
+
+def crop_face_from_landmarks(frame, landmarks):
+    """
+    Align the face on its eye line and crop it to 128x128 using a (478, 2) pixel landmark array.
+    Only the crop is warped, in a single affine call. Returns None if the face box is empty.
+    """
+    img_h, img_w = frame.shape[:2]
+    crop_matrix = compute_crop_matrix(landmarks, img_w, img_h)
+    if crop_matrix is None:
+        return None
+    return cv2.warpAffine(frame, crop_matrix, (CROP_SIZE, CROP_SIZE), flags=cv2.INTER_LINEAR)
+
+def crop_face(frame, face_mesh):
+    """Detect, align and crop the first face in a BGR frame; returns a 128x128 crop or None if no face is found."""
+    rgb_frame = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
+    results = face_mesh.process(rgb_frame)
+    if not results.multi_face_landmarks:
+        return None
+    # Process only the first detected face
+    img_h, img_w, _ = frame.shape
+    landmarks = landmarks_to_array(results.multi_face_landmarks[0], img_w, img_h)
+    return crop_face_from_landmarks(frame, landmarks)
+
+class FaceTracker:
+    """
+    Face landmarks for consecutive frames of one video. Face Mesh runs only on keyframes;
+    in between, the anchor landmarks are followed with pyramidal Lucas-Kanade optical flow
+    and the whole landmark set is moved by the similarity transform they imply.
+    A full detection is forced every keyframe_interval frames, when too few anchors are
+    tracked, or when their forward-backward flow error exceeds drift_threshold pixels.
+    keyframe_interval=1 runs Face Mesh on every frame.
+    """
+
+    def __init__(self, face_mesh, keyframe_interval=DEFAULT_KEYFRAME_INTERVAL, drift_threshold=DEFAULT_DRIFT_THRESHOLD):
+        self.face_mesh = face_mesh
+        self.keyframe_interval = max(1, keyframe_interval)
+        self.drift_threshold = drift_threshold
+        self.landmarks = None
+        self.prev_gray = None
+        self.frames_since_keyframe = 0
+        self.detections = 0
+        self.tracked = 0
+
+    def update(self, frame):
+        """Return the (478, 2) pixel landmarks of the first face in this BGR frame, or None if there is no face."""
+        gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY) if self.keyframe_interval > 1 else None
+
+        landmarks = None
+        if self.landmarks is not None and self.frames_since_keyframe < self.keyframe_interval - 1:
+            landmarks = self._track(gray)
+
+        if landmarks is None:
+            landmarks = self._detect(frame)
+            self.frames_since_keyframe = 0
+        else:
+            self.frames_since_keyframe += 1
+
+        self.landmarks = landmarks
+        self.prev_gray = gray
+        return landmarks
+
+    def _detect(self, frame):
+        self.detections += 1
+        results = self.face_mesh.process(cv2.cvtColor(frame, cv2.COLOR_BGR2RGB))
+        if not results.multi_face_landmarks:
+            return None
+        img_h, img_w = frame.shape[:2]
+        return landmarks_to_array(results.multi_face_landmarks[0], img_w, img_h)
+
+    def _track(self, gray):
+        landmarks = track_landmarks(self.prev_gray, gray, self.landmarks, self.drift_threshold)
+        if landmarks is not None:
+            self.tracked += 1
+        return landmarks
+
+def track_landmarks(prev_gray, gray, landmarks, drift_threshold=DEFAULT_DRIFT_THRESHOLD):
+    """
+    Move a face's (478, 2) landmarks from prev_gray to gray by the similarity transform of its
+    anchor landmarks' optical flow. Returns None when the anchors cannot be tracked reliably.
+    """
+    prev_points = landmarks[ANCHOR_LANDMARKS].astype(np.float32).reshape(-1, 1, 2)
+    next_points, status, _ = cv2.calcOpticalFlowPyrLK(prev_gray, gray, prev_points, None)
+    if next_points is None:
+        return None
+    back_points, back_status, _ = cv2.calcOpticalFlowPyrLK(gray, prev_gray, next_points, None)
+    if back_points is None:
+        return None
+
+    valid = (status.ravel() == 1) & (back_status.ravel() == 1)
+    if valid.sum() < MIN_TRACKED_ANCHORS:
+        return None
+    fb_error = np.linalg.norm((back_points - prev_points).reshape(-1, 2), axis=1)
+    if np.median(fb_error[valid]) > drift_threshold:
+        return None
+
+    transform, _ = cv2.estimateAffinePartial2D(prev_points[valid], next_points[valid])
+    if transform is None:
+        return None
+    return landmarks @ transform[:, :2].T + transform[:, 2]
+
+def is_distinct_frame(face_crop, last_face_crop, ssim_threshold=0.9):
+    """
+    Return True if the crop differs enough from the last kept crop (SSIM below threshold) to be kept.
+    Reference implementation; the pipeline uses the equivalent, faster FrameDeduplicator.
+    """
+    if last_face_crop is None:
+        return True
+    face_crop_gray = cv2.cvtColor(face_crop, cv2.COLOR_BGR2GRAY)
+    last_face_crop_gray = cv2.cvtColor(last_face_crop, cv2.COLOR_BGR2GRAY)
+    ssim_score, _ = ssim(face_crop_gray, last_face_crop_gray, full=True)
+    return ssim_score < ssim_threshold
+
+def iter_aligned_crops(video_path, keyframe_interval=DEFAULT_KEYFRAME_INTERVAL, drift_threshold=DEFAULT_DRIFT_THRESHOLD,
+                       stride=1, start_frame=0, end_frame=None, warmup_frames=0):
+    """
+    Yield every aligned face crop of frames start_frame <= index < end_frame (None reads to the end)
+    whose index is a multiple of stride, followed by the number of frames read from start_frame.
+    Skipped frames are only grabbed, never retrieved. With warmup_frames, decoding starts that many
+    frames earlier so Face Mesh's temporal state has settled by start_frame; those crops are dropped.
+    video_path may also be an opened capture (see open_video), which is released at the end.
+    """
+    first_frame = max(0, start_frame - warmup_frames)
+    with VideoFrames(video_path, stride, first_frame, end_frame) as frames, \
+            closing(initialize_face_mesh()) as face_mesh:
+        tracker = FaceTracker(face_mesh, keyframe_interval, drift_threshold)
+        for frame_idx, frame in frames:
+            counted = frame_idx >= start_frame  # Warm-up frames are not part of this segment's counts
+            if counted:
+                count("frames_decoded")
+            try:
+                with stage("face_mesh"):
+                    landmarks = tracker.update(frame)
+                if landmarks is not None:
+                    with stage("align_crop"):
+                        face_crop = crop_face_from_landmarks(frame, landmarks)
+                    if face_crop is not None and counted:
+                        count("faces_found")
+                        yield face_crop
+            except Exception as e:
+                print(f"Error processing frame {frame_idx}: {e}")
+    return max(0, frames.position - start_frame)
+
+def deduplicate_crops(crops, deduplicator):
+    """Yield the crops of a crop generator that deduplicator accepts, then return the generator's return value."""
+    while True:
         try:
-            rgb_frame = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
-            results = face_mesh.process(rgb_frame)
-            if results.multi_face_landmarks:
-                # Process only the first detected face
-                face_landmarks = results.multi_face_landmarks[0]
-                img_h, img_w, _ = frame.shape
-                aligned_frame = align_face(frame, face_landmarks, img_w, img_h)
-                left_eye, right_eye, nose_tip, forehead_y, chin_y = get_facial_landmarks(face_landmarks, img_w, img_h)
-                rotation_matrix = compute_rotation_matrix(left_eye, right_eye, img_w, img_h)
-                landmarks = np.array([(int(lm.x * img_w), int(lm.y * img_h)) for lm in face_landmarks.landmark])
-                transformed_landmarks = transform_landmarks(landmarks, rotation_matrix)
-                x_min, y_min, x_max, y_max = calculate_face_bounding_box(transformed_landmarks, forehead_y, chin_y, img_w, img_h)
-                face_crop = aligned_frame[y_min:y_max, x_min:x_max]
-                face_crop_resized = cv2.resize(face_crop, (128, 128))
-                
-                if last_face_crop is not None:
-                    face_crop_gray = cv2.cvtColor(face_crop_resized, cv2.COLOR_BGR2GRAY)
-                    last_face_crop_gray = cv2.cvtColor(last_face_crop, cv2.COLOR_BGR2GRAY)
-                    ssim_score, _ = ssim(face_crop_gray, last_face_crop_gray, full=True)
-                    if ssim_score < ssim_threshold:
-                        saved_frames.append(face_crop_resized)
-                        last_face_crop = face_crop_resized
-                else:
-                    saved_frames.append(face_crop_resized)
-                    last_face_crop = face_crop_resized
-        except Exception as e:
-            print(f"Error processing frame {frame_count}: {e}")
-        frame_count += 1
+            face_crop = next(crops)
+        except StopIteration as stop:
+            return stop.value
+        with stage("ssim"):
+            accepted = deduplicator.accept(face_crop)
+        if accepted:
+            count("frames_kept")
+            yield face_crop
+
+def iter_face_crops(video_path, ssim_threshold=0.9, keyframe_interval=DEFAULT_KEYFRAME_INTERVAL,
+                    drift_threshold=DEFAULT_DRIFT_THRESHOLD, deduplicator=None, max_decoded_frames=None):
+    """
+    Yield SSIM-distinct aligned face crops in decode order, followed by the total number of frames in the video.
+    deduplicator defaults to a FrameDeduplicator with ssim_threshold; any object with an
+    accept(face_crop) method returning whether to keep the crop can be passed instead.
+    If max_decoded_frames is set and the container reports its frame count, only evenly
+    spaced frames are decoded; the others are skipped with grab() and never retrieved.
+    """
+    stride = 1
+    if max_decoded_frames:
+        stride = decode_stride(video_frame_count(video_path), max_decoded_frames)
+    crops = iter_aligned_crops(video_path, keyframe_interval, drift_threshold, stride)
+    return (yield from deduplicate_crops(crops, deduplicator or FrameDeduplicator(ssim_threshold)))
+
+def open_video(video_path):
+    """
+    cv2.VideoCapture of a video file, or video_path itself if it is already an object with the same
+    read/grab/get/release interface, such as an UploadIngestion.AVCapture decoding an upload as it arrives.
+    """
+    if hasattr(video_path, "grab"):
+        return video_path
+    return cv2.VideoCapture(video_path)
 
+class VideoFrames:
+    """
+    (index, BGR frame) of the frames start_frame <= index < end_frame (None reads to the end) of a
+    video whose index is a multiple of stride; the others are only grabbed, never retrieved.
+    position is the index of the next frame to read. Used as a context manager, the capture is released
+    on leaving it, also when a generator reading the frames is closed early or its consumer raises.
+    """
+
+    def __init__(self, video_path, stride=1, start_frame=0, end_frame=None):
+        self.video = open_video(video_path)
+        if start_frame:
+            self.video.set(cv2.CAP_PROP_POS_FRAMES, start_frame)
+        self.stride = stride
+        self.end_frame = end_frame
+        self.position = start_frame
+
+    def __iter__(self):
+        while self.video.isOpened() and (self.end_frame is None or self.position < self.end_frame):
+            if self.position % self.stride != 0:
+                with stage("decode"):
+                    grabbed = self.video.grab()
+                if not grabbed:
+                    return
+                self.position += 1
+                continue
+            with stage("decode"):
+                ret, frame = self.video.read()
+            if not ret:
+                return
+            self.position += 1
+            yield self.position - 1, frame
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.video.release()
+
+def video_frame_count(video_path):
+    """Frame count reported by the container, or 0 when it is unknown."""
+    if hasattr(video_path, "grab"):
+        return max(0, int(video_path.get(cv2.CAP_PROP_FRAME_COUNT)))
+    video = cv2.VideoCapture(video_path)
+    frame_count = max(0, int(video.get(cv2.CAP_PROP_FRAME_COUNT)))
     video.release()
-    cv2.destroyAllWindows()
-
-    total_frames = len(saved_frames)
-    if total_frames > target_frames:
-        indices = np.linspace(0, total_frames - 1, target_frames, dtype=int)
-        saved_frames = [saved_frames[i] for i in indices]
-    elif total_frames < target_frames:
-        if total_frames == 0:
-            print("No valid frames were saved. Check video input or face detection.")
-            return frame_count, 0
-        indices = np.linspace(0, total_frames - 1, target_frames, dtype=int)
-        saved_frames = [saved_frames[i] for i in indices]
+    return frame_count
+
+def resample_frames(frames, target_frames):
+    """Uniformly resample the kept crops into a preallocated (target_frames, 128, 128, 3) uint8 array."""
+    sampled = np.empty((target_frames, CROP_SIZE, CROP_SIZE, 3), dtype=np.uint8)
+    indices = np.linspace(0, len(frames) - 1, target_frames, dtype=int)
+    for out_idx, frame_idx in enumerate(indices):
+        sampled[out_idx] = frames[frame_idx]
+    return sampled
+
+def sample_face_crops(crops, target_frames):
+    """
+    Drain a generator of kept crops (returning the video's frame count) through a FrameSampler.
+    Returns the frame count and a (target_frames, 128, 128, 3) uint8 array, or an empty
+    (0, 128, 128, 3) array when no crop was kept.
+    """
+    sampler = FrameSampler(target_frames, (CROP_SIZE, CROP_SIZE, 3))
+    while True:
+        try:
+            face_crop = next(crops)
+        except StopIteration as stop:
+            frame_count = stop.value
+            break
+        with stage("sampling"):
+            sampler.add(face_crop)
+
+    if len(sampler) == 0:
+        print("No valid frames were saved. Check video input or face detection.")
+        return frame_count, np.empty((0, CROP_SIZE, CROP_SIZE, 3), dtype=np.uint8)
+
+    # Fewer kept crops than target_frames are padded by repeating frames
+    count("frames_padded", max(0, target_frames - sampler.offered))
+    with stage("sampling"):
+        return frame_count, resample_frames(sampler.frames(), target_frames)
+
+def extract_face_crops(video_path, target_frames=300, ssim_threshold=0.9, keyframe_interval=DEFAULT_KEYFRAME_INTERVAL,
+                       drift_threshold=DEFAULT_DRIFT_THRESHOLD, decode_oversample=DEFAULT_DECODE_OVERSAMPLE):
+    """
+    Process video frames, align faces and crop the face region entirely in memory.
+    Returns the number of frames in the video and a (target_frames, 128, 128, 3) uint8 BGR array,
+    or an empty (0, 128, 128, 3) array when no face was found.
+    Memory stays O(target_frames): kept crops go through a FrameSampler, and at most
+    decode_oversample * target_frames frames are decoded (None decodes every frame).
+    """
+    max_decoded_frames = decode_oversample * target_frames if decode_oversample else None
+    crops = iter_face_crops(video_path, ssim_threshold, keyframe_interval, drift_threshold,
+                            max_decoded_frames=max_decoded_frames)
+    return sample_face_crops(crops, target_frames)
+
+def save_frames(frames, output_folder):
+    """Write frames to the output folder as frame_XXXX.png (dataset export sink)."""
+    os.makedirs(output_folder, exist_ok=True)
+    with stage("png_io"):
+        for idx, frame in enumerate(frames):
+            output_path = os.path.join(output_folder, f'frame_{idx:04d}.png')
+            cv2.imwrite(output_path, frame)
+
+def process_video(video_path, output_folder, target_frames=300, ssim_threshold=0.9,
+                  keyframe_interval=DEFAULT_KEYFRAME_INTERVAL, drift_threshold=DEFAULT_DRIFT_THRESHOLD):
+    """Process video frames, align faces, crop the face, enhance quality, and save results."""
+    frame_count, saved_frames = extract_face_crops(video_path, target_frames, ssim_threshold,
+                                                   keyframe_interval, drift_threshold)
 
     # Save enhanced images (this must be removed if you are enhancing image)
-    for idx, frame in enumerate(saved_frames):
-        output_path = os.path.join(output_folder, f'frame_{idx:04d}.png')
-        cv2.imwrite(output_path, frame)
+    save_frames(saved_frames, output_folder)
 
     # Enhance image quality using Real-ESRGAN before saving
     # enhanced_frames = []
@@ -192,7 +461,9 @@ if __name__ == "__main__":
     output_folder = create_output_directory(video_filename)
     target_frames = 300   # Desired number of frames
     ssim_threshold = 0.9  # Adjust sensitivity if needed
-    frame_count, saved_frame_count = process_video(DATA_PATH + "MU3D/Videos/" + video_filename, output_folder, target_frames, ssim_threshold)
+    keyframe_interval = 1  # Run Face Mesh on every frame so exported datasets match the training data
+    frame_count, saved_frame_count = process_video(DATA_PATH + "MU3D/Videos/" + video_filename, output_folder, target_frames,
+                                                   ssim_threshold, keyframe_interval)
 
     print(f"Video filename: {video_filename}")
     print(f"Total frames processed: {frame_count}")
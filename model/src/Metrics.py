@@ -0,0 +1,261 @@
+import contextvars
+import os
+import sys
+import threading
+import time
+from collections import Counter, defaultdict
+from contextlib import contextmanager
+
+# Upper bounds (seconds) of the per-analysis stage duration histograms
+STAGE_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+
+# Seconds between samples of the sampling profiler
+DEFAULT_PROFILE_INTERVAL = 0.01
+
+class Timings:
+    """Seconds spent per pipeline stage and frame counters of one analysis, or of a worker's share of one."""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.stages = defaultdict(float)
+        self.counters = defaultdict(int)
+
+    def add(self, stage, seconds):
+        self.stages[stage] += seconds
+
+    def count(self, name, value=1):
+        self.counters[name] += value
+
+    def snapshot(self):
+        """Plain-dict copy that can be sent back from a worker process and merged into another Timings."""
+        return {"stages": dict(self.stages), "counters": dict(self.counters)}
+
+    def merge(self, snapshot):
+        for stage, seconds in snapshot["stages"].items():
+            self.add(stage, seconds)
+        for name, value in snapshot["counters"].items():
+            self.count(name, value)
+
+    def to_dict(self):
+        """Breakdown included in a response: wall time, per-stage milliseconds and counters."""
+        return {
+            "total_ms": round((time.perf_counter() - self.started) * 1000, 1),
+            "stages_ms": {stage: round(seconds * 1000, 1) for stage, seconds in self.stages.items()},
+            "counters": dict(self.counters),
+        }
+
+class Histogram:
+    """Cumulative-bucket histogram as Prometheus exposes it."""
+
+    def __init__(self, buckets=STAGE_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        for idx, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[idx] += 1
+        self.sum += value
+        self.count += 1
+
+class MetricsRegistry:
+    """
+    Process-wide counters, histograms and gauges, rendered in the Prometheus text exposition format.
+    Stage time and frame counters accumulate from every analysis; the histograms hold one observation
+    per finished analysis and stage, so their quantiles are per-request latencies.
+    """
+
+    def __init__(self, buckets=STAGE_BUCKETS):
+        self.buckets = buckets
+        self.stage_seconds = defaultdict(float)
+        self.frames = defaultdict(int)
+        self.analyses = defaultdict(int)
+        self.stage_histograms = defaultdict(lambda: Histogram(self.buckets))
+        self.gauges = {}
+        self._lock = threading.Lock()
+
+    def add_stage_time(self, stage, seconds):
+        with self._lock:
+            self.stage_seconds[stage] += seconds
+
+    def add_frames(self, name, value):
+        with self._lock:
+            self.frames[name] += value
+
+    def observe_analysis(self, status, timings=None):
+        """Count a finished analysis and, given its timings, record its per-stage and total durations."""
+        with self._lock:
+            self.analyses[status] += 1
+            if timings is None:
+                return
+            for stage, seconds in timings.stages.items():
+                self.stage_histograms[stage].observe(seconds)
+            self.stage_histograms["total"].observe(time.perf_counter() - timings.started)
+
+    def add_gauge(self, name, description, read):
+        """Expose read(), evaluated at scrape time, as gauge deeplie_<name>; read may return None to omit it."""
+        self.gauges[name] = (description, read)
+
+    def render(self):
+        with self._lock:
+            lines = [
+                "# HELP deeplie_stage_seconds_total Time spent in each pipeline stage, summed over all analyses.",
+                "# TYPE deeplie_stage_seconds_total counter",
+            ]
+            lines += [f'deeplie_stage_seconds_total{{stage="{stage}"}} {seconds:.6f}'
+                      for stage, seconds in sorted(self.stage_seconds.items())]
+            lines += [
+                "# HELP deeplie_frames_total Frames decoded, with a face found, kept by SSIM and padded by resampling.",
+                "# TYPE deeplie_frames_total counter",
+            ]
+            lines += [f'deeplie_frames_total{{kind="{name}"}} {value}' for name, value in sorted(self.frames.items())]
+            lines += [
+                "# HELP deeplie_analyses_total Analyses by outcome (done, failed or cached).",
+                "# TYPE deeplie_analyses_total counter",
+            ]
+            lines += [f'deeplie_analyses_total{{status="{status}"}} {value}'
+                      for status, value in sorted(self.analyses.items())]
+            lines += [
+                "# HELP deeplie_analysis_stage_seconds Per-analysis time spent in each stage (stage=\"total\" is wall time).",
+                "# TYPE deeplie_analysis_stage_seconds histogram",
+            ]
+            for stage, histogram in sorted(self.stage_histograms.items()):
+                for bound, count in zip(histogram.buckets, histogram.counts):
+                    lines.append(f'deeplie_analysis_stage_seconds_bucket{{stage="{stage}",le="{bound}"}} {count}')
+                lines.append(f'deeplie_analysis_stage_seconds_bucket{{stage="{stage}",le="+Inf"}} {histogram.count}')
+                lines.append(f'deeplie_analysis_stage_seconds_sum{{stage="{stage}"}} {histogram.sum:.6f}')
+                lines.append(f'deeplie_analysis_stage_seconds_count{{stage="{stage}"}} {histogram.count}')
+            gauges = list(self.gauges.items())
+
+        for name, (description, read) in gauges:
+            value = read()
+            if value is not None:
+                lines += [f"# HELP deeplie_{name} {description}", f"# TYPE deeplie_{name} gauge",
+                          f"deeplie_{name} {float(value)}"]
+        return "\n".join(lines) + "\n"
+
+# Shared by the server, the cropping pipeline and the models
+metrics = MetricsRegistry()
+
+# Timings of the analysis running in the current thread, if one is being recorded
+current_timings = contextvars.ContextVar("deeplie_timings", default=None)
+
+def add_stage_time(stage, seconds):
+    """Attribute seconds to a stage, globally and in the current analysis."""
+    metrics.add_stage_time(stage, seconds)
+    timings = current_timings.get()
+    if timings is not None:
+        timings.add(stage, seconds)
+
+@contextmanager
+def stage(name):
+    """Time the enclosed block as pipeline stage name."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        add_stage_time(name, time.perf_counter() - start)
+
+def count(name, value=1):
+    """Add to a frame counter, globally and in the current analysis."""
+    metrics.add_frames(name, value)
+    timings = current_timings.get()
+    if timings is not None:
+        timings.count(name, value)
+
+@contextmanager
+def record():
+    """Collect the stages and counters of the enclosed block (in this thread) into a new Timings."""
+    timings = Timings()
+    token = current_timings.set(timings)
+    try:
+        yield timings
+    finally:
+        current_timings.reset(token)
+
+def merge(snapshot):
+    """Add a worker process's Timings.snapshot() to this process's metrics and current analysis."""
+    for stage_name, seconds in snapshot["stages"].items():
+        add_stage_time(stage_name, seconds)
+    for name, value in snapshot["counters"].items():
+        count(name, value)
+
+class SamplingProfiler:
+    """
+    Low-overhead sampling profiler that can be started and stopped while the server runs.
+    A daemon thread snapshots every other thread's stack with sys._current_frames() each interval
+    and counts the stacks per function, rooted at the thread name. collapsed() returns them in the
+    folded format read by flamegraph.pl and speedscope.
+    """
+
+    def __init__(self):
+        self.interval = DEFAULT_PROFILE_INTERVAL
+        self.samples = Counter()
+        self.sample_count = 0
+        self.started_at = None
+        self._thread = None
+        self._stop = threading.Event()
+        self._lock = threading.Lock()
+        self._samples_lock = threading.Lock()
+
+    @property
+    def running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self, interval=DEFAULT_PROFILE_INTERVAL):
+        """Start sampling with fresh counts; does nothing if already running."""
+        with self._lock:
+            if self.running:
+                return
+            self.interval = interval
+            self.samples = Counter()
+            self.sample_count = 0
+            self.started_at = time.time()
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name="deeplie-profiler", daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        """Stop sampling; the samples taken so far remain available."""
+        with self._lock:
+            if self.running:
+                self._stop.set()
+                self._thread.join()
+
+    def _run(self):
+        own_id = threading.get_ident()
+        while not self._stop.wait(self.interval):
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+            stacks = []
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own_id:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                    frame = frame.f_back
+                stack.append(names.get(thread_id, str(thread_id)))
+                stacks.append(";".join(reversed(stack)))
+            with self._samples_lock:
+                self.samples.update(stacks)
+                self.sample_count += 1
+
+    def collapsed(self):
+        """Sampled stacks as 'thread;outer;...;inner count' lines, most frequent first."""
+        with self._samples_lock:
+            stacks = self.samples.most_common()
+        return "".join(f"{stack} {samples}\n" for stack, samples in stacks)
+
+    def status(self):
+        return {
+            "running": self.running,
+            "interval_seconds": self.interval,
+            "samples": self.sample_count,
+            "stacks": len(self.samples),
+            "started_at": self.started_at,
+        }
+
+profiler = SamplingProfiler()
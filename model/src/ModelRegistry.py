@@ -0,0 +1,126 @@
+import os
+import resource
+import sys
+import threading
+import time
+
+def current_rss_mb():
+    """Resident memory of this process in MB, or None where /proc is unavailable."""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / (1 << 20)
+    except (OSError, ValueError):
+        return None
+
+def peak_rss_mb():
+    """Peak resident memory of this process in MB (ru_maxrss is in bytes on macOS, KB elsewhere)."""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1 << 20) if sys.platform == "darwin" else peak / 1024
+
+class ModelRegistry:
+    """
+    Named components (models, engines, arrays) that are built on first use instead of at import.
+    register(name, loader) adds loader(registry), which may get() other components it depends on.
+    start_background_loading() builds the preloaded components in a daemon thread and then runs the warm-up
+    functions, so the first request does not pay model loading or graph tracing; get() from a
+    request before then simply waits for the component it needs.
+    """
+
+    def __init__(self, started_at=None):
+        self.started_at = started_at if started_at is not None else time.perf_counter()
+        self.ready_event = threading.Event()
+        self.error = None
+        self.time_to_ready = None
+        self.warmup_seconds = None
+        self._loaders = {}
+        self._preload = []
+        self._components = {}
+        self._load_seconds = {}
+        self._locks = {}
+        self._warmups = []
+        self._loading_lock = threading.Lock()
+        self._loading_thread = None
+        self._loading_pid = None
+
+    def register(self, name, loader, preload=True):
+        """
+        Register loader(registry) as the builder of component name. Components with preload=False
+        are not built by load_all, only when first requested.
+        """
+        self._loaders[name] = loader
+        self._locks[name] = threading.Lock()
+        if preload:
+            self._preload.append(name)
+
+    def add_warmup(self, warmup):
+        """Run warmup(registry) once all components are loaded, before the registry reports ready."""
+        self._warmups.append(warmup)
+
+    def get(self, name):
+        """The component called name, loading it (and what it depends on) if needed."""
+        if name in self._components:
+            return self._components[name]
+        with self._locks[name]:
+            if name not in self._components:
+                start = time.perf_counter()
+                self._components[name] = self._loaders[name](self)
+                self._load_seconds[name] = time.perf_counter() - start
+        return self._components[name]
+
+    def is_loaded(self, name):
+        return name in self._components
+
+    def load_all(self):
+        """Load every preloaded component and run the warm-ups, then mark the registry ready."""
+        try:
+            for name in self._preload:
+                self.get(name)
+            start = time.perf_counter()
+            for warmup in self._warmups:
+                warmup(self)
+            self.warmup_seconds = time.perf_counter() - start
+        except Exception as e:
+            print(f"Model loading failed: {e}")
+            self.error = str(e)
+            raise
+        self.time_to_ready = time.perf_counter() - self.started_at
+        self.ready_event.set()
+        rss = current_rss_mb()
+        print(f"Models ready in {self.time_to_ready:.1f}s" + (f", RSS {rss:.0f} MB" if rss is not None else ""))
+
+    def start_background_loading(self):
+        """
+        Call load_all in a daemon thread and return the thread. Only the first call in a process
+        starts one; later calls return the same thread. A forked child (threads do not survive
+        fork) starts its own.
+        """
+        def load():
+            try:
+                self.load_all()
+            except Exception:
+                pass  # Reported through status()
+
+        with self._loading_lock:
+            if self._loading_thread is None or self._loading_pid != os.getpid():
+                self._loading_thread = threading.Thread(target=load, name="deeplie-model-loader", daemon=True)
+                self._loading_pid = os.getpid()
+                self._loading_thread.start()
+            return self._loading_thread
+
+    @property
+    def ready(self):
+        return self.ready_event.is_set()
+
+    def status(self):
+        """Readiness, per-component load times and startup metrics, for the /api/ready endpoint."""
+        return {
+            "ready": self.ready,
+            "error": self.error,
+            "components": {name: {"loaded": name in self._components,
+                                  "load_seconds": self._load_seconds.get(name)} for name in self._loaders},
+            "warmup_seconds": self.warmup_seconds,
+            "time_to_ready_seconds": self.time_to_ready,
+            "uptime_seconds": time.perf_counter() - self.started_at,
+            "rss_mb": current_rss_mb(),
+            "peak_rss_mb": peak_rss_mb(),
+        }
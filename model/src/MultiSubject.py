@@ -0,0 +1,221 @@
+"""
+Face crops of every person in a video, e.g. a panel interview or a two-camera recording put side by
+side, from a single decode.
+
+Face Mesh looks for up to max_subjects faces on keyframes, and each face is followed with optical
+flow in between, as FaceTracker does for one face. Detections are matched to subjects by the overlap
+of their landmark boxes with each subject's last known box, so a subject keeps its id while moving
+and after being out of view for a while. Every subject has its own FrameDeduplicator and
+FrameSampler; DeepLie.predict_subjects then encodes all subjects' crops in one FER pass and scores
+them in one GRU call, so an extra face adds cropping work but no decoding or model call overhead.
+"""
+from contextlib import closing
+
+import cv2
+import numpy as np
+
+from FrameDeduplication import FrameDeduplicator
+from FrameSampling import FrameSampler, decode_stride, DEFAULT_DECODE_OVERSAMPLE
+from MediaPipeCropping import (CROP_SIZE, DEFAULT_DRIFT_THRESHOLD, DEFAULT_KEYFRAME_INTERVAL, VideoFrames,
+                               crop_face_from_landmarks, initialize_face_mesh, landmarks_to_array, resample_frames,
+                               track_landmarks, video_frame_count)
+from Metrics import count, stage
+
+DEFAULT_MAX_SUBJECTS = 4
+
+# Up to this many times max_subjects subjects are followed, so that passing or false detections
+# do not take the place of a person; only the max_subjects with the most crops are analysed
+TRACKED_SUBJECTS_FACTOR = 2
+
+# Overlap (intersection over union) of landmark boxes needed to match a detection to a known subject
+MIN_MATCH_IOU = 0.3
+
+# Subjects with fewer kept crops are dropped as passing or false detections
+MIN_SUBJECT_CROPS = 10
+
+def landmark_box(landmarks):
+    """(x_min, y_min, x_max, y_max) bounding box of a (N, 2) landmark array."""
+    return np.concatenate([landmarks.min(axis=0), landmarks.max(axis=0)])
+
+def box_iou(box, other):
+    """Intersection over union of two (x_min, y_min, x_max, y_max) boxes."""
+    width = min(box[2], other[2]) - max(box[0], other[0])
+    height = min(box[3], other[3]) - max(box[1], other[1])
+    if width <= 0 or height <= 0:
+        return 0.0
+    intersection = width * height
+    area = (box[2] - box[0]) * (box[3] - box[1]) + (other[2] - other[0]) * (other[3] - other[1])
+    return float(intersection / (area - intersection))
+
+def match_boxes(known_boxes, boxes, min_iou=MIN_MATCH_IOU):
+    """
+    Match detected boxes one-to-one to known boxes, greatest overlap first.
+    Returns {box index: known box index} for the pairs overlapping by at least min_iou.
+    """
+    pairs = sorted(((box_iou(known, box), box_idx, known_idx) for known_idx, known in enumerate(known_boxes)
+                    for box_idx, box in enumerate(boxes)), key=lambda pair: -pair[0])
+    matches, matched_known = {}, set()
+    for iou, box_idx, known_idx in pairs:
+        if iou < min_iou:
+            break
+        if box_idx not in matches and known_idx not in matched_known:
+            matches[box_idx] = known_idx
+            matched_known.add(known_idx)
+    return matches
+
+class MultiFaceTracker:
+    """
+    Landmarks of every face in consecutive frames of one video, keyed by subject ids numbered in
+    order of first appearance. Face Mesh runs every keyframe_interval frames, or sooner when optical
+    flow loses one of the faces; in between, every face is tracked like FaceTracker tracks one.
+    A detected face that overlaps no known subject becomes a new subject while fewer than
+    max_tracked are known; subjects missing from a keyframe are matched again when they reappear.
+    """
+
+    def __init__(self, face_mesh, keyframe_interval=DEFAULT_KEYFRAME_INTERVAL, drift_threshold=DEFAULT_DRIFT_THRESHOLD,
+                 max_tracked=DEFAULT_MAX_SUBJECTS * TRACKED_SUBJECTS_FACTOR):
+        self.face_mesh = face_mesh
+        self.keyframe_interval = max(1, keyframe_interval)
+        self.drift_threshold = drift_threshold
+        self.max_tracked = max_tracked
+        self.boxes = []  # Last known landmark box of each subject, indexed by subject id
+        self.faces = {}  # Subject id -> landmarks of the faces in the previous frame
+        self.prev_gray = None
+        self.frames_since_keyframe = 0
+        self.detections = 0
+        self.tracked = 0
+
+    def update(self, frame):
+        """Return {subject id: (478, 2) pixel landmarks} of the faces in this BGR frame."""
+        gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY) if self.keyframe_interval > 1 else None
+
+        faces = None
+        if self.faces and self.frames_since_keyframe < self.keyframe_interval - 1:
+            faces = self._track(gray)
+
+        if faces is None:
+            faces = self._detect(frame)
+            self.frames_since_keyframe = 0
+        else:
+            self.frames_since_keyframe += 1
+
+        for subject_id, landmarks in faces.items():
+            self.boxes[subject_id] = landmark_box(landmarks)
+        self.faces = faces
+        self.prev_gray = gray
+        return faces
+
+    def assign(self, detections):
+        """{subject id: landmarks} for a keyframe's detected landmark arrays, adding new subjects as needed."""
+        boxes = [landmark_box(landmarks) for landmarks in detections]
+        matches = match_boxes(self.boxes, boxes)
+        faces = {}
+        for idx, landmarks in enumerate(detections):
+            subject_id = matches.get(idx)
+            if subject_id is None:
+                if len(self.boxes) >= self.max_tracked:
+                    continue
+                subject_id = len(self.boxes)
+                self.boxes.append(boxes[idx])
+            faces[subject_id] = landmarks
+        return faces
+
+    def _detect(self, frame):
+        self.detections += 1
+        results = self.face_mesh.process(cv2.cvtColor(frame, cv2.COLOR_BGR2RGB))
+        img_h, img_w = frame.shape[:2]
+        return self.assign([landmarks_to_array(face_landmarks, img_w, img_h)
+                            for face_landmarks in results.multi_face_landmarks or []])
+
+    def _track(self, gray):
+        """Every face of the previous frame moved by optical flow, or None if any of them is lost."""
+        faces = {}
+        for subject_id, landmarks in self.faces.items():
+            landmarks = track_landmarks(self.prev_gray, gray, landmarks, self.drift_threshold)
+            if landmarks is None:
+                return None
+            faces[subject_id] = landmarks
+        self.tracked += 1
+        return faces
+
+def iter_subject_crops(video_path, max_subjects=DEFAULT_MAX_SUBJECTS, keyframe_interval=DEFAULT_KEYFRAME_INTERVAL,
+                       drift_threshold=DEFAULT_DRIFT_THRESHOLD, stride=1):
+    """
+    Yield (subject id, aligned face crop) for every face of every frame whose index is a multiple of
+    stride, in decode order, followed by the number of frames read. Skipped frames are only grabbed.
+    The video and Face Mesh are released however the generator ends, as in iter_aligned_crops.
+    """
+    with VideoFrames(video_path, stride) as frames, closing(initialize_face_mesh(max_subjects)) as face_mesh:
+        tracker = MultiFaceTracker(face_mesh, keyframe_interval, drift_threshold,
+                                   max_subjects * TRACKED_SUBJECTS_FACTOR)
+        for frame_idx, frame in frames:
+            count("frames_decoded")
+            try:
+                with stage("face_mesh"):
+                    faces = tracker.update(frame)
+                for subject_id, landmarks in faces.items():
+                    with stage("align_crop"):
+                        face_crop = crop_face_from_landmarks(frame, landmarks)
+                    if face_crop is not None:
+                        count("faces_found")
+                        yield subject_id, face_crop
+            except Exception as e:
+                print(f"Error processing frame {frame_idx}: {e}")
+    return frames.position
+
+def select_subjects(kept_crops, max_subjects=DEFAULT_MAX_SUBJECTS, min_subject_crops=MIN_SUBJECT_CROPS):
+    """
+    Ids of the subjects to analyse from {subject id: kept crops}: the max_subjects with the most kept
+    crops among those with at least min_subject_crops (or the single one with the most if none has
+    that many), in id order.
+    """
+    if not kept_crops:
+        return []
+    threshold = min(min_subject_crops, max(kept_crops.values()))
+    candidates = sorted((subject_id for subject_id, kept in kept_crops.items() if kept >= threshold),
+                        key=lambda subject_id: (-kept_crops[subject_id], subject_id))
+    return sorted(candidates[:max_subjects])
+
+def extract_subject_crops(video_path, target_frames=300, ssim_threshold=0.9, max_subjects=DEFAULT_MAX_SUBJECTS,
+                          keyframe_interval=DEFAULT_KEYFRAME_INTERVAL, drift_threshold=DEFAULT_DRIFT_THRESHOLD,
+                          decode_oversample=DEFAULT_DECODE_OVERSAMPLE, min_subject_crops=MIN_SUBJECT_CROPS):
+    """
+    Multi-subject counterpart of extract_face_crops: the number of frames in the video and
+    {subject id: (target_frames, 128, 128, 3) uint8 BGR array} of the subjects chosen by
+    select_subjects, or {} when no face was found. The video is decoded once, with at most
+    decode_oversample * target_frames frames decoded, and each subject's crops are deduplicated
+    and sampled on their own.
+    """
+    stride = 1
+    if decode_oversample:
+        stride = decode_stride(video_frame_count(video_path), decode_oversample * target_frames)
+    crops = iter_subject_crops(video_path, max_subjects, keyframe_interval, drift_threshold, stride)
+
+    deduplicators, samplers = {}, {}
+    while True:
+        try:
+            subject_id, face_crop = next(crops)
+        except StopIteration as stop:
+            frame_count = stop.value
+            break
+        if subject_id not in samplers:
+            deduplicators[subject_id] = FrameDeduplicator(ssim_threshold)
+            samplers[subject_id] = FrameSampler(target_frames, (CROP_SIZE, CROP_SIZE, 3))
+        with stage("ssim"):
+            accepted = deduplicators[subject_id].accept(face_crop)
+        if accepted:
+            count("frames_kept")
+            with stage("sampling"):
+                samplers[subject_id].add(face_crop)
+
+    subject_ids = select_subjects({subject_id: sampler.offered for subject_id, sampler in samplers.items()},
+                                  max_subjects, min_subject_crops)
+    if not subject_ids:
+        print("No valid frames were saved. Check video input or face detection.")
+    subjects = {}
+    with stage("sampling"):
+        for subject_id in subject_ids:
+            sampler = samplers[subject_id]
+            count("frames_padded", max(0, target_frames - sampler.offered))
+            subjects[subject_id] = resample_frames(sampler.frames(), target_frames)
+    return frame_count, subjects
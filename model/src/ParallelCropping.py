@@ -0,0 +1,135 @@
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+from FrameDeduplication import FrameDeduplicator
+from FrameSampling import DEFAULT_DECODE_OVERSAMPLE, FrameSampler, decode_stride
+from MediaPipeCropping import (CROP_SIZE, DEFAULT_DRIFT_THRESHOLD, DEFAULT_KEYFRAME_INTERVAL, deduplicate_crops,
+                               extract_face_crops, iter_aligned_crops, sample_face_crops, video_frame_count)
+from Metrics import merge, record
+
+# Segments shorter than this many frames are not worth a separate capture, seek and Face Mesh
+MIN_SEGMENT_FRAMES = 150
+
+# Decoded frames each segment runs Face Mesh on before its start, so the landmark transient of a fresh
+# detection (several pixels on the first frame, settling to ~0.05 px within about five frames) is discarded
+SEGMENT_WARMUP_FRAMES = 8
+
+# Containers where cv2's CAP_PROP_POS_FRAMES seek lands on a nearby keyframe rather than the requested
+# frame (ASF/WMV have no frame index), so segments would overlap or leave gaps; these are cropped sequentially
+INEXACT_SEEK_EXTENSIONS = (".asf", ".wmv")
+
+segment_pools = {}
+segment_pools_lock = threading.Lock()
+
+def default_preprocess_workers():
+    """
+    Number of processes one video's cropping stage is split across. Defaults to 1 (sequential),
+    since the job queue already runs several videos at once; set DEEPLIE_PREPROCESS_WORKERS to change it.
+    """
+    configured = os.environ.get("DEEPLIE_PREPROCESS_WORKERS")
+    if configured:
+        return max(1, int(configured))
+    return 1
+
+def get_segment_pool(workers):
+    """
+    Shared process pool with the given number of workers, created on first use so that the
+    MediaPipe import and process start-up are paid once. Workers are spawned rather than forked,
+    as forking a process that has already started TensorFlow threads is unsafe.
+    """
+    with segment_pools_lock:
+        pool = segment_pools.get(workers)
+        if pool is None:
+            pool = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn"))
+            segment_pools[workers] = pool
+        return pool
+
+def segment_boundaries(frame_count, segments, stride=1):
+    """
+    Split frames [0, frame_count) into at most segments contiguous (start, end) ranges of
+    roughly equal length. Every start is a multiple of stride, so each segment decodes the
+    same frame indices the sequential path would. The last segment ends at None (read to the end),
+    in case the container under-reports its frame count.
+    """
+    segments = max(1, min(segments, frame_count // MIN_SEGMENT_FRAMES))
+    decoded = -(-frame_count // stride)
+    starts = sorted({(decoded * idx // segments) * stride for idx in range(segments)})
+    ends = starts[1:] + [None]
+    return list(zip(starts, ends))
+
+def seeks_exactly(video_path):
+    """Whether segments of video_path can start at an exact frame (see INEXACT_SEEK_EXTENSIONS)."""
+    return not str(video_path).lower().endswith(INEXACT_SEEK_EXTENSIONS)
+
+def crop_segment(video_path, start_frame, end_frame, stride, keyframe_interval, drift_threshold, target_frames):
+    """
+    Worker entry point: aligned face crops of one segment with its own capture and Face Mesh,
+    before deduplication. Returns the number of frames read, a (N, 128, 128, 3) uint8 array and
+    the segment's stage timings and counters (a Metrics.Timings snapshot).
+    The crops go through a FrameSampler of target_frames, so a segment returns at most
+    2 * target_frames of them, evenly spaced, however many frames it decodes.
+    """
+    sampler = FrameSampler(target_frames, (CROP_SIZE, CROP_SIZE, 3))
+    with record() as timings:
+        crops = iter_aligned_crops(video_path, keyframe_interval, drift_threshold, stride, start_frame, end_frame,
+                                   warmup_frames=SEGMENT_WARMUP_FRAMES * stride)
+        while True:
+            try:
+                sampler.add(next(crops))
+            except StopIteration as stop:
+                frames_read = stop.value
+                break
+    return frames_read, sampler.frames(), timings.snapshot()
+
+def iter_segment_results(futures):
+    """
+    Yield the crops of segment futures in video order, then return the total number of frames read.
+    Each segment's timings are merged into this process's metrics as it arrives.
+    """
+    frame_count = 0
+    for future in futures:
+        frames_read, crops, timings = future.result()
+        merge(timings)
+        frame_count += frames_read
+        yield from crops
+    return frame_count
+
+def extract_face_crops_parallel(video_path, target_frames=300, ssim_threshold=0.9,
+                                keyframe_interval=DEFAULT_KEYFRAME_INTERVAL, drift_threshold=DEFAULT_DRIFT_THRESHOLD,
+                                decode_oversample=DEFAULT_DECODE_OVERSAMPLE, workers=None):
+    """
+    extract_face_crops with the video split into time segments, each cropped in its own worker
+    process. Segment crops are merged in order and SSIM deduplication and sampling run once over
+    the merged stream in the parent, so dedup decisions across segment boundaries are made exactly
+    as on the sequential path. Face Mesh carries landmarks from frame to frame, so a segment's
+    landmarks cannot be bit-identical to the sequential run's; each segment is warmed up for
+    SEGMENT_WARMUP_FRAMES decoded frames, after which they agree to within Face Mesh's own
+    sub-pixel jitter.
+    Each segment returns at most 2 * target_frames crops (see crop_segment). With the default
+    decode_oversample no segment decodes more than that when there are at least two, so nothing is
+    dropped before deduplication; with decode_oversample=None long segments are thinned evenly first.
+    Falls back to the sequential path for one worker, short videos, an unknown frame count, an
+    opened capture rather than a file (segments need a file each worker can seek in), or a container
+    cv2 cannot seek in exactly (INEXACT_SEEK_EXTENSIONS).
+    """
+    workers = workers or default_preprocess_workers()
+    frame_count = video_frame_count(video_path)
+    stride = decode_stride(frame_count, decode_oversample * target_frames) if decode_oversample else 1
+    boundaries = segment_boundaries(frame_count, workers, stride)
+    if (workers <= 1 or frame_count == 0 or len(boundaries) == 1 or hasattr(video_path, "grab")
+            or not seeks_exactly(video_path)):
+        return extract_face_crops(video_path, target_frames, ssim_threshold, keyframe_interval,
+                                  drift_threshold, decode_oversample)
+
+    pool = get_segment_pool(workers)
+    futures = [pool.submit(crop_segment, video_path, start, end, stride, keyframe_interval, drift_threshold,
+                           target_frames)
+               for start, end in boundaries]
+    try:
+        crops = deduplicate_crops(iter_segment_results(futures), FrameDeduplicator(ssim_threshold))
+        return sample_face_crops(crops, target_frames)
+    finally:
+        for future in futures:
+            future.cancel()
@@ -0,0 +1,200 @@
+"""
+TFLite backend for the FER CNN and the GRU deception model.
+
+Run from model/src to convert both models next to their .keras files:
+    python QuantizedInference.py [--mode dynamic|int8|float16|float32] [--crops-dir DIR | --videos DIR]
+
+int8 calibrates activation ranges on face crops: the images of --crops-dir, or else crops of the
+MU3D videos (--videos). Synthetic frames drawn from the training set's per-pixel statistics are
+only used when neither is available, as real faces activate the CNN quite differently from noise.
+"""
+import argparse
+import glob
+import os
+import tempfile
+
+import cv2
+import keras
+import numpy as np
+import tensorflow as tf
+
+from constants import FER_MODEL_PATH, MAIN_MODEL_PATH, MEAN_X_PATH, MU3D_VIDEOS_PATH, STD_X_PATH
+from InferenceEngine import DEFAULT_BATCH_SIZE, fer_multi_output_model, preprocess_frames
+
+# float32: plain conversion; dynamic: int8 weights with float activations;
+# int8: int8 weights and activations calibrated on representative data (float inputs and outputs); float16: half weights
+QUANTIZATION_MODES = ("float32", "dynamic", "int8", "float16")
+DEFAULT_QUANTIZATION_MODE = "dynamic"
+
+# Number of representative frames used to calibrate int8 activations. Each activation's range is
+# the extremes seen during calibration; with fewer frames those are underestimated and activations
+# outside them are clipped, which on some weights moved emotion probabilities by more than 0.1
+DEFAULT_CALIBRATION_FRAMES = 300
+MIN_CALIBRATION_FRAMES = 300
+
+# Videos whose face crops calibrate int8 when no crops directory is given
+DEFAULT_CALIBRATION_VIDEOS = 10
+
+def tflite_model_path(keras_path, mode=DEFAULT_QUANTIZATION_MODE):
+    """Where the converted model for a .keras file lives: next to it, named after the quantization mode."""
+    return os.path.splitext(keras_path)[0] + f".{mode}.tflite"
+
+def representative_frames(mean_X, std_X, count=DEFAULT_CALIBRATION_FRAMES, seed=0):
+    """
+    Synthetic normalized FER inputs drawn from the per-pixel distribution of the training set:
+    pixels ~ N(mean_x, std_x) clipped to [0, 255], then normalized like preprocess_frames.
+    """
+    rng = np.random.default_rng(seed)
+    pixels = np.clip(mean_X + std_X * rng.standard_normal((count,) + mean_X.shape), 0, 255)
+    return ((pixels - mean_X) / (std_X + 1e-8)).astype(np.float32)
+
+def crop_frames(crops_dir, mean_X, std_X):
+    """Normalized FER inputs from face crop images (e.g. the output of MediaPipeCropping.process_video)."""
+    paths = sorted(glob.glob(os.path.join(crops_dir, "*.png")) + glob.glob(os.path.join(crops_dir, "*.jpg")))
+    return preprocess_frames([cv2.imread(path) for path in paths], mean_X, std_X)
+
+def video_frames(videos_dir, mean_X, std_X, count=DEFAULT_CALIBRATION_FRAMES, max_videos=DEFAULT_CALIBRATION_VIDEOS):
+    """
+    count normalized FER inputs from the face crops of up to max_videos videos spread over videos_dir,
+    evenly spaced in each. Empty if the directory has no usable video.
+    """
+    from BatchInference import find_videos
+    from MediaPipeCropping import extract_face_crops
+    videos = find_videos([videos_dir]) if os.path.isdir(videos_dir) else []
+    videos = [videos[idx] for idx in np.linspace(0, len(videos) - 1, min(max_videos, len(videos)), dtype=int)]
+    crops = []
+    for path in videos:
+        _, video_crops = extract_face_crops(path, target_frames=-(-count // len(videos)))
+        crops.extend(video_crops)
+    return preprocess_frames(crops[:count], mean_X, std_X)
+
+def convert(model, input_shape, mode, representative_inputs=None):
+    """
+    Convert a Keras model to TFLite bytes. The model is exported as a SavedModel first: converting
+    Keras 3 models directly fails on their variable reads. Recurrent layers need a fixed batch
+    size, so input_shape may fix it.
+    """
+    if mode not in QUANTIZATION_MODES:
+        raise ValueError(f"Unknown quantization mode {mode!r}; expected one of {QUANTIZATION_MODES}")
+
+    with tempfile.TemporaryDirectory() as export_dir:
+        archive = keras.export.ExportArchive()
+        archive.track(model)
+        archive.add_endpoint("serve", lambda inputs: model(inputs, training=False),
+                             input_signature=[tf.TensorSpec(input_shape, tf.float32)])
+        archive.write_out(export_dir, verbose=False)
+
+        converter = tf.lite.TFLiteConverter.from_saved_model(export_dir)
+        if mode != "float32":
+            converter.optimizations = [tf.lite.Optimize.DEFAULT]
+        if mode == "float16":
+            converter.target_spec.supported_types = [tf.float16]
+        if mode == "int8":
+            if representative_inputs is None:
+                raise ValueError("int8 quantization needs representative inputs")
+            converter.representative_dataset = lambda: ([sample[np.newaxis]] for sample in representative_inputs)
+        return converter.convert()
+
+def convert_fer_model(fer_model, mode=DEFAULT_QUANTIZATION_MODE, calibration_frames=None):
+    """
+    TFLite bytes of the two-output (emotions, encodings) FER model, with a dynamic batch size.
+    int8 needs at least MIN_CALIBRATION_FRAMES calibration frames.
+    """
+    if mode == "int8" and calibration_frames is not None and len(calibration_frames) < MIN_CALIBRATION_FRAMES:
+        raise ValueError(f"int8 calibration needs at least {MIN_CALIBRATION_FRAMES} frames, "
+                         f"got {len(calibration_frames)}")
+    multi_output_model = fer_multi_output_model(fer_model)
+    input_shape = (None,) + tuple(fer_model.inputs[0].shape[1:])
+    return convert(multi_output_model, input_shape, mode, calibration_frames)
+
+def convert_main_model(main_model, mode=DEFAULT_QUANTIZATION_MODE):
+    """
+    TFLite bytes of the GRU model for a single (1, frames, 4608) sequence. int8 activation
+    calibration crashes the converter on the recurrent while loop, so int8 uses dynamic-range
+    quantization (int8 weights) for this model.
+    """
+    input_shape = (1,) + tuple(main_model.inputs[0].shape[1:])
+    if mode == "int8":
+        mode = "dynamic"
+    return convert(main_model, input_shape, mode)
+
+class TFLiteModel:
+    """A converted model's serving signature, called with one float32 input and returning its outputs in order."""
+
+    def __init__(self, model_path, num_threads=None):
+        self.model_path = model_path
+        self.interpreter = tf.lite.Interpreter(model_path=model_path, num_threads=num_threads)
+        self._runner = self.interpreter.get_signature_runner()
+        signature = self.interpreter.get_signature_list()["serving_default"]
+        self._input_name = signature["inputs"][0]
+        self._output_names = sorted(signature["outputs"])  # output_0, output_1, ... in the Keras model's order
+
+    def __call__(self, inputs):
+        outputs = self._runner(**{self._input_name: np.ascontiguousarray(inputs, dtype=np.float32)})
+        return [outputs[name] for name in self._output_names]
+
+class TFLiteFERInferenceEngine:
+    """Drop-in replacement for FERInferenceEngine running a converted FER model."""
+
+    def __init__(self, model_path, batch_size=DEFAULT_BATCH_SIZE, num_threads=None):
+        self.batch_size = batch_size
+        self.model = TFLiteModel(model_path, num_threads)
+
+    def run(self, frames_processed, progress_callback=None):
+        """Same contract as FERInferenceEngine.run: (N, 7) emotions and (N, 4608) encodings."""
+        emotion_preds, encodings = [], []
+        total = len(frames_processed)
+        for start in range(0, total, self.batch_size):
+            end = min(start + self.batch_size, total)
+            batch_emotions, batch_encodings = self.model(frames_processed[start:end])
+            emotion_preds.append(batch_emotions)
+            encodings.append(batch_encodings)
+            if progress_callback is not None:
+                progress_callback(end / total)
+        return np.concatenate(emotion_preds), np.concatenate(encodings)
+
+class TFLiteSequenceClassifier:
+    """Drop-in replacement for the GRU Keras model's predict(), running a converted model one sequence at a time."""
+
+    def __init__(self, model_path, num_threads=None):
+        self.model = TFLiteModel(model_path, num_threads)
+
+    def predict(self, sequences, verbose=0):
+        """(B, frames, 4608) encodings to (B, 1) deception scores."""
+        return np.concatenate([self.model(sequence[np.newaxis])[0] for sequence in sequences])
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--mode", choices=QUANTIZATION_MODES, default=DEFAULT_QUANTIZATION_MODE)
+    parser.add_argument("--crops-dir", help="Calibrate int8 on these face crops")
+    parser.add_argument("--videos", default=MU3D_VIDEOS_PATH, help="Otherwise calibrate int8 on crops of these videos")
+    parser.add_argument("--calibration-frames", type=int, default=DEFAULT_CALIBRATION_FRAMES)
+    args = parser.parse_args()
+
+    custom_objects = {"categorical_crossentropy": tf.keras.losses.categorical_crossentropy}
+    fer_model = tf.keras.models.load_model(FER_MODEL_PATH, custom_objects=custom_objects)
+    main_model = tf.keras.models.load_model(MAIN_MODEL_PATH)
+    mean_X, std_X = np.load(MEAN_X_PATH), np.load(STD_X_PATH)
+
+    calibration_frames = None
+    if args.mode == "int8":
+        if args.crops_dir:
+            calibration_frames = crop_frames(args.crops_dir, mean_X, std_X)
+        else:
+            calibration_frames = video_frames(args.videos, mean_X, std_X, args.calibration_frames)
+        if len(calibration_frames) == 0:
+            print(f"No face crops found in {args.crops_dir or args.videos}; calibrating on synthetic frames")
+            calibration_frames = representative_frames(mean_X, std_X, args.calibration_frames)
+
+    for keras_path, converted in [
+        (FER_MODEL_PATH, lambda: convert_fer_model(fer_model, args.mode, calibration_frames)),
+        (MAIN_MODEL_PATH, lambda: convert_main_model(main_model, args.mode)),
+    ]:
+        output_path = tflite_model_path(keras_path, args.mode)
+        with open(output_path, "wb") as f:
+            f.write(converted())
+        print(f"{output_path}: {os.path.getsize(output_path) / (1 << 20):.1f} MB "
+              f"(from {os.path.getsize(keras_path) / (1 << 20):.1f} MB)")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,169 @@
+import hashlib
+import json
+import os
+import tempfile
+import threading
+
+import numpy as np
+
+# Bump when a pipeline change alters results for the same video, parameters and models
+CACHE_VERSION = 2
+
+# Bytes read at a time when hashing uploads and model files
+HASH_CHUNK_SIZE = 1 << 20
+
+# Per-user, so other accounts on the machine can neither read the cached results nor plant entries
+DEFAULT_CACHE_DIR = os.path.join(os.environ.get("XDG_CACHE_HOME") or os.path.join(os.path.expanduser("~"), ".cache"),
+                                 "deeplie")
+DEFAULT_CACHE_MB = 1024
+
+def hash_file(path):
+    """sha256 hex digest of a file's contents."""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def save_and_hash(stream, path):
+    """Copy a readable stream (e.g. an upload) to path and return the sha256 hex digest of its bytes, in one pass."""
+    digest = hashlib.sha256()
+    with open(path, "wb") as f:
+        for chunk in iter(lambda: stream.read(HASH_CHUNK_SIZE), b""):
+            digest.update(chunk)
+            f.write(chunk)
+    return digest.hexdigest()
+
+def model_identity(paths):
+    """Digest of the given model and normalisation files, so replacing any of them invalidates the cache."""
+    return hashlib.sha256("".join(hash_file(path) for path in paths).encode()).hexdigest()
+
+def private_directory(path):
+    """
+    Create path readable only by the current user (mode 0700) if it is missing. Raises PermissionError
+    if it exists but belongs to another user or is writable by others, since its entries are trusted.
+    """
+    os.makedirs(path, mode=0o700, exist_ok=True)
+    if hasattr(os, "getuid"):
+        stat = os.stat(path)
+        if stat.st_uid != os.getuid():
+            raise PermissionError(f"Cache directory {path} belongs to another user")
+        if stat.st_mode & 0o022:
+            raise PermissionError(f"Cache directory {path} is writable by other users")
+
+def cache_key(video_digest, params, model_digest):
+    """Key of one analysis: the video's bytes, the preprocessing parameters and the models used."""
+    payload = json.dumps({"version": CACHE_VERSION, "video": video_digest, "params": params, "models": model_digest},
+                         sort_keys=True)
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+class ResultCache:
+    """
+    On-disk cache of analysis results keyed by cache_key. Each entry is <key>.json holding the
+    response payload and, optionally, <key>.npz holding the (frames, 4608) FER encodings and any
+    other arrays kept with the result (such as the visualization tiles) as float16.
+    Reading an entry refreshes its modification time; once the directory grows past max_bytes the
+    least recently used entries are deleted. The directory must be private to the current user.
+    """
+
+    def __init__(self, cache_dir=DEFAULT_CACHE_DIR, max_bytes=DEFAULT_CACHE_MB << 20, store_encodings=True):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.store_encodings = store_encodings
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        private_directory(cache_dir)
+
+    @classmethod
+    def from_env(cls):
+        """
+        Cache configured by DEEPLIE_CACHE_DIR, DEEPLIE_CACHE_MB (0 disables caching, returning None)
+        and DEEPLIE_CACHE_ENCODINGS (0 to store only results).
+        """
+        max_mb = int(os.environ.get("DEEPLIE_CACHE_MB", DEFAULT_CACHE_MB))
+        if max_mb <= 0:
+            return None
+        return cls(os.environ.get("DEEPLIE_CACHE_DIR", DEFAULT_CACHE_DIR), max_mb << 20,
+                   os.environ.get("DEEPLIE_CACHE_ENCODINGS", "1") != "0")
+
+    def _path(self, key, extension):
+        return os.path.join(self.cache_dir, key + extension)
+
+    def get(self, key):
+        """The cached result for key, or None."""
+        path = self._path(key, ".json")
+        try:
+            with open(path) as f:
+                result = json.load(f)
+            os.utime(path)
+        except (OSError, ValueError):
+            self.misses += 1
+            return None
+        self.hits += 1
+        return result
+
+    def get_arrays(self, key):
+        """The arrays cached with key's result as a dict of float16 arrays, or None."""
+        try:
+            with np.load(self._path(key, ".npz")) as data:
+                return {name: data[name] for name in data.files}
+        except (OSError, ValueError):
+            return None
+
+    def get_encodings(self, key):
+        """The cached (frames, 4608) float16 encodings for key, or None."""
+        return (self.get_arrays(key) or {}).get("encodings")
+
+    def put(self, key, result, encodings=None, arrays=None):
+        """
+        Store a JSON-serialisable result, the encodings (if enabled) and a dict of extra arrays,
+        then evict down to max_bytes.
+        """
+        arrays = dict(arrays or {})
+        if encodings is not None and self.store_encodings:
+            arrays["encodings"] = encodings
+        if arrays:
+            arrays = {name: np.asarray(array, np.float16) for name, array in arrays.items()}
+            self._write(key, ".npz", lambda f: np.savez_compressed(f, **arrays))
+        # The JSON file is written last: its presence marks the entry as complete
+        self._write(key, ".json", lambda f: f.write(json.dumps(result).encode()))
+        self.evict()
+
+    def _write(self, key, extension, write):
+        # Write to a temporary file and rename it, so readers never see a partial entry
+        fd, temp_path = tempfile.mkstemp(dir=self.cache_dir, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                write(f)
+            os.replace(temp_path, self._path(key, extension))
+        except BaseException:
+            os.remove(temp_path)
+            raise
+
+    def evict(self):
+        """Delete least recently used entries until the cache fits in max_bytes."""
+        with self._lock:
+            entries = {}
+            for entry in os.scandir(self.cache_dir):
+                key, extension = os.path.splitext(entry.name)
+                if extension not in (".json", ".npz"):
+                    continue
+                try:
+                    stat = entry.stat()
+                except OSError:
+                    continue
+                size, last_used = entries.get(key, (0, 0))
+                last_used = stat.st_mtime if extension == ".json" else last_used
+                entries[key] = (size + stat.st_size, last_used)
+
+            total = sum(size for size, _ in entries.values())
+            for key, (size, _) in sorted(entries.items(), key=lambda item: item[1][1]):
+                if total <= self.max_bytes:
+                    break
+                for extension in (".json", ".npz"):
+                    try:
+                        os.remove(self._path(key, extension))
+                    except FileNotFoundError:
+                        pass
+                total -= size
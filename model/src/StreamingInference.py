@@ -0,0 +1,386 @@
+import itertools
+import math
+import threading
+import time
+import uuid
+from collections import deque
+from contextlib import nullcontext
+
+import numpy as np
+import tensorflow as tf
+
+from InferenceEngine import preprocess_frames
+from FrameDeduplication import FrameDeduplicator
+from MediaPipeCropping import initialize_face_mesh, crop_face_from_landmarks, FaceTracker
+
+# Early exit: the running deception score counts as stable once the last EARLY_EXIT_PATIENCE + 1
+# scores, one per chunk of encoded frames, lie within the tolerance of each other
+DEFAULT_EARLY_EXIT_TOLERANCE = 0.02
+DEFAULT_EARLY_EXIT_PATIENCE = 2
+
+# Frames encoded before the score may count as stable
+DEFAULT_EARLY_EXIT_MIN_FRAMES = 90
+
+# Face crops encoded by the FER model and pushed to the classifier at a time
+DEFAULT_CHUNK_FRAMES = 30
+
+# Layers that act on every timestep independently at inference time
+POINTWISE_LAYERS = (
+    tf.keras.layers.BatchNormalization,
+    tf.keras.layers.Activation,
+    tf.keras.layers.Dropout,
+    tf.keras.layers.Dense,
+)
+
+class StreamingState:
+    """Per-stream progress through the deception model: buffered frames, conv outputs and GRU states."""
+
+    def __init__(self, recurrent_states):
+        self.frames = None            # Encodings not yet consumed by the Conv1D front
+        self.frames_offset = 0        # Absolute index of frames[0]
+        self.total_frames = 0
+        self.next_conv = 0            # Index of the next Conv1D output to compute
+        self.conv_outputs = None      # Conv1D outputs not yet consumed by pooling
+        self.conv_offset = 0          # Absolute index of conv_outputs[0]
+        self.next_step = 0            # Index of the next pooled timestep to feed the GRU
+        self.recurrent_states = recurrent_states
+        self.last_output = None       # Model output after the last committed timestep
+
+class StreamingClassifier:
+    """
+    Runs the GRU deception model incrementally over a stream of FER encodings.
+    The model is split into its Conv1D/MaxPooling1D front, which is evaluated on
+    each newly completed window, and its recurrent layers, which are stepped with
+    their cells so the hidden state carries forward between chunks. score() gives
+    the output the full model would produce if the stream ended at this point.
+    """
+
+    def __init__(self, main_model, reference_frames=300):
+        self.conv = None
+        self.frame_layers = []
+        self.pool = None
+        self.step_layers = []
+
+        stage = "conv"
+        for layer in main_model.layers:
+            if isinstance(layer, tf.keras.layers.InputLayer):
+                continue
+            if stage == "conv" and isinstance(layer, tf.keras.layers.Conv1D):
+                if layer.padding != "valid" or layer.dilation_rate[0] != 1:
+                    raise ValueError(f"Layer {layer.name} cannot be streamed: only undilated 'valid' Conv1D is supported.")
+                self.conv = layer
+                stage = "frame"
+            elif stage in ("conv", "frame") and isinstance(layer, tf.keras.layers.MaxPooling1D):
+                self.pool = layer
+                stage = "step"
+            elif stage in ("conv", "frame") and isinstance(layer, POINTWISE_LAYERS) and not self.step_layers:
+                self.frame_layers.append(layer)
+                stage = "frame"
+            elif isinstance(layer, tf.keras.layers.RNN) or isinstance(layer, POINTWISE_LAYERS):
+                if isinstance(layer, tf.keras.layers.RNN) and layer.go_backwards:
+                    raise ValueError(f"Layer {layer.name} cannot be streamed: backwards recurrent layers need the whole sequence.")
+                self.step_layers.append(layer)
+                stage = "step"
+            else:
+                raise ValueError(f"Layer {layer.name} ({type(layer).__name__}) cannot be streamed.")
+
+        if not any(isinstance(layer, tf.keras.layers.RNN) for layer in self.step_layers):
+            raise ValueError("The model has no recurrent layer to stream.")
+
+        self.conv_kernel = self.conv.kernel_size[0] if self.conv else 1
+        self.conv_stride = self.conv.strides[0] if self.conv else 1
+        self.pool_size = self.pool.pool_size[0] if self.pool else 1
+        self.pool_stride = self.pool.strides[0] if self.pool else 1
+
+        # 'same' pooling pads the start of the sequence; stream with the padding the model sees at reference length
+        self.pool_offset = 0
+        if self.pool is not None and self.pool.padding == "same":
+            conv_length = (reference_frames - self.conv_kernel) // self.conv_stride + 1
+            pooled_length = math.ceil(conv_length / self.pool_stride)
+            pad_total = max((pooled_length - 1) * self.pool_stride + self.pool_size - conv_length, 0)
+            self.pool_offset = pad_total // 2
+
+    def new_state(self):
+        """Create an empty state for a new stream."""
+        recurrent_states = [
+            [tf.zeros((1, size)) for size in tf.nest.flatten(layer.cell.state_size)]
+            for layer in self.step_layers if isinstance(layer, tf.keras.layers.RNN)
+        ]
+        return StreamingState(recurrent_states)
+
+    def push(self, state, encodings):
+        """Feed (N, 4608) encodings of the next frames and commit every timestep they complete."""
+        if len(encodings) == 0:
+            return
+        encodings = np.asarray(encodings, dtype=np.float32)
+        state.frames = encodings if state.frames is None else np.concatenate([state.frames, encodings])
+        state.total_frames += len(encodings)
+
+        # Conv1D outputs whose receptive field is now complete
+        last_conv = (state.total_frames - self.conv_kernel) // self.conv_stride
+        if last_conv >= state.next_conv:
+            start = state.next_conv * self.conv_stride - state.frames_offset
+            end = last_conv * self.conv_stride + self.conv_kernel - state.frames_offset
+            window = state.frames[start:end][np.newaxis]
+            outputs = self.conv(window, training=False) if self.conv else window
+            for layer in self.frame_layers:
+                outputs = layer(outputs, training=False)
+            outputs = np.asarray(outputs)[0]
+            state.conv_outputs = outputs if state.conv_outputs is None else np.concatenate([state.conv_outputs, outputs])
+            state.next_conv = last_conv + 1
+
+            # Drop frames no future Conv1D window needs
+            consumed = state.next_conv * self.conv_stride - state.frames_offset
+            state.frames = state.frames[consumed:]
+            state.frames_offset += consumed
+
+        # Pooled timesteps whose window is now complete
+        conv_count = state.conv_offset + (0 if state.conv_outputs is None else len(state.conv_outputs))
+        while state.next_step * self.pool_stride - self.pool_offset + self.pool_size <= conv_count:
+            pooled = self._pool_window(state, state.next_step, conv_count)
+            state.last_output, state.recurrent_states = self._run_step(pooled, state.recurrent_states)
+            state.next_step += 1
+
+            # Drop conv outputs no future pooling window needs
+            keep_from = max(0, state.next_step * self.pool_stride - self.pool_offset)
+            consumed = max(0, keep_from - state.conv_offset)
+            state.conv_outputs = state.conv_outputs[consumed:]
+            state.conv_offset += consumed
+
+    def score(self, state):
+        """
+        Deception score as if the stream ended now, or None before the first Conv1D output.
+        The partially filled pooling window is evaluated without committing it.
+        """
+        conv_count = state.conv_offset + (0 if state.conv_outputs is None else len(state.conv_outputs))
+        window_start = max(0, state.next_step * self.pool_stride - self.pool_offset)
+        if conv_count > window_start:
+            pooled = self._pool_window(state, state.next_step, conv_count)
+            output, _ = self._run_step(pooled, state.recurrent_states)
+        elif state.last_output is not None:
+            output = state.last_output
+        else:
+            return None
+        return float(np.asarray(output).reshape(-1)[0])
+
+    def _pool_window(self, state, step, conv_count):
+        start = max(0, step * self.pool_stride - self.pool_offset)
+        end = min(conv_count, step * self.pool_stride - self.pool_offset + self.pool_size)
+        window = state.conv_outputs[start - state.conv_offset:end - state.conv_offset]
+        return window.max(axis=0)[np.newaxis, np.newaxis]
+
+    def _run_step(self, x, recurrent_states):
+        # x is a (1, 1, C) single-timestep sequence until a recurrent layer stops returning sequences
+        new_states = []
+        states = iter(recurrent_states)
+        for layer in self.step_layers:
+            if isinstance(layer, tf.keras.layers.RNN):
+                output, layer_state = layer.cell(x[:, 0], next(states), training=False)
+                new_states.append(tf.nest.flatten(layer_state))
+                x = output[:, tf.newaxis] if layer.return_sequences else output
+            else:
+                x = layer(x, training=False)
+        return x, new_states
+
+class EarlyExit:
+    """
+    Decides when a running deception score has settled: once at least min_frames frames are used and
+    the last patience + 1 scores lie within tolerance of each other, all on the same side of 0.5.
+    A tolerance of 0 never stops early.
+    """
+
+    def __init__(self, tolerance=DEFAULT_EARLY_EXIT_TOLERANCE, patience=DEFAULT_EARLY_EXIT_PATIENCE,
+                 min_frames=DEFAULT_EARLY_EXIT_MIN_FRAMES):
+        self.tolerance = tolerance
+        self.min_frames = min_frames
+        self.scores = deque(maxlen=patience + 1)
+
+    def update(self, score, frames_used):
+        """Record the score after frames_used frames; returns True once it is stable."""
+        if score is None:
+            return False
+        self.scores.append(score)
+        if self.tolerance <= 0 or frames_used < self.min_frames or len(self.scores) < self.scores.maxlen:
+            return False
+        return max(self.scores) - min(self.scores) <= self.tolerance and len({score > 0.5 for score in self.scores}) == 1
+
+def score_crops(crops, fer_engine, classifier, mean_X, std_X, max_frames=None, chunk_frames=DEFAULT_CHUNK_FRAMES,
+                early_exit=None, inference_lock=None, progress_callback=None):
+    """
+    Score the face crops of one video with only its real frames: crops are pulled from an iterable
+    (e.g. a crop generator) chunk_frames at a time, encoded by the FER engine and pushed to the
+    StreamingClassifier, with no resampling or duplicated frames. Stops after max_frames crops, or
+    as soon as early_exit (an EarlyExit) calls the score stable; a generator is then closed, so
+    nothing more is decoded. inference_lock, if given, is held while each chunk runs through the models.
+    progress_callback, if given, is called with the number of frames used after each chunk.
+    Returns a dict with the final "score" (None without any crop), "frames_used", "stopped_early",
+    the running "scores" after each chunk, and the "frames_processed", "emotion_preds" and
+    "encodings" arrays of the frames used.
+    """
+    inference_lock = inference_lock or nullcontext()
+    state = classifier.new_state()
+    chunks = {"frames_processed": [], "emotion_preds": [], "encodings": []}
+    scores = []
+    frames_used = 0
+    stopped_early = False
+    crops = iter(crops)
+    try:
+        while max_frames is None or frames_used < max_frames:
+            size = chunk_frames if max_frames is None else min(chunk_frames, max_frames - frames_used)
+            chunk = list(itertools.islice(crops, size))
+            if not chunk:
+                break
+            frames_processed = preprocess_frames(chunk, mean_X, std_X)
+            with inference_lock:
+                emotion_preds, encodings = fer_engine.run(frames_processed)
+                classifier.push(state, encodings)
+                score = classifier.score(state)
+            frames_used += len(chunk)
+            for name, array in zip(chunks, (frames_processed, emotion_preds, encodings)):
+                chunks[name].append(array)
+            if score is not None:
+                scores.append(score)
+            if progress_callback is not None:
+                progress_callback(frames_used)
+            if early_exit is not None and early_exit.update(score, frames_used):
+                stopped_early = True
+                break
+    finally:
+        if hasattr(crops, "close"):
+            crops.close()
+
+    result = {name: np.concatenate(arrays) if arrays else None for name, arrays in chunks.items()}
+    result.update(score=scores[-1] if scores else None, frames_used=frames_used, stopped_early=stopped_early,
+                  scores=scores)
+    return result
+
+class StreamSession:
+    """
+    Streaming analysis of one client's frames: face cropping, SSIM dedup, FER encoding and GRU state.
+    The stream is scored in clips: end_clip() returns the current clip's snapshot and starts the next
+    one from a fresh GRU state, so each clip is scored on its own frames like an uploaded video.
+    frames_received counts every frame of the session, frames_used only the current clip's crops.
+    inference_lock, if given, is held while the models run, as for the analysis jobs.
+    """
+
+    def __init__(self, fer_engine, classifier, mean_X, std_X, emit_every=10, emotion_window=300, ssim_threshold=0.9,
+                 inference_lock=None):
+        self.session_id = uuid.uuid4().hex
+        self.fer_engine = fer_engine
+        self.classifier = classifier
+        self.mean_X = mean_X
+        self.std_X = std_X
+        self.emit_every = emit_every
+        self.inference_lock = inference_lock or nullcontext()
+        self.face_mesh = initialize_face_mesh()
+        self.tracker = FaceTracker(self.face_mesh)
+        self.deduplicator = FrameDeduplicator(ssim_threshold)
+        self.state = classifier.new_state()
+        self.emotion_preds = deque(maxlen=emotion_window)
+        self.frames_received = 0
+        self.frames_used = 0
+        self.clip = 0
+        self.last_emitted = 0
+        self.last_active = time.time()
+        self.lock = threading.Lock()
+
+    def push_frames(self, frames):
+        """
+        Feed decoded BGR frames in capture order.
+        Returns a snapshot every emit_every received frames, otherwise None.
+        """
+        with self.lock:
+            self.last_active = time.time()
+            crops = []
+            for frame in frames:
+                self.frames_received += 1
+                landmarks = self.tracker.update(frame)
+                if landmarks is None:
+                    continue
+                face_crop = crop_face_from_landmarks(frame, landmarks)
+                if face_crop is not None and self.deduplicator.accept(face_crop):
+                    crops.append(face_crop)
+
+            if crops:
+                frames_processed = preprocess_frames(crops, self.mean_X, self.std_X)
+                with self.inference_lock:
+                    emotion_preds, encodings = self.fer_engine.run(frames_processed)
+                    self.classifier.push(self.state, encodings)
+                self.emotion_preds.extend(emotion_preds)
+                self.frames_used += len(crops)
+
+            if self.frames_received - self.last_emitted >= self.emit_every:
+                self.last_emitted = self.frames_received
+                return self._snapshot()
+            return None
+
+    def snapshot(self):
+        """Rolling emotion predictions over the recent window of the clip and its current deception score."""
+        with self.lock:
+            return self._snapshot()
+
+    def end_clip(self):
+        """Snapshot of the current clip; the next frames start a new clip with a fresh score and emotions."""
+        with self.lock:
+            snapshot = self._snapshot()
+            self.state = self.classifier.new_state()
+            self.emotion_preds.clear()
+            self.frames_used = 0
+            self.clip += 1
+            return snapshot
+
+    def _snapshot(self):
+        with self.inference_lock:
+            score = self.classifier.score(self.state)
+        return {
+            "frames_received": self.frames_received,
+            "frames_used": self.frames_used,
+            "clip": self.clip,
+            "emotion_preds": np.array(self.emotion_preds),
+            "score": score,
+        }
+
+    def close(self):
+        """Release the face mesh; the session must not be used afterwards."""
+        with self.lock:
+            self.face_mesh.close()
+
+class StreamSessions:
+    """Registry of open stream sessions; idle sessions are closed after idle_timeout seconds."""
+
+    def __init__(self, max_sessions=16, idle_timeout=60):
+        self.max_sessions = max_sessions
+        self.idle_timeout = idle_timeout
+        self._sessions = {}
+        self._lock = threading.Lock()
+
+    def add(self, session):
+        """Register a new session; raises RuntimeError when too many sessions are open."""
+        with self._lock:
+            self._close_idle()
+            if len(self._sessions) >= self.max_sessions:
+                session.close()
+                raise RuntimeError(f"Too many open streams ({len(self._sessions)}); try again shortly.")
+            self._sessions[session.session_id] = session
+        return session
+
+    def get(self, session_id):
+        """Return the open session with this id, or None once it is closed or has been idle too long."""
+        with self._lock:
+            self._close_idle()
+            return self._sessions.get(session_id)
+
+    def remove(self, session_id):
+        """Unregister and close a session; returns it, or None if it was unknown."""
+        with self._lock:
+            session = self._sessions.pop(session_id, None)
+        if session is not None:
+            session.close()
+        return session
+
+    def _close_idle(self):
+        now = time.time()
+        idle = [session_id for session_id, session in self._sessions.items()
+                if now - session.last_active > self.idle_timeout]
+        for session_id in idle:
+            self._sessions.pop(session_id).close()
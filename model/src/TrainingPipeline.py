@@ -0,0 +1,196 @@
+"""
+tf.data input pipelines for retraining the FER CNN and the deception GRU, so that training is bound
+by the models rather than by per-frame Python loops.
+
+fer_dataset() serves face images (FER2013-style 48x48 grayscale arrays or the 128x128 BGR face crops
+of MediaPipeCropping) in batches: the grayscale/resize step runs once and is cached, and the
+augmentations of HOF_100.ipynb's apply_augmentations (flip, brightness, Gaussian noise, rotation,
+each with probability 0.5) run on whole batches with stateless random ops in a parallel map.
+Each batch's randomness comes from a seeded stream, so a run is reproducible for a given seed
+whatever the number of threads, while every epoch sees different augmentations.
+
+sequence_dataset() serves whole (300, 4608) encoding sequences of a FeatureStore to the GRU: the
+shuffled video indices are batched first and each batch is gathered from the memory-mapped chunks
+in one indexing call, so only the batch is ever copied.
+
+train() runs the epochs and reports, next to the loss and metrics, how long each epoch waited on
+the input pipeline ("input_stall_seconds"); with the pipeline keeping up it stays near zero.
+
+    train_ds = fer_dataset(X_train, y_train, mean_X, std_X, training=True, seed=0)
+    history = train(model, train_ds, epochs=100, validation_data=fer_dataset(X_valid, y_valid, mean_X, std_X))
+"""
+import time
+
+import numpy as np
+import tensorflow as tf
+
+from InferenceEngine import FER_INPUT_SIZE
+
+# Batch size of the training cells in DeepLie.ipynb
+DEFAULT_BATCH_SIZE = 64
+
+# Augmentations of apply_augmentations in HOF_100.ipynb: each is applied with this probability
+AUGMENT_PROBABILITY = 0.5
+BRIGHTNESS_RANGE = (0.8, 1.2)
+NOISE_STD = 10.0       # Pixel values (0-255)
+MAX_ROTATION = 10.0    # Degrees
+
+# Examples shuffled at a time; FER2013 and MU3D fit entirely
+DEFAULT_SHUFFLE_BUFFER = 50000
+
+def prepare_images(images):
+    """
+    (N, H, W, C) uint8 or float pixel images as (N, 48, 48, 1) float32 FER inputs before normalization:
+    BGR crops are converted to grayscale with the weights of cv2.COLOR_BGR2GRAY, and other sizes resized.
+    """
+    images = tf.cast(images, tf.float32)
+    if images.shape[-1] == 3:
+        images = tf.image.rgb_to_grayscale(images[..., ::-1])
+    if images.shape[1:3] != (FER_INPUT_SIZE, FER_INPUT_SIZE):
+        images = tf.image.resize(images, (FER_INPUT_SIZE, FER_INPUT_SIZE))
+    return images
+
+def rotation_transforms(angles, height, width):
+    """Projective transforms (ImageProjectiveTransformV3 rows) rotating images by angles (radians) about their centre."""
+    cos, sin = tf.cos(angles), tf.sin(angles)
+    x_offset = ((width - 1) - (cos * (width - 1) - sin * (height - 1))) / 2
+    y_offset = ((height - 1) - (sin * (width - 1) + cos * (height - 1))) / 2
+    zeros = tf.zeros_like(angles)
+    return tf.stack([cos, -sin, x_offset, sin, cos, y_offset, zeros, zeros], axis=1)
+
+def augment_images(images, seed, probability=AUGMENT_PROBABILITY):
+    """
+    Randomly flipped, brightened, noised and rotated copies of a (B, H, W, C) batch of 0-255 float
+    images, each augmentation drawn per image with the given probability. seed is a shape (2,) int
+    tensor; the same seed always gives the same result.
+    """
+    batch = tf.shape(images)[0]
+    height, width = images.shape[1], images.shape[2]
+    seeds = tf.random.experimental.stateless_split(seed, 8)
+    apply = [tf.random.stateless_uniform([batch], seeds[idx]) < probability for idx in range(4)]
+
+    images = tf.where(tf.reshape(apply[0], [-1, 1, 1, 1]), tf.reverse(images, axis=[2]), images)
+    factors = tf.random.stateless_uniform([batch], seeds[4], *BRIGHTNESS_RANGE)
+    factors = tf.where(apply[1], factors, tf.ones_like(factors))
+    images = tf.clip_by_value(images * tf.reshape(factors, [-1, 1, 1, 1]), 0, 255)
+
+    # Noise and rotation are only computed for the images they apply to
+    def add_noise(selected):
+        return tf.clip_by_value(selected + tf.random.stateless_normal(tf.shape(selected), seeds[5], stddev=NOISE_STD),
+                                0, 255)
+
+    def rotate(selected):
+        angles = tf.random.stateless_uniform([tf.shape(selected)[0]], seeds[6], -MAX_ROTATION, MAX_ROTATION)
+        return tf.raw_ops.ImageProjectiveTransformV3(
+            images=selected, transforms=rotation_transforms(angles * (np.pi / 180), height, width),
+            output_shape=tf.shape(selected)[1:3], fill_value=0.0, interpolation="BILINEAR", fill_mode="CONSTANT")
+
+    images = update_where(apply[2], add_noise, images)
+    return update_where(apply[3], rotate, images)
+
+def update_where(mask, fn, images):
+    """images with fn applied to the ones selected by the boolean (B,) mask."""
+    indices = tf.where(mask)
+    return tf.tensor_scatter_nd_update(images, indices, fn(tf.gather_nd(images, indices)))
+
+def batch_seeds(seed):
+    """Endless dataset of shape (2,) stateless seeds, reproducible for seed and different every epoch."""
+    return tf.data.Dataset.random(seed=seed, rerandomize_each_iteration=True).batch(2)
+
+def fer_dataset(images, labels, mean_X, std_X, batch_size=DEFAULT_BATCH_SIZE, training=False, seed=0,
+                augment=None, cache=True, shuffle_buffer=DEFAULT_SHUFFLE_BUFFER):
+    """
+    Batches of (normalized (B, 48, 48, 1) images, labels) for the FER CNN.
+    images are (N, H, W, C) pixel arrays (see prepare_images), labels one-hot (N, 7) or class ids.
+    A training dataset is shuffled and augmented (augment defaults to training) and drops the last
+    partial batch. cache keeps the prepared images in memory (True) or in a file of that name.
+    """
+    augment = training if augment is None else augment
+    mean_X = tf.constant(mean_X, tf.float32)
+    std_X = tf.constant(std_X, tf.float32) + 1e-8
+
+    dataset = tf.data.Dataset.from_tensor_slices((images, labels))
+    dataset = dataset.batch(1024).map(lambda x, y: (prepare_images(x), y), num_parallel_calls=tf.data.AUTOTUNE).unbatch()
+    if cache:
+        dataset = dataset.cache("" if cache is True else cache)
+    if training:
+        dataset = dataset.shuffle(min(shuffle_buffer, len(images)), seed=seed, reshuffle_each_iteration=True)
+    dataset = dataset.batch(batch_size, drop_remainder=training)
+    if augment:
+        dataset = tf.data.Dataset.zip((dataset, batch_seeds(seed)))
+        dataset = dataset.map(lambda batch, batch_seed: (augment_images(batch[0], batch_seed), batch[1]),
+                              num_parallel_calls=tf.data.AUTOTUNE, deterministic=True)
+    dataset = dataset.map(lambda x, y: ((x - mean_X) / std_X, y), num_parallel_calls=tf.data.AUTOTUNE)
+    return dataset.prefetch(tf.data.AUTOTUNE)
+
+def sequence_dataset(features, batch_size=DEFAULT_BATCH_SIZE, training=False, seed=0, noise_std=0.0):
+    """
+    Batches of ((B, 300, 4608) encodings, (B,) labels) for the GRU from FeatureStore Features, whose
+    encodings may be memory-mapped or a StackedArray of memory maps (the training side of
+    leave_one_subject_out): each batch is gathered in one indexing call, in a parallel map.
+    A training dataset is shuffled, and noise_std > 0 adds seeded Gaussian noise to its encodings.
+    """
+    encodings, labels = features.encodings, np.asarray(features.labels, dtype=np.float32)
+    sequence_shape = encodings.shape[1:]
+
+    def gather(indices):
+        # Sorted indices read the memory map in file order
+        indices = np.sort(indices)
+        return np.asarray(encodings[indices], dtype=np.float32), labels[indices]
+
+    def load(indices):
+        batch, batch_labels = tf.numpy_function(gather, [indices], (tf.float32, tf.float32))
+        batch.set_shape((None,) + sequence_shape)
+        batch_labels.set_shape((None,))
+        return batch, batch_labels
+
+    dataset = tf.data.Dataset.range(len(labels))
+    if training:
+        dataset = dataset.shuffle(len(labels), seed=seed, reshuffle_each_iteration=True)
+    dataset = dataset.batch(batch_size).map(load, num_parallel_calls=tf.data.AUTOTUNE, deterministic=True)
+    if training and noise_std > 0:
+        dataset = tf.data.Dataset.zip((dataset, batch_seeds(seed)))
+        dataset = dataset.map(
+            lambda batch, batch_seed: (batch[0] + tf.random.stateless_normal(tf.shape(batch[0]), batch_seed,
+                                                                             stddev=noise_std), batch[1]),
+            num_parallel_calls=tf.data.AUTOTUNE, deterministic=True)
+    return dataset.prefetch(tf.data.AUTOTUNE)
+
+def train(model, dataset, epochs, validation_data=None, log=print):
+    """
+    Train a compiled Keras model on a dataset for some epochs. Returns one dict per epoch with the
+    mean training loss and metrics, the validation ones prefixed with "val_", "seconds", "steps",
+    and "input_stall_seconds", the time spent waiting for the next batch of the input pipeline.
+    """
+    history = []
+    for epoch in range(epochs):
+        totals, examples, steps, stall = {}, 0, 0, 0.0
+        started = time.perf_counter()
+        batches = iter(dataset)
+        while True:
+            wait_started = time.perf_counter()
+            try:
+                x, y = next(batches)
+            except StopIteration:
+                break
+            stall += time.perf_counter() - wait_started
+            logs = model.train_on_batch(x, y, return_dict=True)
+            size = int(tf.shape(y)[0])
+            for name, value in logs.items():
+                totals[name] = totals.get(name, 0.0) + float(value) * size
+            examples += size
+            steps += 1
+        seconds = time.perf_counter() - started
+
+        epoch_logs = {name: total / max(examples, 1) for name, total in totals.items()}
+        if validation_data is not None:
+            val_logs = model.evaluate(validation_data, verbose=0, return_dict=True)
+            epoch_logs.update({"val_" + name: float(value) for name, value in val_logs.items()})
+        epoch_logs.update(seconds=seconds, steps=steps, input_stall_seconds=stall)
+        history.append(epoch_logs)
+        if log is not None:
+            metrics = " ".join(f"{name}={value:.4f}" for name, value in epoch_logs.items()
+                               if name not in ("seconds", "steps", "input_stall_seconds"))
+            log(f"Epoch {epoch + 1}/{epochs}: {metrics} ({seconds:.1f} s, input stall {stall:.2f} s"
+                f" = {stall / seconds if seconds else 0:.1%})")
+    return history
@@ -0,0 +1,256 @@
+"""
+Ingestion of uploads that are still arriving. The request thread copies the body into an
+UploadBuffer, hashing it on the way, while an analysis job decodes it through an AVCapture:
+a cv2.VideoCapture look-alike backed by PyAV that reads from the buffer, blocking until the bytes
+it needs have arrived. Face cropping therefore starts on the first frames instead of after the
+upload has been received and written to disk.
+
+Streamed containers (WebM from MediaRecorder, MKV, MP4 with the index at the front) decode as they
+arrive; an MP4 with its index at the end is only decodable once complete, which costs nothing over
+waiting for it. PyAV (pip install av) is optional: without it uploads are saved to a file first.
+
+Only the first memory_limit bytes of an upload are kept in memory; a larger upload spills to an
+anonymous temporary file, so concurrent uploads of long videos do not each hold the video in RAM.
+"""
+import hashlib
+import io
+import tempfile
+import threading
+
+import cv2
+
+from JobQueue import JobCancelledError
+from ResultCache import HASH_CHUNK_SIZE
+
+# Bytes of an upload kept in memory before it spills to a temporary file
+DEFAULT_MEMORY_LIMIT = 32 << 20
+
+class UploadAbortedError(JobCancelledError):
+    """Raised to readers of an upload that will not be completed or is no longer needed; cancels their job."""
+
+def streaming_decode_available():
+    """True if PyAV is installed, so uploads can be decoded while they arrive."""
+    try:
+        import av  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+class UploadBuffer:
+    """
+    An upload received while other threads read it. One thread feeds it with receive() (or write()
+    and finish()), which also computes the sha256 digest; open() returns file-like readers whose
+    reads block until the requested bytes have arrived or the upload is complete. Past memory_limit
+    bytes the upload moves to a temporary file in spill_dir (default: the system's), removed by close().
+    expected_size, e.g. the request's Content-Length, answers the demuxers' size queries (seeks relative
+    to the end) before the upload is complete; without it they wait for the whole upload.
+    """
+
+    def __init__(self, memory_limit=DEFAULT_MEMORY_LIMIT, spill_dir=None, expected_size=None):
+        self.digest = None
+        self.expected_size = expected_size
+        self.memory_limit = memory_limit
+        self.spill_dir = spill_dir
+        self._data = bytearray()
+        self._file = None
+        self._size = 0
+        self._closed = False
+        self._hash = hashlib.sha256()
+        self._complete = False
+        self._error = None
+        self._changed = threading.Condition()
+        # Serialises the seek-and-read/write pairs on the spill file
+        self._file_lock = threading.Lock()
+
+    @property
+    def size(self):
+        return self._size
+
+    @property
+    def complete(self):
+        return self._complete
+
+    @property
+    def spilled(self):
+        """True once the upload has moved from memory to a temporary file."""
+        return self._file is not None
+
+    def write(self, chunk):
+        self._hash.update(chunk)
+        with self._file_lock:
+            # Once closed nobody reads the upload any more; only its digest is still wanted
+            if not self._closed:
+                self._store(chunk)
+        with self._changed:
+            self._size += len(chunk)
+            self._changed.notify_all()
+
+    def _store(self, chunk):
+        if self._file is None and self._size + len(chunk) > self.memory_limit:
+            self._file = tempfile.TemporaryFile(dir=self.spill_dir)
+            self._file.write(self._data)
+            self._data = None
+        if self._file is None:
+            self._data += chunk
+        else:
+            self._file.seek(0, io.SEEK_END)
+            self._file.write(chunk)
+
+    def read_range(self, start, end):
+        """The bytes from start to end, which must have arrived."""
+        with self._file_lock:
+            if self._closed:
+                raise UploadAbortedError("The upload has been closed.")
+            if self._file is None:
+                return bytes(self._data[start:end])
+            self._file.seek(start)
+            return self._file.read(max(0, end - start))
+
+    def close(self):
+        """Release the upload's memory or temporary file; later reads fail, later writes are only hashed."""
+        with self._file_lock:
+            self._closed = True
+            self._data = None
+            if self._file is not None:
+                self._file.close()
+
+    def finish(self):
+        """Mark the upload complete and return the sha256 hex digest of its bytes."""
+        with self._changed:
+            self.digest = self._hash.hexdigest()
+            self._complete = True
+            self._changed.notify_all()
+        return self.digest
+
+    def abort(self, error=None):
+        """Fail every current and future read, e.g. once the client has gone away or nobody needs the video any more."""
+        with self._changed:
+            self._error = error or UploadAbortedError("The upload was not completed.")
+            self._changed.notify_all()
+
+    def receive(self, stream, chunk_size=HASH_CHUNK_SIZE):
+        """
+        Copy a readable stream (e.g. the request body) into the buffer and return its sha256 hex digest.
+        If reading fails, e.g. on a size limit or a disconnect, readers are aborted and the error re-raised.
+        """
+        try:
+            for chunk in iter(lambda: stream.read(chunk_size), b""):
+                self.write(chunk)
+        except BaseException as e:
+            self.abort(UploadAbortedError(f"The upload was not completed: {e}"))
+            raise
+        return self.finish()
+
+    def wait(self, end=None):
+        """Block until end bytes (or, with None, all of them) have arrived; returns the number received."""
+        with self._changed:
+            while self._error is None and not self._complete and (end is None or self._size < end):
+                self._changed.wait()
+            if self._error is not None:
+                raise self._error
+            return self._size
+
+    def total_size(self):
+        """Size of the whole upload: expected_size while it is arriving, if given, else once it is complete."""
+        if self.expected_size is not None and not self._complete and self._error is None:
+            return self.expected_size
+        return self.wait()
+
+    def open(self):
+        return UploadReader(self)
+
+class UploadReader:
+    """Seekable binary reader over an UploadBuffer; seeking relative to the end needs its total_size()."""
+
+    def __init__(self, upload):
+        self.upload = upload
+        self.position = 0
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def read(self, size=-1):
+        end = self.upload.wait(None if size is None or size < 0 else self.position + size)
+        if size is not None and size >= 0:
+            end = min(end, self.position + size)
+        data = self.upload.read_range(self.position, end)
+        self.position = max(self.position, end)
+        return data
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_END:
+            offset += self.upload.total_size()
+        elif whence == io.SEEK_CUR:
+            offset += self.position
+        self.position = max(0, offset)
+        return self.position
+
+    def tell(self):
+        return self.position
+
+    def close(self):
+        pass
+
+class AVCapture:
+    """
+    The part of the cv2.VideoCapture interface the cropping pipeline uses (read, grab, get,
+    isOpened, release), decoding a file-like object with PyAV. Frames come out as BGR arrays;
+    grab() decodes without the colour conversion, as cv2's does.
+    """
+
+    def __init__(self, fileobj):
+        import av
+        self.container = av.open(fileobj, mode="r")
+        self.stream = self.container.streams.video[0]
+        self.stream.thread_type = "AUTO"
+        self._frames = self.container.decode(self.stream)
+        self._frame = None
+        self._opened = True
+
+    def isOpened(self):
+        return self._opened
+
+    def grab(self):
+        self._frame = next(self._frames, None) if self._opened else None
+        if self._frame is None:
+            self._opened = False
+            return False
+        return True
+
+    def retrieve(self):
+        if self._frame is None:
+            return False, None
+        return True, self._frame.to_ndarray(format="bgr24")
+
+    def read(self):
+        if not self.grab():
+            return False, None
+        return self.retrieve()
+
+    def get(self, prop):
+        """Frame count (0 when the container does not say, as for most streamed WebM), fps or frame size."""
+        if prop == cv2.CAP_PROP_FRAME_COUNT:
+            return float(self.stream.frames or 0)
+        if prop == cv2.CAP_PROP_FPS:
+            return float(self.stream.average_rate or 0)
+        if prop == cv2.CAP_PROP_FRAME_WIDTH:
+            return float(self.stream.codec_context.width)
+        if prop == cv2.CAP_PROP_FRAME_HEIGHT:
+            return float(self.stream.codec_context.height)
+        return 0.0
+
+    def set(self, prop, value):
+        return False  # Seeking a stream that is still arriving is not supported
+
+    def release(self):
+        if self.container is not None:
+            self.container.close()
+            self.container = None
+        self._opened = False
+
+def open_upload_capture(upload):
+    """AVCapture decoding an UploadBuffer from its start; blocks until the container header has arrived."""
+    return AVCapture(upload.open())
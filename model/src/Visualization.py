@@ -0,0 +1,96 @@
+import cv2
+import numpy as np
+
+from constants import EMOTION_LABELS
+
+# Frames shown in the visualization, evenly spaced over the analysed sequence
+DEFAULT_TILES = 8
+
+# Rendered width in pixels unless the client asks for another; renders are clamped to this range
+DEFAULT_RENDER_WIDTH = 1600
+MIN_RENDER_WIDTH = 256
+MAX_RENDER_WIDTH = 3200
+
+# Shape the 4608-value flatten encodings are displayed in
+ENCODING_GRID = (64, 72)
+
+BACKGROUND = 255
+TEXT_COLOR = (0, 0, 0)
+
+def select_tiles(frames_processed, emotion_preds, encodings, num_tiles=DEFAULT_TILES):
+    """
+    The data the visualization needs, kept instead of a rendered image: num_tiles evenly spaced
+    normalized 48x48 frames, their emotion predictions and their encodings.
+    """
+    indices = np.linspace(0, len(frames_processed) - 1, min(num_tiles, len(frames_processed)), dtype=int)
+    return {
+        "frames": np.asarray(frames_processed)[indices, :, :, 0],
+        "emotion_preds": np.asarray(emotion_preds)[indices],
+        "encodings": np.asarray(encodings)[indices],
+    }
+
+def render_width(requested_width=None):
+    """Clamp a requested width and round it to 64 pixels, which also bounds how many renders get cached."""
+    width = requested_width or DEFAULT_RENDER_WIDTH
+    width = int(round(width / 64)) * 64
+    return min(max(width, MIN_RENDER_WIDTH), MAX_RENDER_WIDTH)
+
+def to_uint8(image):
+    """Stretch an image to 0-255 over its own range, as imshow does."""
+    image = np.nan_to_num(image.astype(np.float32), nan=0.0, posinf=0.0, neginf=0.0)
+    low, high = image.min(), image.max()
+    scale = 255.0 / (high - low) if high > low else 0.0
+    return ((image - low) * scale).astype(np.uint8)
+
+def encoding_grid(encoding):
+    """Reshape an encoding for display: 64x72 for the FER flatten layer, otherwise as square as possible."""
+    if encoding.size == ENCODING_GRID[0] * ENCODING_GRID[1]:
+        return encoding.reshape(ENCODING_GRID)
+    side = int(np.sqrt(encoding.size))
+    return encoding[:side * (encoding.size // side)].reshape(side, -1)
+
+def draw_caption(canvas, text, x, y, width, height):
+    """Draw text centred in the box at (x, y), scaled to its height."""
+    scale = height / 40
+    thickness = max(1, int(round(scale * 1.5)))
+    (text_width, text_height), _ = cv2.getTextSize(text, cv2.FONT_HERSHEY_SIMPLEX, scale, thickness)
+    origin = (x + max(0, (width - text_width) // 2), y + (height + text_height) // 2)
+    cv2.putText(canvas, text, origin, cv2.FONT_HERSHEY_SIMPLEX, scale, TEXT_COLOR, thickness, cv2.LINE_AA)
+
+def render_visualization(tiles, width=DEFAULT_RENDER_WIDTH):
+    """
+    Composite the tiles into one BGR image: a row of grayscale frames captioned with their dominant
+    emotion, above a row of viridis encoding heatmaps. Drawn directly with NumPy and OpenCV.
+    """
+    frames, emotion_preds, encodings = tiles["frames"], tiles["emotion_preds"], tiles["encodings"]
+    count = max(1, len(frames))
+    cell = width // count
+    pad = max(2, cell // 16)
+    inner = cell - 2 * pad
+    caption = max(12, cell // 7)
+    heatmap_height = inner * ENCODING_GRID[0] // ENCODING_GRID[1]
+    height = 2 * caption + inner + heatmap_height + 4 * pad
+
+    canvas = np.full((height, cell * count, 3), BACKGROUND, dtype=np.uint8)
+    for j in range(len(frames)):
+        x = j * cell + pad
+        label = EMOTION_LABELS[int(np.argmax(emotion_preds[j]))] if j < len(emotion_preds) else f"Frame {j}"
+        draw_caption(canvas, label, x, pad, inner, caption)
+        frame = cv2.resize(to_uint8(frames[j]), (inner, inner), interpolation=cv2.INTER_LINEAR)
+        top = pad + caption
+        canvas[top:top + inner, x:x + inner] = frame[:, :, np.newaxis]
+
+        top += inner + 2 * pad
+        draw_caption(canvas, "Encoding", x, top, inner, caption)
+        top += caption
+        heatmap = cv2.applyColorMap(to_uint8(encoding_grid(encodings[j])), cv2.COLORMAP_VIRIDIS)
+        canvas[top:top + heatmap_height, x:x + inner] = cv2.resize(heatmap, (inner, heatmap_height),
+                                                                   interpolation=cv2.INTER_NEAREST)
+    return canvas
+
+def render_png(tiles, width=DEFAULT_RENDER_WIDTH):
+    """The visualization as PNG bytes."""
+    ok, png = cv2.imencode(".png", render_visualization(tiles, width))
+    if not ok:
+        raise ValueError("Could not encode the visualization")
+    return png.tobytes()
@@ -1,3 +1,15 @@
 MODEL_ROOT_PATH = "../"
 NOTEBOOKS_PATH = MODEL_ROOT_PATH + "notebooks/"
-DATA_PATH = MODEL_ROOT_PATH + "data/"
\ No newline at end of file
+DATA_PATH = MODEL_ROOT_PATH + "data/"
+FER_MODEL_PATH = NOTEBOOKS_PATH + "deeplie/content/fer2013/fer.keras"
+MAIN_MODEL_PATH = NOTEBOOKS_PATH + "deeplie/content/deep-lie/project/gru_model/gru_model_(LOOCV)_64.0 (+- 48.0).keras"
+MEAN_X_PATH = NOTEBOOKS_PATH + "deeplie/content/fer2013/mean_x.npy"
+STD_X_PATH = NOTEBOOKS_PATH + "deeplie/content/fer2013/std_x.npy"
+MU3D_VIDEOS_PATH = DATA_PATH + "MU3D/Videos/"
+MU3D_CODEBOOK_PATH = DATA_PATH + "MU3D/MU3D Codebook.xlsx"
+
+EMOTION_LABELS = ["Angry", "Disgust", "Fear", "Happy", "Sad", "Surprise", "Neutral"]
+
+def subject_of(video_id):
+    """MU3D target ID of a video, e.g. BF001 for BF001_1PT."""
+    return video_id.split("_")[0]
@@ -0,0 +1,58 @@
+"""Scaled-down models and synthetic face videos shared by the tests."""
+import cv2
+import numpy as np
+import tensorflow as tf
+from skimage import data
+
+def create_small_fer_model():
+    """Same input and layer names as fer.json, scaled down."""
+    X_input = tf.keras.layers.Input(shape=(48, 48, 1))
+    X = tf.keras.layers.Conv2D(4, 3, activation="relu")(X_input)
+    X = tf.keras.layers.BatchNormalization()(X)
+    X = tf.keras.layers.MaxPooling2D(4)(X)
+    X = tf.keras.layers.Flatten(name="flatten")(X)
+    X = tf.keras.layers.Dense(7, activation="softmax")(X)
+    return tf.keras.models.Model(inputs=X_input, outputs=X)
+
+def create_small_gru_model(frames, dims):
+    """Same layer layout as create_gru_model in DeepLie.ipynb, scaled down."""
+    X_input = tf.keras.layers.Input(shape=(frames, dims))
+    X = tf.keras.layers.Conv1D(filters=8, kernel_size=5, strides=2)(X_input)
+    X = tf.keras.layers.MaxPooling1D(pool_size=6, strides=3, padding='same')(X)
+    X = tf.keras.layers.BatchNormalization()(X)
+    X = tf.keras.layers.Activation("relu")(X)
+    X = tf.keras.layers.Dropout(rate=0.8)(X)
+    X = tf.keras.layers.GRU(units=4, return_sequences=True)(X)
+    X = tf.keras.layers.BatchNormalization()(X)
+    X = tf.keras.layers.GRU(units=4, return_sequences=False)(X)
+    X = tf.keras.layers.Dense(1, activation="sigmoid")(X)
+    return tf.keras.models.Model(inputs=X_input, outputs=X)
+
+def face_frames(frames, width=320, height=240):
+    """BGR frames of the astronaut's head slowly drifting and rotating over a gray background."""
+    head = cv2.cvtColor(data.astronaut(), cv2.COLOR_RGB2BGR)[0:300, 100:380]
+    size = int(0.7 * height)
+    head = cv2.resize(head, (size * 280 // 300, size), interpolation=cv2.INTER_AREA)
+    h, w = head.shape[:2]
+    for idx in range(frames):
+        matrix = cv2.getRotationMatrix2D((w / 2, h / 2), 6 * np.sin(0.05 * idx), 1.0)
+        matrix[:, 2] += ((width - w) / 2 + 10 * np.sin(0.03 * idx), (height - h) / 2)
+        mask = cv2.warpAffine(np.full((h, w), 255, np.uint8), matrix, (width, height))
+        yield np.where(mask[..., None] > 0, cv2.warpAffine(head, matrix, (width, height)), np.uint8(90))
+
+def write_face_video(path, frames, width=320, height=240):
+    """An MJPG AVI at 30 fps of face_frames."""
+    writer = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*"MJPG"), 30, (width, height))
+    for frame in face_frames(frames, width, height):
+        writer.write(frame)
+    writer.release()
+
+def write_face_webm(path, frames, width=320, height=240):
+    """A VP8 WebM at 30 fps of face_frames, decodable while it arrives like MediaRecorder's uploads."""
+    import av
+    with av.open(path, "w", format="webm", options={"live": "1"}) as container:
+        stream = container.add_stream("libvpx", rate=30)
+        stream.width, stream.height, stream.pix_fmt = width, height, "yuv420p"
+        for frame in face_frames(frames, width, height):
+            container.mux(stream.encode(av.VideoFrame.from_ndarray(frame, format="bgr24")))
+        container.mux(stream.encode())
@@ -0,0 +1,105 @@
+import csv
+import json
+import os
+import sys
+import tempfile
+import unittest
+from unittest import mock
+
+import numpy as np
+import tensorflow as tf
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+sys.path.insert(0, os.path.dirname(__file__))
+
+import BatchInference
+from BatchInference import ResultWriter, crop_video, find_videos, iter_batches, iter_crops, result_row, score_batch
+from InferenceEngine import FERInferenceEngine
+from helpers import create_small_fer_model, create_small_gru_model
+
+# Encoding size of create_small_fer_model: 11x11x4 after its pooling layer
+SMALL_ENCODING_DIM = 484
+
+class TestBatchInference(unittest.TestCase):
+
+    def setUp(self):
+        tf.keras.utils.set_random_seed(0)
+        self.temp_dir = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def test_batched_scores_match_one_video_at_a_time(self):
+        fer_engine = FERInferenceEngine(create_small_fer_model(), batch_size=32)
+        main_model = create_small_gru_model(40, SMALL_ENCODING_DIM)
+        mean_X = np.full((48, 48, 1), 128, dtype=np.float32)
+        std_X = np.full((48, 48, 1), 60, dtype=np.float32)
+        rng = np.random.default_rng(0)
+        crops = [rng.integers(0, 256, (40, 128, 128, 3), dtype=np.uint8) for _ in range(3)]
+
+        (frames_processed, emotion_preds, encodings), scores = score_batch(crops, fer_engine, main_model, mean_X, std_X)
+        self.assertEqual(scores.shape, (3,))
+        for idx, video_crops in enumerate(crops):
+            (_, single_emotions, single_encodings), single_score = score_batch(
+                [video_crops], fer_engine, main_model, mean_X, std_X)
+            self.assertEqual(frames_processed[idx].shape, (40, 48, 48, 1))
+            np.testing.assert_allclose(emotion_preds[idx], single_emotions[0], atol=1e-5)
+            np.testing.assert_allclose(encodings[idx], single_encodings[0], atol=1e-5)
+            np.testing.assert_allclose(scores[idx], single_score[0], atol=1e-5)
+
+    def test_crops_with_the_preprocessing_the_cache_key_records(self):
+        import DeepLie
+        video_path = os.path.join(self.temp_dir.name, "a.mp4")
+        open(video_path, "w").close()
+        preprocessing = dict(DeepLie.PREPROCESSING_PARAMS, keyframe_interval=5, drift_threshold=2.5)
+        crops = np.zeros((preprocessing["num_frames"], 128, 128, 3), dtype=np.uint8)
+        with mock.patch.object(BatchInference, "extract_face_crops", return_value=(0, crops)) as extract:
+            self.assertIs(crop_video(video_path, preprocessing)[1], crops)
+            self.assertEqual(list(iter_crops([video_path], preprocessing, workers=0))[0][2], None)
+        self.assertEqual(extract.call_args.kwargs, {
+            "target_frames": preprocessing["num_frames"], "ssim_threshold": preprocessing["ssim_threshold"],
+            "keyframe_interval": 5, "drift_threshold": 2.5, "decode_oversample": preprocessing["decode_oversample"]})
+        self.assertEqual(set(preprocessing), {"num_frames", "ssim_threshold", "keyframe_interval", "drift_threshold",
+                                              "decode_oversample"})
+
+    def test_find_videos_expands_directories(self):
+        nested = os.path.join(self.temp_dir.name, "nested")
+        os.makedirs(nested)
+        for path in ["b.wmv", "a.MP4", "notes.txt", os.path.join("nested", "c.avi")]:
+            open(os.path.join(self.temp_dir.name, path), "w").close()
+
+        names = lambda paths: [os.path.relpath(path, self.temp_dir.name) for path in paths]
+        self.assertEqual(names(find_videos([self.temp_dir.name])), ["a.MP4", "b.wmv"])
+        self.assertEqual(names(find_videos([self.temp_dir.name], recursive=True)),
+                         ["a.MP4", "b.wmv", os.path.join("nested", "c.avi")])
+
+    def test_iter_batches_keeps_the_remainder(self):
+        self.assertEqual(list(iter_batches(range(5), 2)), [[0, 1], [2, 3], [4]])
+
+    def test_writes_csv_and_jsonl_rows(self):
+        result = {"prediction": [[0.75]], "result": "Deceptive", "confidence": "50.0%",
+                  "emotions": [{"name": "Happy", "value": 60.0}, {"name": "Sad", "value": 40.0}]}
+        rows = [result_row("a.mp4", result), result_row("b.mp4", error="No faces detected in the video.")]
+
+        for extension in (".csv", ".jsonl"):
+            path = os.path.join(self.temp_dir.name, "results" + extension)
+            with ResultWriter(path) as writer:
+                for row in rows:
+                    writer.write(row)
+            with open(path, newline="") as f:
+                written = list(csv.DictReader(f)) if extension == ".csv" else [json.loads(line) for line in f]
+
+            self.assertEqual([row["status"] for row in written], ["done", "failed"])
+            if extension == ".csv":
+                self.assertEqual(float(written[0]["emotion_happy"]), 60.0)
+                self.assertEqual(float(written[0]["score"]), 0.75)
+            else:
+                self.assertEqual(written[0]["emotions"]["Sad"], 40.0)
+                self.assertEqual(written[1]["error"], "No faces detected in the video.")
+
+    def test_rejects_unknown_result_formats(self):
+        with self.assertRaises(ValueError):
+            ResultWriter(os.path.join(self.temp_dir.name, "results.xlsx"))
+
+if __name__ == "__main__":
+    unittest.main()
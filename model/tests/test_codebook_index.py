@@ -0,0 +1,85 @@
+import os
+import sys
+import tempfile
+import unittest
+
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+
+from CodebookIndex import CODEBOOK_SHEETS, Codebook, query_etag
+
+CODEBOOK_PATH = os.path.join(os.path.dirname(__file__), "..", "data", "MU3D", "MU3D Codebook.xlsx")
+
+def write_codebook(path, veracity=(1, 0, 1)):
+    """A codebook with the two data sheets: three videos of two targets."""
+    videos = pd.DataFrame({"VideoID": ["BF001_1PT", "BF001_2NL", "BM002_1PT"], "Valence": [1, 0, 1],
+                           "Veracity": list(veracity), "Accuracy": [0.77, 0.4, float("nan")]})
+    targets = pd.DataFrame({"TargetID": ["BF001", "BM002"], "Age": [18.0, 21.0], "Major": ["Psychology ", "Biology"]})
+    with pd.ExcelWriter(path) as writer:
+        videos.to_excel(writer, sheet_name=CODEBOOK_SHEETS["videos"], index=False)
+        targets.to_excel(writer, sheet_name=CODEBOOK_SHEETS["targets"], index=False)
+
+class TestCodebookIndex(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.temp_dir.name, "codebook.xlsx")
+        write_codebook(self.path)
+        self.codebook = Codebook(self.path)
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def page(self, sheet="videos", columns=None, filters=None, offset=0, limit=50):
+        table = self.codebook.tables()[0][sheet]
+        return table.select_page(**table.normalize_query(columns, filters, offset, limit))
+
+    def test_filters_and_projection(self):
+        page = self.page(columns=["videoid", "SUBJECT"], filters={"veracity": ["1"], "valence": ["1", "0"]})
+        self.assertEqual(page["columns"], ["VideoID", "Subject"])
+        self.assertEqual(page["rows"], [{"VideoID": "BF001_1PT", "Subject": "BF001"},
+                                        {"VideoID": "BM002_1PT", "Subject": "BM002"}])
+        self.assertEqual(self.page(filters={"subject": ["bf001"], "veracity": ["0"]})["total"], 1)
+        self.assertEqual(self.page(filters={"accuracy": ["0.4"]})["rows"][0]["VideoID"], "BF001_2NL")
+        self.assertIsNone(self.page(filters={"videoid": ["BM002_1PT"]})["rows"][0]["Accuracy"])
+
+        # Numbers match by value, text ignoring case and spaces; "subject" is TargetID on the targets sheet
+        self.assertEqual(self.page("targets", filters={"age": ["18"], "major": ["psychology"]})["total"], 1)
+        self.assertEqual(self.page("targets", filters={"subject": ["BM002"]})["rows"][0]["Age"], 21.0)
+        with self.assertRaises(ValueError):
+            self.page(filters={"bogus": ["1"]})
+
+    def test_pagination(self):
+        page = self.page(offset=1, limit=1)
+        self.assertEqual((page["total"], page["offset"], page["limit"]), (3, 1, 1))
+        self.assertEqual([row["VideoID"] for row in page["rows"]], ["BF001_2NL"])
+        self.assertEqual(self.page(offset=5)["rows"], [])
+        self.assertEqual(self.page(limit=100000)["limit"], 500)
+
+    def test_reloads_when_the_file_changes(self):
+        _, version = self.codebook.tables()
+        self.codebook.tables()
+        self.assertEqual(self.codebook.loads, 1)
+        table = self.codebook.tables()[0]["videos"]
+        etag = query_etag(version, "videos", table.normalize_query(filters={"veracity": ["1"]}))
+
+        write_codebook(self.path, veracity=(0, 0, 0))
+        os.utime(self.path, ns=(0, 0))
+        self.assertEqual(self.page(filters={"veracity": ["1"]})["total"], 0)
+        self.assertEqual(self.codebook.loads, 2)
+        self.assertNotEqual(self.codebook.version, version)
+        self.assertNotEqual(query_etag(self.codebook.version, "videos", table.normalize_query(filters={"veracity": ["1"]})),
+                            etag)
+
+    def test_reads_the_mu3d_codebook(self):
+        tables, _ = Codebook(CODEBOOK_PATH).tables()
+        self.assertEqual(len(tables["videos"].rows), 320)
+        self.assertEqual(len(tables["targets"].rows), 80)
+        page = tables["videos"].select_page(**tables["videos"].normalize_query(
+            ["VideoID", "Veracity"], {"subject": ["BF001"]}))
+        self.assertEqual(page["rows"][0], {"VideoID": "BF001_1PT", "Veracity": 1})
+        self.assertEqual(page["total"], 4)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,158 @@
+import os
+import sys
+import tempfile
+import unittest
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+
+from constants import subject_of
+from FeatureStore import FeatureStore, StackedArray, load_codebook
+
+CODEBOOK_PATH = os.path.join(os.path.dirname(__file__), "..", "data", "MU3D", "MU3D Codebook.xlsx")
+
+PARAMS = {"num_frames": 5}
+
+class FakeEncoder:
+    """Encodes a video as arrays filled with its first byte, and remembers which videos it was asked for."""
+
+    def __init__(self):
+        self.encoded = []
+
+    def __call__(self, paths):
+        for path in paths:
+            self.encoded.append(os.path.basename(path))
+            with open(path, "rb") as f:
+                value = f.read(1)[0]
+            if value == 0:
+                yield path, None, None, "No faces detected in the video."
+            else:
+                yield path, np.full((5, 8), value, np.float32), np.full((5, 7), value / 10, np.float32), None
+
+class TestFeatureStore(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.videos_dir = os.path.join(self.temp_dir.name, "videos")
+        self.store_dir = os.path.join(self.temp_dir.name, "store")
+        os.makedirs(self.videos_dir)
+        self.videos = {}
+        for value, video_id in enumerate(["BF001_1PT", "BF001_2NL", "BM002_1PT", "BM002_3NT"], start=1):
+            self.write_video(video_id, value)
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def write_video(self, video_id, value):
+        path = os.path.join(self.videos_dir, video_id + ".wmv")
+        with open(path, "wb") as f:
+            f.write(bytes([value]) * 16)
+        self.videos[video_id] = {"path": path, "label": int(video_id.endswith("T")), "valence": int("P" in video_id)}
+
+    def update(self, params=PARAMS):
+        encoder = FakeEncoder()
+        summary = FeatureStore(self.store_dir).update(self.videos, params, "digest", encoder, log=lambda message: None)
+        return FeatureStore(self.store_dir), encoder.encoded, summary
+
+    def test_subjects_are_memory_mapped(self):
+        store, encoded, _ = self.update()
+        self.assertEqual(len(encoded), 4)
+        self.assertEqual(store.subjects, ["BF001", "BM002"])
+        self.assertEqual(len(store), 4)
+
+        subject = store.subject("BM002")
+        self.assertEqual(subject.video_ids, ["BM002_1PT", "BM002_3NT"])
+        self.assertIsInstance(subject.encodings, np.memmap)
+        self.assertEqual(subject.encodings.shape, (2, 5, 8))
+        np.testing.assert_array_equal(subject.encodings[:, 0, 0], [3, 4])
+        np.testing.assert_allclose(subject.emotions[:, 0, 0], [0.3, 0.4])
+        np.testing.assert_array_equal(subject.labels, [1, 1])
+        np.testing.assert_array_equal(subject.valence, [1, 0])
+
+    def test_leave_one_subject_out(self):
+        store, _, _ = self.update()
+        folds = list(store.leave_one_subject_out())
+        self.assertEqual([subject for subject, _, _ in folds], ["BF001", "BM002"])
+        _, train, test = folds[0]
+        self.assertEqual(train.video_ids, ["BM002_1PT", "BM002_3NT"])
+        self.assertEqual(test.video_ids, ["BF001_1PT", "BF001_2NL"])
+        self.assertEqual(train.subjects, ["BM002", "BM002"])
+        np.testing.assert_array_equal(train.encodings[:, 0, 0], [3, 4])
+        np.testing.assert_array_equal(train.labels, [1, 1])
+        self.assertEqual(store.features().encodings.shape, (4, 5, 8))
+
+    def test_training_side_is_not_copied(self):
+        self.write_video("BM003_1PT", 5)
+        store, _, _ = self.update()
+        _, train, _ = next(store.leave_one_subject_out())
+        self.assertEqual(train.video_ids, ["BM002_1PT", "BM002_3NT", "BM003_1PT"])
+        for features in (train.encodings, train.emotions):
+            self.assertIsInstance(features, StackedArray)
+            self.assertEqual(len(features.parts), 2)
+            for part in features.parts:
+                self.assertIsInstance(part, np.memmap)
+        self.assertTrue(np.shares_memory(train.encodings.parts[0], store.subject("BM002").encodings))
+        self.assertEqual(train.encodings.shape, (3, 5, 8))
+
+        # Batches gather just their rows, across subjects, as from the concatenated arrays
+        expected = store.features(["BM002", "BM003"]).encodings
+        for key in ([2, 0], np.array([1, 2]), slice(1, None), np.array([True, False, True]), -1):
+            np.testing.assert_array_equal(train.encodings[key], expected[key])
+        np.testing.assert_array_equal(np.asarray(train.encodings, dtype=np.float64), expected)
+
+    def test_only_new_and_changed_videos_are_encoded(self):
+        self.update()
+        bf001_chunk = FeatureStore(self.store_dir).index["subjects"]["BF001"]["chunk"]
+
+        _, encoded, summary = self.update()
+        self.assertEqual(encoded, [])
+        self.assertEqual(summary["unchanged"], 4)
+
+        # Same contents with a new modification time are recognised by their digest
+        os.utime(self.videos["BM002_1PT"]["path"], ns=(0, 0))
+        self.assertEqual(self.update()[1], [])
+
+        self.write_video("BM002_3NT", 9)
+        self.write_video("BM002_4PL", 5)
+        store, encoded, summary = self.update()
+        self.assertEqual(encoded, ["BM002_3NT.wmv", "BM002_4PL.wmv"])
+        self.assertEqual(summary["computed"], 2)
+        self.assertEqual(store.index["subjects"]["BF001"]["chunk"], bf001_chunk)
+        np.testing.assert_array_equal(store.subject("BM002").encodings[:, 0, 0], [3, 9, 5])
+
+    def test_removed_videos_and_codebook_changes(self):
+        self.update()
+        del self.videos["BF001_2NL"]
+        self.videos["BF001_1PT"]["label"] = 0
+        store, encoded, summary = self.update()
+        self.assertEqual(encoded, [])
+        self.assertEqual(summary["removed"], 1)
+        self.assertEqual(store.subject("BF001").video_ids, ["BF001_1PT"])
+        np.testing.assert_array_equal(store.subject("BF001").labels, [0])
+        self.assertEqual(len(os.listdir(os.path.join(self.store_dir, "chunks"))), 4)
+
+    def test_failed_videos_are_not_retried(self):
+        self.write_video("BF001_2NL", 0)
+        store, _, summary = self.update()
+        self.assertEqual(summary["failed"], 1)
+        self.assertEqual(store.failed, {"BF001_2NL": "No faces detected in the video."})
+        self.assertEqual(store.subject("BF001").video_ids, ["BF001_1PT"])
+        self.assertEqual(self.update()[1], [])
+
+    def test_new_parameters_recompute_everything(self):
+        self.update()
+        store, encoded, _ = self.update({"num_frames": 6})
+        self.assertEqual(len(encoded), 4)
+        self.assertEqual(len(os.listdir(os.path.join(self.store_dir, "chunks"))), 4)
+        self.assertEqual(store.index["params"], {"num_frames": 6})
+
+    def test_reads_the_mu3d_codebook(self):
+        codebook = load_codebook(CODEBOOK_PATH)
+        self.assertEqual(len(codebook), 320)
+        self.assertEqual(codebook["BF001_1PT"], {"label": 1, "valence": 1})
+        self.assertEqual(codebook["BF001_2NL"], {"label": 0, "valence": 0})
+        self.assertEqual(subject_of("BF001_2NL"), "BF001")
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,43 @@
+import os
+import sys
+import unittest
+
+import cv2
+import numpy as np
+from skimage.metrics import structural_similarity as ssim
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+
+from FrameDeduplication import FrameDeduplicator, SSIMReference
+
+class TestFrameDeduplication(unittest.TestCase):
+
+    def setUp(self):
+        rng = np.random.default_rng(0)
+        self.base = cv2.GaussianBlur(rng.integers(0, 256, (128, 128, 3), dtype=np.uint8), (9, 9), 0)
+        self.noisy = np.clip(self.base + rng.normal(0, 4, self.base.shape), 0, 255).astype(np.uint8)
+
+    def test_ssim_matches_skimage(self):
+        gray_a = cv2.cvtColor(self.base, cv2.COLOR_BGR2GRAY)
+        gray_b = cv2.cvtColor(self.noisy, cv2.COLOR_BGR2GRAY)
+        expected = ssim(gray_a, gray_b)
+        self.assertAlmostEqual(SSIMReference(gray_a).ssim(SSIMReference(gray_b)), expected, places=10)
+
+    def test_keeps_same_frames_as_threshold_rule(self):
+        deduplicator = FrameDeduplicator(ssim_threshold=0.9)
+        self.assertTrue(deduplicator.accept(self.base))
+        self.assertFalse(deduplicator.accept(self.base.copy()))
+        self.assertEqual(deduplicator.prefiltered, 1)
+
+        gray_a = cv2.cvtColor(self.base, cv2.COLOR_BGR2GRAY)
+        gray_b = cv2.cvtColor(self.noisy, cv2.COLOR_BGR2GRAY)
+        self.assertEqual(deduplicator.accept(self.noisy), ssim(gray_a, gray_b) < 0.9)
+
+    def test_reset_forgets_reference(self):
+        deduplicator = FrameDeduplicator()
+        self.assertTrue(deduplicator.accept(self.base))
+        deduplicator.reset()
+        self.assertTrue(deduplicator.accept(self.base))
+
+if __name__ == "__main__":
+    unittest.main()
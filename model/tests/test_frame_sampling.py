@@ -0,0 +1,41 @@
+import os
+import sys
+import unittest
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+
+from FrameSampling import FrameSampler, decode_stride
+
+class TestFrameSampler(unittest.TestCase):
+
+    def offer(self, sampler, count):
+        for idx in range(count):
+            sampler.add(np.full((1,), idx, dtype=np.int64))
+        return sampler.frames()[:, 0]
+
+    def test_short_stream_keeps_every_frame(self):
+        sampler = FrameSampler(target_frames=10, frame_shape=(1,), dtype=np.int64)
+        stored = self.offer(sampler, 15)
+        np.testing.assert_array_equal(stored, np.arange(15))
+
+    def test_long_stream_stays_bounded_and_uniform(self):
+        sampler = FrameSampler(target_frames=10, frame_shape=(1,), dtype=np.int64)
+        stored = self.offer(sampler, 10000)
+
+        self.assertLessEqual(len(stored), 20)
+        self.assertGreaterEqual(len(stored), 10)
+        self.assertEqual(sampler.buffer.shape[0], 20)
+        gaps = np.diff(stored)
+        self.assertTrue((gaps == sampler.stride).all())
+        self.assertEqual(stored[0], 0)
+        self.assertGreater(stored[-1], 10000 - 2 * sampler.stride)
+
+    def test_decode_stride(self):
+        self.assertEqual(decode_stride(0, 1200), 1)
+        self.assertEqual(decode_stride(300, 1200), 1)
+        self.assertEqual(decode_stride(108000, 1200), 90)
+
+if __name__ == "__main__":
+    unittest.main()
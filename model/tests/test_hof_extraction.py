@@ -0,0 +1,92 @@
+import os
+import sys
+import tempfile
+import unittest
+
+import cv2
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+
+from HOFExtraction import (HOFExtractor, extract_hof_features, frame_folder_hof_features, iter_hof_features,
+                           spatial_histograms)
+
+def reference_spatial_histograms(flow, num_mag_bins=30, num_angle_bins=36, grid_size=(4, 4)):
+    """compute_spatial_histograms from notebooks/cnn/preprocess/HOF_100.ipynb."""
+    h, w, _ = flow.shape
+    grid_h, grid_w = h // grid_size[0], w // grid_size[1]
+    hof_features = []
+    for i in range(grid_size[0]):
+        for j in range(grid_size[1]):
+            region = flow[i * grid_h: (i + 1) * grid_h, j * grid_w: (j + 1) * grid_w]
+            magnitude, angle = cv2.cartToPolar(region[..., 0], region[..., 1])
+            angle = np.degrees(angle) % 360
+            mag_hist, _ = np.histogram(magnitude, bins=num_mag_bins, range=(0, np.max(magnitude)))
+            angle_hist, _ = np.histogram(angle, bins=num_angle_bins, range=(0, 360))
+            mag_hist = mag_hist.astype(np.float32) / np.sum(mag_hist) if np.sum(mag_hist) > 0 else mag_hist
+            angle_hist = angle_hist.astype(np.float32) / np.sum(angle_hist) if np.sum(angle_hist) > 0 else angle_hist
+            hof_features.extend(mag_hist)
+            hof_features.extend(angle_hist)
+    return np.array(hof_features)
+
+def reference_optical_flow(prev_frame, next_frame):
+    return cv2.calcOpticalFlowFarneback(cv2.cvtColor(prev_frame, cv2.COLOR_BGR2GRAY),
+                                        cv2.cvtColor(next_frame, cv2.COLOR_BGR2GRAY), None, 0.5, 3, 15, 3, 5, 1.2, 0)
+
+def moving_face_frames(count=6):
+    """Frames of a blurred ellipse drifting right, so consecutive pairs have real flow."""
+    frames = []
+    for idx in range(count):
+        frame = np.full((128, 128, 3), 40, dtype=np.uint8)
+        cv2.ellipse(frame, (50 + 3 * idx, 64), (30, 40), 0, 0, 360, (170, 180, 200), -1)
+        cv2.circle(frame, (40 + 3 * idx, 55), 5, (20, 20, 20), -1)
+        frames.append(cv2.GaussianBlur(frame, (7, 7), 0))
+    return frames
+
+class TestHOFExtraction(unittest.TestCase):
+
+    def test_histograms_equal_the_notebook(self):
+        rng = np.random.default_rng(0)
+        for idx, shape in enumerate([(128, 128), (128, 128), (97, 130), (64, 64)]):
+            flow = rng.normal(0, [0.05, 2, 10, 1][idx], shape + (2,)).astype(np.float32)
+            if idx == 1:
+                flow = np.round(flow)  # Values on bin edges
+            if idx == 3:
+                flow[:32] = 0  # Cells without motion
+            expected = reference_spatial_histograms(flow)
+            features = spatial_histograms(flow)
+            self.assertEqual(features.dtype, np.float32)
+            np.testing.assert_array_equal(features, expected)
+
+    def test_other_bin_counts_and_grids(self):
+        flow = np.random.default_rng(1).normal(0, 1, (60, 90, 2)).astype(np.float32)
+        np.testing.assert_array_equal(spatial_histograms(flow, 10, 8, (3, 5)),
+                                      reference_spatial_histograms(flow, 10, 8, (3, 5)))
+
+    def test_features_of_frames_equal_the_notebook(self):
+        frames = moving_face_frames()
+        expected = np.array([reference_spatial_histograms(reference_optical_flow(frames[idx], frames[idx + 1]))
+                             for idx in range(len(frames) - 1)])
+        features = extract_hof_features(frames)
+        self.assertEqual(features.shape, (5, 16 * (30 + 36)))
+        np.testing.assert_array_equal(features, expected)
+        np.testing.assert_array_equal(np.array(list(iter_hof_features(iter(frames)))), expected)
+
+    def test_extractor_starts_over_after_reset(self):
+        frames = moving_face_frames(2)
+        extractor = HOFExtractor()
+        self.assertIsNone(extractor.push(frames[0]))
+        self.assertEqual(extractor.push(frames[1]).shape, (extractor.feature_size,))
+        extractor.reset()
+        self.assertIsNone(extractor.push(frames[1]))
+        self.assertEqual(len(extract_hof_features(frames[:1])), 0)
+
+    def test_reads_frame_folders_in_order(self):
+        frames = moving_face_frames(4)
+        with tempfile.TemporaryDirectory() as folder:
+            for idx, frame in enumerate(frames):
+                cv2.imwrite(os.path.join(folder, f"frame_{idx:04d}.png"), frame)
+            np.testing.assert_array_equal(frame_folder_hof_features(folder), extract_hof_features(frames))
+
+if __name__ == "__main__":
+    unittest.main()
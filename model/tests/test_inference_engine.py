@@ -0,0 +1,47 @@
+import os
+import sys
+import unittest
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+sys.path.insert(0, os.path.dirname(__file__))
+
+from InferenceEngine import FERInferenceEngine, fer_multi_output_model
+from helpers import create_small_fer_model
+
+class TestFERInferenceEngine(unittest.TestCase):
+
+    def setUp(self):
+        self.fer_model = create_small_fer_model()
+        rng = np.random.default_rng(0)
+        self.frames = rng.normal(size=(70, 48, 48, 1)).astype(np.float32)
+
+    def test_matches_the_multi_output_model_across_batches(self):
+        expected_emotions, expected_encodings = fer_multi_output_model(self.fer_model).predict(self.frames, verbose=0)
+
+        # Two full batches of 32 and a partial one of 6
+        fractions = []
+        engine = FERInferenceEngine(self.fer_model, batch_size=32)
+        emotions, encodings = engine.run(self.frames, progress_callback=fractions.append)
+
+        self.assertEqual((emotions.dtype, encodings.dtype), (np.float32, np.float32))
+        self.assertEqual(emotions.shape, (70, 7))
+        self.assertEqual(encodings.shape, expected_encodings.shape)
+        np.testing.assert_allclose(emotions, expected_emotions, rtol=1e-5, atol=1e-6)
+        np.testing.assert_allclose(encodings, expected_encodings, rtol=1e-5, atol=1e-6)
+        self.assertEqual(fractions, [32 / 70, 64 / 70, 1.0])
+
+    def test_batch_size_does_not_change_the_outputs(self):
+        emotions, encodings = FERInferenceEngine(self.fer_model, batch_size=300).run(self.frames)
+        small_emotions, small_encodings = FERInferenceEngine(self.fer_model, batch_size=7).run(self.frames)
+        np.testing.assert_allclose(small_emotions, emotions, rtol=1e-5, atol=1e-6)
+        np.testing.assert_allclose(small_encodings, encodings, rtol=1e-5, atol=1e-6)
+
+    def test_no_frames(self):
+        emotions, encodings = FERInferenceEngine(self.fer_model).run(self.frames[:0])
+        self.assertEqual(emotions.shape, (0, 7))
+        self.assertEqual(len(encodings), 0)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,78 @@
+import os
+import sys
+import threading
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+
+from JobQueue import JobCancelledError, JobQueue, QueueFullError, JOB_CANCELLED, JOB_DONE, JOB_FAILED
+
+class TestJobQueue(unittest.TestCase):
+
+    def test_jobs_keep_separate_progress(self):
+        queue = JobQueue(max_workers=2)
+
+        def work(job, value):
+            job.update("working", value)
+            return value * 2
+
+        first = queue.submit(work, 10)
+        second = queue.submit(work, 20)
+        self.assertTrue(first.wait(5) and second.wait(5))
+
+        self.assertEqual(first.status, JOB_DONE)
+        self.assertEqual(first.result, 20)
+        self.assertEqual(second.result, 40)
+        self.assertIsNot(queue.get(first.job_id), queue.get(second.job_id))
+
+    def test_failed_job_reports_error_and_runs_cleanup(self):
+        queue = JobQueue(max_workers=1)
+        cleaned = threading.Event()
+
+        def fail(job):
+            raise ValueError("No faces detected in the video.")
+
+        job = queue.submit(fail, cleanup=cleaned.set)
+        self.assertTrue(job.wait(5))
+
+        self.assertEqual(job.status, JOB_FAILED)
+        self.assertEqual(job.error, "No faces detected in the video.")
+        self.assertTrue(cleaned.is_set())
+
+    def test_cancelled_job_is_not_failed(self):
+        queue = JobQueue(max_workers=1)
+        cleaned = threading.Event()
+
+        def cancel(job):
+            raise JobCancelledError("Answered from the result cache.")
+
+        job = queue.submit(cancel, cleanup=cleaned.set)
+        self.assertTrue(job.wait(5))
+
+        self.assertEqual(job.status, JOB_CANCELLED)
+        self.assertEqual(job.error, "Answered from the result cache.")
+        self.assertEqual((queue.count(JOB_FAILED), queue.count(JOB_CANCELLED)), (0, 1))
+        self.assertTrue(cleaned.is_set())
+
+    def test_queue_is_bounded(self):
+        queue = JobQueue(max_workers=1, max_pending=1)
+        release = threading.Event()
+
+        blocked = queue.submit(lambda job: release.wait(5))
+        with self.assertRaises(QueueFullError):
+            queue.submit(lambda job: None)
+
+        release.set()
+        self.assertTrue(blocked.wait(5))
+
+    def test_completed_job_is_immediately_done(self):
+        queue = JobQueue(max_workers=1)
+        job = queue.complete({"result": "Truthful"})
+
+        self.assertTrue(job.wait(0))
+        self.assertIs(queue.get(job.job_id), job)
+        self.assertEqual(job.to_dict()["progress"], 100)
+        self.assertEqual(job.result, {"result": "Truthful"})
+
+if __name__ == "__main__":
+    unittest.main()
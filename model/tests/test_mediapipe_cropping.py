@@ -0,0 +1,146 @@
+import importlib.util
+import os
+import sys
+import unittest
+
+import cv2
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+sys.path.insert(0, os.path.dirname(__file__))
+
+from MediaPipeCropping import (CROP_SIZE, DEFAULT_KEYFRAME_INTERVAL, FaceTracker,
+                               calculate_face_bounding_box, compute_rotation_matrix, crop_face_from_landmarks,
+                               initialize_face_mesh, landmarks_to_array, track_landmarks, transform_landmarks)
+from helpers import face_frames
+
+def textured_frames(count, shift=(1.0, 0.5), size=(320, 240), seed=0):
+    """BGR frames of a smooth random texture translated by shift pixels per frame."""
+    rng = np.random.default_rng(seed)
+    texture = cv2.GaussianBlur(rng.integers(0, 256, (size[1], size[0]), dtype=np.uint8), (0, 0), 2)
+    texture = cv2.normalize(texture, None, 0, 255, cv2.NORM_MINMAX)
+    frames = []
+    for idx in range(count):
+        matrix = np.float32([[1, 0, shift[0] * idx], [0, 1, shift[1] * idx]])
+        frame = cv2.warpAffine(texture, matrix, size, flags=cv2.INTER_LINEAR, borderMode=cv2.BORDER_REFLECT)
+        frames.append(cv2.cvtColor(frame, cv2.COLOR_GRAY2BGR))
+    return frames
+
+def face_landmarks(seed=0):
+    """Stand-in (478, 2) landmarks spread over the middle of a 320x240 frame."""
+    rng = np.random.default_rng(seed)
+    return np.stack([rng.uniform(100, 220, 478), rng.uniform(70, 170, 478)], axis=1)
+
+class FakeFaceMesh:
+    """Face Mesh stand-in finding the face at the true landmarks of whichever frame it is given."""
+
+    def __init__(self, frames, landmarks):
+        from mediapipe.framework.formats import landmark_pb2
+        height, width = frames[0].shape[:2]
+        self.frames = [cv2.cvtColor(frame, cv2.COLOR_BGR2RGB) for frame in frames]
+        self.results = [type("Results", (), {"multi_face_landmarks": [landmark_pb2.NormalizedLandmarkList(
+            landmark=[landmark_pb2.NormalizedLandmark(x=x / width, y=y / height, z=0.0) for x, y in frame_landmarks])]})
+            for frame_landmarks in landmarks]
+        self.calls = []
+
+    def process(self, rgb_frame):
+        idx = next(idx for idx, frame in enumerate(self.frames) if np.array_equal(frame, rgb_frame))
+        self.calls.append(idx)
+        return self.results[idx]
+
+def two_step_crop(frame, landmarks):
+    """crop_face_from_landmarks as it was before the single warp: rotate the frame, slice the box, resize."""
+    img_h, img_w = frame.shape[:2]
+    pixel_landmarks = landmarks.astype(int)
+    rotation_matrix = compute_rotation_matrix(pixel_landmarks[33], pixel_landmarks[263], img_w, img_h)
+    aligned_frame = cv2.warpAffine(frame, rotation_matrix, (img_w, img_h))
+    transformed_landmarks = transform_landmarks(pixel_landmarks, rotation_matrix)
+    x_min, y_min, x_max, y_max = calculate_face_bounding_box(transformed_landmarks, pixel_landmarks[10][1],
+                                                             pixel_landmarks[152][1], img_w, img_h)
+    return cv2.resize(aligned_frame[y_min:y_max, x_min:x_max], (CROP_SIZE, CROP_SIZE))
+
+@unittest.skipUnless(importlib.util.find_spec("mediapipe"), "MediaPipe is not installed")
+class TestCropParity(unittest.TestCase):
+    """The single-warp crop against the code it replaced."""
+
+    @classmethod
+    def setUpClass(cls):
+        face_mesh = initialize_face_mesh()
+        cls.frames, cls.face_landmarks = [], []
+        try:
+            for frame in list(face_frames(60, 640, 480))[::6]:
+                results = face_mesh.process(cv2.cvtColor(frame, cv2.COLOR_BGR2RGB))
+                cls.frames.append(frame)
+                cls.face_landmarks.append(results.multi_face_landmarks[0])
+        finally:
+            face_mesh.close()
+
+    def test_single_warp_matches_the_two_step_crop(self):
+        for frame, face_landmarks in zip(self.frames, self.face_landmarks):
+            landmarks = landmarks_to_array(face_landmarks, 640, 480)
+            crop = crop_face_from_landmarks(frame, landmarks)
+            expected = two_step_crop(frame, landmarks)
+            self.assertEqual(crop.shape, expected.shape)
+            # One interpolation instead of two: within a gray level on average, a few at the face's edges
+            diff = np.abs(crop.astype(np.int16) - expected.astype(np.int16))
+            self.assertLess(diff.mean(), 1.0)
+            self.assertLessEqual(np.percentile(diff, 99), 8)
+
+class TestTrackLandmarks(unittest.TestCase):
+
+    def test_follows_motion_without_drifting(self):
+        frames = textured_frames(10)
+        landmarks = start = face_landmarks()
+        for prev_frame, frame in zip(frames, frames[1:]):
+            landmarks = track_landmarks(cv2.cvtColor(prev_frame, cv2.COLOR_BGR2GRAY),
+                                        cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY), landmarks)
+            self.assertIsNotNone(landmarks)
+        # Nine frames of (1, 0.5) px motion, with errors not accumulating beyond a fraction of a pixel
+        error = np.linalg.norm(landmarks - (start + [9.0, 4.5]), axis=1)
+        self.assertLess(error.max(), 0.3)
+
+    def test_rejects_unrelated_frames(self):
+        prev_gray = cv2.cvtColor(textured_frames(1, seed=1)[0], cv2.COLOR_BGR2GRAY)
+        gray = cv2.cvtColor(textured_frames(1, seed=2)[0], cv2.COLOR_BGR2GRAY)
+        self.assertIsNone(track_landmarks(prev_gray, gray, face_landmarks()))
+
+    def test_forward_backward_error_above_threshold_is_rejected(self):
+        frames = [cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY) for frame in textured_frames(2, shift=(1.3, 0.7))]
+        self.assertIsNotNone(track_landmarks(frames[0], frames[1], face_landmarks()))
+        self.assertIsNone(track_landmarks(frames[0], frames[1], face_landmarks(), drift_threshold=0.0))
+
+@unittest.skipUnless(importlib.util.find_spec("mediapipe"), "MediaPipe is not installed")
+class TestFaceTracker(unittest.TestCase):
+
+    def setUp(self):
+        self.frames = textured_frames(12)
+        self.landmarks = [face_landmarks() + [1.0 * idx, 0.5 * idx] for idx in range(12)]
+
+    def test_face_mesh_runs_on_every_frame_by_default(self):
+        self.assertEqual(DEFAULT_KEYFRAME_INTERVAL, 1)
+        face_mesh = FakeFaceMesh(self.frames, self.landmarks)
+        tracker = FaceTracker(face_mesh)
+        for frame, expected in zip(self.frames, self.landmarks):
+            np.testing.assert_allclose(tracker.update(frame), expected, atol=1e-3)
+        self.assertEqual(face_mesh.calls, list(range(12)))
+        self.assertEqual(tracker.tracked, 0)
+
+    def test_keyframe_schedule(self):
+        face_mesh = FakeFaceMesh(self.frames, self.landmarks)
+        tracker = FaceTracker(face_mesh, keyframe_interval=5)
+        for frame, expected in zip(self.frames, self.landmarks):
+            np.testing.assert_allclose(tracker.update(frame), expected, atol=0.3)
+        self.assertEqual(face_mesh.calls, [0, 5, 10])
+        self.assertEqual((tracker.detections, tracker.tracked), (3, 9))
+
+    def test_lost_tracking_forces_a_detection(self):
+        # Frame 3 cuts to another scene: tracking into it fails and the schedule restarts there
+        self.frames[3] = textured_frames(1, seed=5)[0]
+        face_mesh = FakeFaceMesh(self.frames, self.landmarks)
+        tracker = FaceTracker(face_mesh, keyframe_interval=5)
+        for frame in self.frames:
+            tracker.update(frame)
+        self.assertEqual(face_mesh.calls, [0, 3, 4, 9])
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,93 @@
+import os
+import sys
+import threading
+import time
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+
+import Metrics
+from Metrics import MetricsRegistry, SamplingProfiler, Timings, count, merge, record, stage
+
+class TestMetrics(unittest.TestCase):
+
+    def setUp(self):
+        # Record into a fresh registry rather than the process-wide one
+        self.registry = MetricsRegistry(buckets=(0.1, 1))
+        self.original_registry, Metrics.metrics = Metrics.metrics, self.registry
+
+    def tearDown(self):
+        Metrics.metrics = self.original_registry
+
+    def test_stages_and_counters_go_to_the_current_analysis(self):
+        with record() as timings:
+            with stage("decode"):
+                time.sleep(0.01)
+            count("frames_decoded", 3)
+            merge({"stages": {"face_mesh": 0.5}, "counters": {"frames_decoded": 2}})
+        count("frames_decoded")  # Outside record(): only the process-wide counter
+
+        self.assertGreaterEqual(timings.stages["decode"], 0.01)
+        self.assertEqual(timings.stages["face_mesh"], 0.5)
+        self.assertEqual(timings.counters["frames_decoded"], 5)
+        self.assertEqual(self.registry.frames["frames_decoded"], 6)
+        self.assertEqual(set(timings.to_dict()["stages_ms"]), {"decode", "face_mesh"})
+
+    def test_recordings_in_other_threads_are_separate(self):
+        results = {}
+
+        def analyse(name, frames):
+            with record() as timings:
+                count("frames_decoded", frames)
+            results[name] = timings.counters["frames_decoded"]
+
+        threads = [threading.Thread(target=analyse, args=(name, frames)) for name, frames in (("a", 1), ("b", 2))]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(results, {"a": 1, "b": 2})
+
+    def test_renders_prometheus_text(self):
+        timings = Timings()
+        timings.add("fer", 0.5)
+        self.registry.add_stage_time("fer", 0.5)
+        self.registry.add_frames("frames_kept", 4)
+        self.registry.observe_analysis("done", timings)
+        self.registry.observe_analysis("cached")
+        self.registry.add_gauge("models_ready", "Ready.", lambda: True)
+        self.registry.add_gauge("omitted", "Not available.", lambda: None)
+
+        lines = self.registry.render().splitlines()
+        self.assertIn('deeplie_stage_seconds_total{stage="fer"} 0.500000', lines)
+        self.assertIn('deeplie_frames_total{kind="frames_kept"} 4', lines)
+        self.assertIn('deeplie_analyses_total{status="cached"} 1', lines)
+        self.assertIn('deeplie_analysis_stage_seconds_bucket{stage="fer",le="0.1"} 0', lines)
+        self.assertIn('deeplie_analysis_stage_seconds_bucket{stage="fer",le="1"} 1', lines)
+        self.assertIn('deeplie_analysis_stage_seconds_bucket{stage="fer",le="+Inf"} 1', lines)
+        self.assertIn("deeplie_models_ready 1.0", lines)
+        self.assertFalse(any("omitted" in line for line in lines))
+
+    def test_profiler_samples_running_threads(self):
+        stop = threading.Event()
+
+        def busy_loop():
+            while not stop.is_set():
+                sum(range(1000))
+
+        worker = threading.Thread(target=busy_loop, name="busy-worker")
+        worker.start()
+        profiler = SamplingProfiler()
+        profiler.start(interval=0.002)
+        time.sleep(0.1)
+        profiler.stop()
+        stop.set()
+        worker.join()
+
+        self.assertFalse(profiler.running)
+        self.assertGreater(profiler.status()["samples"], 0)
+        stacks = profiler.collapsed().splitlines()
+        self.assertTrue(any(line.startswith("busy-worker;") and "busy_loop" in line for line in stacks))
+
+if __name__ == "__main__":
+    unittest.main()
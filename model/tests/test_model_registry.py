@@ -0,0 +1,59 @@
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+
+from ModelRegistry import ModelRegistry
+
+class TestModelRegistry(unittest.TestCase):
+
+    def test_components_load_once_on_first_use(self):
+        registry = ModelRegistry()
+        calls = []
+        registry.register("model", lambda r: calls.append("model") or "weights")
+        registry.register("engine", lambda r: ("engine", r.get("model")))
+
+        self.assertFalse(registry.is_loaded("model"))
+        self.assertEqual(registry.get("engine"), ("engine", "weights"))
+        self.assertEqual(registry.get("engine"), ("engine", "weights"))
+        self.assertEqual(calls, ["model"])
+        self.assertFalse(registry.ready)
+
+    def test_background_loading_warms_up_then_reports_ready(self):
+        registry = ModelRegistry()
+        warmed = []
+        registry.register("model", lambda r: "weights")
+        registry.add_warmup(lambda r: warmed.append(r.get("model")))
+
+        registry.start_background_loading().join(5)
+        status = registry.status()
+        self.assertTrue(status["ready"])
+        self.assertEqual(warmed, ["weights"])
+        self.assertTrue(status["components"]["model"]["loaded"])
+        self.assertIsNotNone(status["time_to_ready_seconds"])
+        self.assertGreater(status["peak_rss_mb"], 0)
+
+    def test_background_loading_starts_once_per_process(self):
+        registry = ModelRegistry()
+        calls = []
+        registry.register("model", lambda r: calls.append("model") or "weights")
+        thread = registry.start_background_loading()
+        self.assertIs(registry.start_background_loading(), thread)
+        thread.join(5)
+        self.assertIs(registry.start_background_loading(), thread)
+        self.assertEqual(calls, ["model"])
+
+    def test_failed_load_is_reported(self):
+        registry = ModelRegistry()
+
+        def broken(r):
+            raise FileNotFoundError("missing.keras")
+
+        registry.register("model", broken)
+        registry.start_background_loading().join(5)
+        self.assertFalse(registry.ready)
+        self.assertIn("missing.keras", registry.status()["error"])
+
+if __name__ == "__main__":
+    unittest.main()
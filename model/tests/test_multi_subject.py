@@ -0,0 +1,113 @@
+import importlib.util
+import os
+import sys
+import tempfile
+import unittest
+from unittest import mock
+
+import cv2
+import numpy as np
+from skimage import data
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+
+import MultiSubject
+from MultiSubject import (MultiFaceTracker, extract_subject_crops, iter_subject_crops, landmark_box, match_boxes,
+                          select_subjects)
+
+def face_at(x, y, size=100):
+    """Stand-in (478, 2) landmarks filling a size x size box at (x, y)."""
+    grid = np.linspace(0, size, 478)
+    return np.stack([x + grid, y + grid[::-1]], axis=1)
+
+def write_two_person_video(path, frames=45, width=640, height=400):
+    """An MJPG AVI of the astronaut twice side by side, each copy drifting on its own."""
+    head = cv2.cvtColor(data.astronaut(), cv2.COLOR_RGB2BGR)[0:300, 100:380]
+    head = cv2.resize(head, (int(0.6 * height) * 280 // 300, int(0.6 * height)), interpolation=cv2.INTER_AREA)
+    h, w = head.shape[:2]
+    half = width // 2
+    writer = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*"MJPG"), 30, (width, height))
+    for idx in range(frames):
+        frame = np.full((height, width, 3), 90, dtype=np.uint8)
+        for side, phase in enumerate((0.0, 1.5)):
+            matrix = cv2.getRotationMatrix2D((w / 2, h / 2), 8 * np.sin(0.3 * idx + phase), 1.0)
+            matrix[:, 2] += (side * half + (half - w) / 2 + 12 * np.sin(0.2 * idx + phase), (height - h) / 2)
+            mask = cv2.warpAffine(np.full((h, w), 255, np.uint8), matrix, (width, height))
+            frame = np.where(mask[..., None] > 0, cv2.warpAffine(head, matrix, (width, height)), frame)
+        writer.write(frame)
+    writer.release()
+
+class TestMultiSubject(unittest.TestCase):
+
+    def test_boxes_are_matched_by_greatest_overlap(self):
+        known = [np.array([0, 0, 100, 100]), np.array([200, 0, 300, 100])]
+        boxes = [np.array([210, 5, 310, 105]), np.array([500, 0, 600, 100]), np.array([5, 0, 105, 100])]
+        self.assertEqual(match_boxes(known, boxes), {0: 1, 2: 0})
+        # One detection between two subjects only matches the closer one
+        self.assertEqual(match_boxes(known, [np.array([40, 0, 140, 100]), np.array([30, 0, 130, 100])]), {1: 0})
+        np.testing.assert_array_equal(landmark_box(face_at(10, 20)), [10, 20, 110, 120])
+
+    def test_subjects_keep_their_ids(self):
+        tracker = MultiFaceTracker(face_mesh=None, max_tracked=3)
+        faces = tracker.assign([face_at(0, 0), face_at(300, 0)])
+        self.assertEqual(sorted(faces), [0, 1])
+        tracker.boxes = [landmark_box(faces[0]), landmark_box(faces[1])]
+
+        # Detection order does not matter, moved faces are followed, and a new face gets a new id
+        faces = tracker.assign([face_at(310, 5), face_at(600, 0), face_at(-10, 0)])
+        np.testing.assert_array_equal(faces[1], face_at(310, 5))
+        np.testing.assert_array_equal(faces[0], face_at(-10, 0))
+        np.testing.assert_array_equal(faces[2], face_at(600, 0))
+
+        # A subject missing from a keyframe is matched again when it comes back
+        self.assertEqual(sorted(tracker.assign([face_at(0, 0)])), [0])
+        self.assertEqual(sorted(tracker.assign([face_at(300, 0), face_at(0, 0)])), [0, 1])
+
+        # Beyond max_tracked subjects new faces are ignored
+        self.assertEqual(sorted(tracker.assign([face_at(0, 250)])), [])
+
+    def test_select_subjects(self):
+        self.assertEqual(select_subjects({0: 40, 1: 3, 2: 25, 3: 30}, max_subjects=2, min_subject_crops=10), [0, 3])
+        self.assertEqual(select_subjects({0: 40, 1: 3, 2: 25}, max_subjects=4, min_subject_crops=10), [0, 2])
+        self.assertEqual(select_subjects({0: 2, 1: 4}, max_subjects=4, min_subject_crops=10), [1])
+        self.assertEqual(select_subjects({}), [])
+
+    @unittest.skipUnless(importlib.util.find_spec("mediapipe"), "MediaPipe is not installed")
+    def test_crops_every_subject_in_one_decode(self):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            video_path = os.path.join(temp_dir, "panel.avi")
+            write_two_person_video(video_path)
+            frame_count, subjects = extract_subject_crops(video_path, target_frames=20, ssim_threshold=0.95,
+                                                          min_subject_crops=5)
+
+        self.assertEqual(frame_count, 45)
+        self.assertEqual(sorted(subjects), [0, 1])
+        for crops in subjects.values():
+            self.assertEqual(crops.shape, (20, 128, 128, 3))
+            self.assertEqual(crops.dtype, np.uint8)
+        self.assertGreater(np.abs(subjects[0].astype(int) - subjects[1].astype(int)).mean(), 1)
+
+    @unittest.skipUnless(importlib.util.find_spec("mediapipe"), "MediaPipe is not installed")
+    def test_stopping_early_releases_the_video_and_face_mesh(self):
+        closed = []
+        create_face_mesh = MultiSubject.initialize_face_mesh
+
+        def initialize_face_mesh(max_num_faces):
+            face_mesh = create_face_mesh(max_num_faces)
+            close = face_mesh.close
+            face_mesh.close = lambda: (closed.append(True), close())
+            return face_mesh
+
+        with tempfile.TemporaryDirectory() as temp_dir:
+            video_path = os.path.join(temp_dir, "panel.avi")
+            write_two_person_video(video_path)
+            capture = cv2.VideoCapture(video_path)
+            with mock.patch.object(MultiSubject, "initialize_face_mesh", side_effect=initialize_face_mesh):
+                crops = iter_subject_crops(capture, max_subjects=2)
+                next(crops)
+                crops.close()
+            self.assertFalse(capture.isOpened())
+            self.assertEqual(closed, [True])
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,79 @@
+import importlib.util
+import os
+import sys
+import tempfile
+import unittest
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+sys.path.insert(0, os.path.dirname(__file__))
+
+from helpers import write_face_video
+from MediaPipeCropping import extract_face_crops
+from Metrics import record
+from ParallelCropping import (MIN_SEGMENT_FRAMES, crop_segment, extract_face_crops_parallel, seeks_exactly,
+                              segment_boundaries)
+
+class TestSegmentBoundaries(unittest.TestCase):
+
+    def test_segments_cover_video_in_order(self):
+        boundaries = segment_boundaries(3000, 4)
+        self.assertEqual(boundaries, [(0, 750), (750, 1500), (1500, 2250), (2250, None)])
+
+    def test_starts_align_with_decode_stride(self):
+        boundaries = segment_boundaries(10000, 3, stride=7)
+        self.assertEqual(boundaries[0][0], 0)
+        for start, end in boundaries:
+            self.assertEqual(start % 7, 0)
+        for (_, end), (start, _) in zip(boundaries, boundaries[1:]):
+            self.assertEqual(end, start)
+
+    def test_short_video_is_not_split(self):
+        self.assertEqual(segment_boundaries(MIN_SEGMENT_FRAMES * 2 - 1, 8), [(0, None)])
+        self.assertEqual(segment_boundaries(0, 4), [(0, None)])
+
+    def test_inexact_seek_containers_are_cropped_sequentially(self):
+        self.assertTrue(seeks_exactly("interview.avi"))
+        self.assertFalse(seeks_exactly("BF001_1PT.wmv"))
+        self.assertFalse(seeks_exactly("/videos/CLIP.ASF"))
+
+@unittest.skipUnless(importlib.util.find_spec("mediapipe"), "MediaPipe is not installed")
+class TestParallelCropping(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.temp_dir = tempfile.TemporaryDirectory()
+        cls.video_path = os.path.join(cls.temp_dir.name, "face.avi")
+        write_face_video(cls.video_path, 2 * MIN_SEGMENT_FRAMES + 20)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.temp_dir.cleanup()
+
+    def test_matches_the_sequential_crops(self):
+        # Every crop is kept (SSIM never reaches 1.01) so both paths sample the same frames
+        options = dict(target_frames=60, ssim_threshold=1.01, keyframe_interval=1)
+        with record() as sequential_timings:
+            frame_count, crops = extract_face_crops(self.video_path, **options)
+        with record() as parallel_timings:
+            parallel_count, parallel_crops = extract_face_crops_parallel(self.video_path, workers=2, **options)
+
+        self.assertEqual(parallel_count, frame_count)
+        self.assertEqual(parallel_crops.shape, crops.shape)
+        for name in ("frames_decoded", "faces_found", "frames_kept"):
+            self.assertEqual(parallel_timings.counters[name], sequential_timings.counters[name], name)
+        # The first segment is cropped exactly as sequentially; after its warm-up the second agrees to
+        # within Face Mesh's jitter, at most a pixel's shift of the crop
+        np.testing.assert_array_equal(parallel_crops[:25], crops[:25])
+        difference = np.abs(parallel_crops.astype(int) - crops.astype(int))
+        self.assertLess(difference.mean(), 1.0)
+
+    def test_segment_crops_are_bounded(self):
+        frames_read, crops, _ = crop_segment(self.video_path, 0, MIN_SEGMENT_FRAMES, 1, 1, 1.5, target_frames=10)
+        self.assertEqual(frames_read, MIN_SEGMENT_FRAMES)
+        self.assertEqual(crops.shape[1:], (128, 128, 3))
+        self.assertTrue(10 <= len(crops) <= 20)
+
+if __name__ == "__main__":
+    unittest.main()
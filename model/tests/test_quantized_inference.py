@@ -0,0 +1,64 @@
+import os
+import sys
+import tempfile
+import unittest
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+sys.path.insert(0, os.path.dirname(__file__))
+
+from InferenceEngine import FERInferenceEngine
+from QuantizedInference import (TFLiteFERInferenceEngine, TFLiteSequenceClassifier, convert_fer_model,
+                                convert_main_model, representative_frames, tflite_model_path)
+from helpers import create_small_fer_model, create_small_gru_model
+
+class TestQuantizedInference(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.mean_X = np.full((48, 48, 1), 128, dtype=np.float32)
+        self.std_X = np.full((48, 48, 1), 60, dtype=np.float32)
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def write(self, name, content):
+        path = os.path.join(self.temp_dir.name, name)
+        with open(path, "wb") as f:
+            f.write(content)
+        return path
+
+    def test_fer_engine_matches_float_model(self):
+        fer_model = create_small_fer_model()
+        frames = representative_frames(self.mean_X, self.std_X, count=20, seed=1)
+        expected_emotions, expected_encodings = FERInferenceEngine(fer_model).run(frames)
+
+        for mode in ("float32", "dynamic", "int8"):
+            calibration = representative_frames(self.mean_X, self.std_X)
+            path = self.write(f"fer.{mode}.tflite", convert_fer_model(fer_model, mode, calibration))
+            emotions, encodings = TFLiteFERInferenceEngine(path, batch_size=8).run(frames)
+            self.assertEqual(emotions.shape, expected_emotions.shape)
+            self.assertEqual(encodings.shape, expected_encodings.shape)
+            tolerance = 1e-5 if mode == "float32" else 0.05
+            np.testing.assert_allclose(emotions, expected_emotions, atol=tolerance)
+
+    def test_int8_needs_enough_calibration_frames(self):
+        with self.assertRaises(ValueError):
+            convert_fer_model(create_small_fer_model(), "int8", representative_frames(self.mean_X, self.std_X, count=20))
+
+    def test_sequence_classifier_matches_float_model(self):
+        model = create_small_gru_model(60, 16)
+        sequences = np.random.default_rng(0).normal(size=(3, 60, 16)).astype(np.float32)
+        expected = model.predict(sequences, verbose=0)
+
+        path = self.write("gru.dynamic.tflite", convert_main_model(model, "dynamic"))
+        scores = TFLiteSequenceClassifier(path).predict(sequences)
+        self.assertEqual(scores.shape, (3, 1))
+        np.testing.assert_allclose(scores, expected, atol=0.02)
+
+    def test_model_path_sits_next_to_keras_file(self):
+        self.assertEqual(tflite_model_path("models/fer.keras", "int8"), "models/fer.int8.tflite")
+
+if __name__ == "__main__":
+    unittest.main()
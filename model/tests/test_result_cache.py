@@ -0,0 +1,85 @@
+import io
+import os
+import sys
+import tempfile
+import time
+import unittest
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+
+from ResultCache import ResultCache, cache_key, save_and_hash
+
+class TestResultCache(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.cache_dir = self.temp_dir.name
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def test_round_trip_with_encodings(self):
+        cache = ResultCache(self.cache_dir)
+        encodings = np.random.default_rng(0).random((300, 4608), dtype=np.float32)
+        cache.put("abc", {"result": "Deceptive", "emotions": [1, 2]}, encodings)
+
+        self.assertEqual(cache.get("abc"), {"result": "Deceptive", "emotions": [1, 2]})
+        stored = cache.get_encodings("abc")
+        self.assertEqual(stored.dtype, np.float16)
+        np.testing.assert_allclose(stored, encodings, atol=1e-3)
+        self.assertIsNone(cache.get("missing"))
+        self.assertEqual((cache.hits, cache.misses), (1, 1))
+
+    def test_extra_arrays_are_kept_without_encodings(self):
+        cache = ResultCache(self.cache_dir, store_encodings=False)
+        tiles = np.random.default_rng(0).random((8, 48, 48), dtype=np.float32)
+        cache.put("abc", {"result": "Truthful"}, np.ones((300, 4608)), arrays={"tile_frames": tiles})
+
+        arrays = cache.get_arrays("abc")
+        self.assertEqual(set(arrays), {"tile_frames"})
+        np.testing.assert_allclose(arrays["tile_frames"], tiles, atol=1e-3)
+        self.assertIsNone(cache.get_encodings("abc"))
+        self.assertIsNone(cache.get_arrays("missing"))
+
+    def test_evicts_least_recently_used(self):
+        cache = ResultCache(self.cache_dir, max_bytes=2500)
+        payload = {"visualization": "x" * 1000}
+        cache.put("old", payload)
+        cache.put("used", payload)
+        past = time.time() - 60
+        os.utime(os.path.join(self.cache_dir, "old.json"), (past, past))
+        os.utime(os.path.join(self.cache_dir, "used.json"), (past, past))
+        self.assertIsNotNone(cache.get("used"))
+
+        cache.put("new", payload)
+        self.assertIsNone(cache.get("old"))
+        self.assertIsNotNone(cache.get("used"))
+        self.assertIsNotNone(cache.get("new"))
+
+    @unittest.skipUnless(hasattr(os, "getuid"), "POSIX permissions only")
+    def test_cache_directory_is_private(self):
+        cache_dir = os.path.join(self.cache_dir, "cache")
+        ResultCache(cache_dir)
+        self.assertEqual(os.stat(cache_dir).st_mode & 0o777, 0o700)
+
+    @unittest.skipUnless(hasattr(os, "getuid"), "POSIX permissions only")
+    def test_refuses_a_directory_others_can_write(self):
+        os.chmod(self.cache_dir, 0o777)
+        with self.assertRaises(PermissionError):
+            ResultCache(self.cache_dir)
+
+    def test_key_depends_on_video_params_and_models(self):
+        digest = save_and_hash(io.BytesIO(b"video bytes"), os.path.join(self.cache_dir, "upload.mp4"))
+        with open(os.path.join(self.cache_dir, "upload.mp4"), "rb") as f:
+            self.assertEqual(f.read(), b"video bytes")
+
+        key = cache_key(digest, {"num_frames": 300}, "models")
+        self.assertEqual(key, cache_key(digest, {"num_frames": 300}, "models"))
+        self.assertNotEqual(key, cache_key(digest, {"num_frames": 200}, "models"))
+        self.assertNotEqual(key, cache_key(digest, {"num_frames": 300}, "other models"))
+        self.assertNotEqual(key, cache_key("0" * 64, {"num_frames": 300}, "models"))
+
+if __name__ == "__main__":
+    unittest.main()
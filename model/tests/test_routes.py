@@ -0,0 +1,244 @@
+import importlib.util
+import os
+import sys
+import tempfile
+import threading
+import time
+import unittest
+from io import BytesIO
+from unittest import mock
+
+import cv2
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+sys.path.insert(0, os.path.dirname(__file__))
+
+from CodebookIndex import Codebook
+from ResultCache import ResultCache, cache_key
+from UploadIngestion import UploadBuffer
+from helpers import create_small_gru_model, face_frames, write_face_video, write_face_webm
+from test_codebook_index import write_codebook
+
+# Encoding size of StubFEREngine
+STUB_ENCODING_DIM = 16
+
+class StubFEREngine:
+    """FER engine stand-in: uniform emotions, and the first pixels of each frame as its encoding."""
+
+    def run(self, frames_processed, progress_callback=None):
+        flat = frames_processed.reshape(len(frames_processed), -1)
+        if progress_callback is not None:
+            progress_callback(1.0)
+        return np.full((len(flat), 7), 1 / 7, dtype=np.float32), flat[:, :STUB_ENCODING_DIM]
+
+@unittest.skipUnless(importlib.util.find_spec("mediapipe"), "MediaPipe is not installed")
+class TestRoutes(unittest.TestCase):
+    """The Flask routes end to end with the real pipeline around stub models."""
+
+    @classmethod
+    def setUpClass(cls):
+        import DeepLie
+        cls.DeepLie = DeepLie
+        cls.temp_dir = tempfile.TemporaryDirectory()
+
+        # Stub loaders replace the trained models before anything is loaded
+        gru_model = create_small_gru_model(DeepLie.NUM_FRAMES, STUB_ENCODING_DIM)
+        registry = DeepLie.model_registry
+        registry.register("fer_engine", lambda r: StubFEREngine())
+        registry.register("main_model", lambda r: gru_model)
+        registry.register("normalization", lambda r: (np.full((48, 48, 1), 128, np.float32),
+                                                      np.full((48, 48, 1), 60, np.float32)))
+        registry.register("model_digest", lambda r: "stub-models", preload=False)
+        cls.client = DeepLie.app.test_client()
+        response = cls.client.get("/api/ready")  # Starts loading the models
+        registry.start_background_loading().join(60)
+        cls.not_ready_status = response.status_code
+
+        cls.video_path = os.path.join(cls.temp_dir.name, "face.avi")
+        write_face_video(cls.video_path, 60)
+        with open(cls.video_path, "rb") as f:
+            cls.video = f.read()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.temp_dir.cleanup()
+
+    def setUp(self):
+        self.use_empty_cache()
+
+    def use_empty_cache(self):
+        cache_dir = tempfile.mkdtemp(dir=self.temp_dir.name)
+        self.DeepLie.result_cache = ResultCache(cache_dir, 64 << 20)
+
+    def wait_for_result(self, job_id):
+        response = self.client.get(f"/api/result/{job_id}?wait=60")
+        self.assertEqual(response.status_code, 200, response.get_json())
+        return response.get_json()
+
+    def test_ready_once_the_models_are_loaded(self):
+        self.assertIn(self.not_ready_status, (200, 503))
+        response = self.client.get("/api/ready")
+        self.assertEqual(response.status_code, 200)
+        status = response.get_json()
+        self.assertTrue(status["ready"])
+        self.assertTrue(status["components"]["fer_engine"]["loaded"])
+
+    def test_job_flow_and_cache_hit(self):
+        response = self.client.post("/api/predict", data={"video": (open(self.video_path, "rb"), "face.avi")})
+        self.assertEqual(response.status_code, 202)
+        job_id = response.get_json()["job_id"]
+
+        progress = self.client.get(f"/api/progress/{job_id}")
+        self.assertEqual(progress.status_code, 200)
+        self.assertIn(progress.get_json()["status"], ("queued", "running", "done"))
+
+        result = self.wait_for_result(job_id)
+        self.assertIn(result["result"], ("Deceptive", "Truthful"))
+        self.assertEqual(len(result["emotions"]), 1)
+        self.assertEqual(self.client.get(f"/api/progress/{job_id}").get_json()["status"], "done")
+
+        visualization = self.client.get(result["visualization_url"])
+        self.assertEqual(visualization.status_code, 200)
+        self.assertEqual(visualization.mimetype, "image/png")
+        self.assertEqual(visualization.data[:8], b"\x89PNG\r\n\x1a\n")
+
+        # The same video again is answered at once from the cache, with its visualization
+        response = self.client.post("/api/predict", data={"video": (open(self.video_path, "rb"), "face.avi")})
+        self.assertEqual(response.status_code, 200)
+        cached = response.get_json()
+        self.assertTrue(cached["cached"])
+        self.assertEqual(cached["result"]["prediction"], result["prediction"])
+        self.assertEqual(self.client.get(cached["result"]["visualization_url"]).status_code, 200)
+
+    def test_raw_body_uploads(self):
+        for streamed in (True, False):
+            with self.subTest(streamed=streamed), \
+                    mock.patch.object(self.DeepLie, "streaming_decode_available", return_value=streamed):
+                self.use_empty_cache()
+                response = self.client.post("/api/predict?timings=1", data=self.video,
+                                            content_type="video/x-msvideo")
+                self.assertEqual(response.status_code, 202)
+                result = self.wait_for_result(response.get_json()["job_id"])
+                self.assertIn("timings", result)
+                self.assertGreater(result["timings"]["counters"]["frames_decoded"], 0)
+
+                response = self.client.post("/api/predict", data=self.video, content_type="application/octet-stream")
+                self.assertEqual(response.status_code, 200)
+                self.assertEqual(response.get_json()["result"]["prediction"], result["prediction"])
+
+    def test_early_exit_before_the_upload_is_complete_is_cached(self):
+        path = os.path.join(self.temp_dir.name, "long.webm")
+        write_face_webm(path, 300)
+        with open(path, "rb") as f:
+            data = f.read()
+        waiting_for_digest = threading.Event()
+
+        class WatchedUpload(UploadBuffer):
+            def wait(self, end=None):
+                if end is None:
+                    waiting_for_digest.set()
+                return super().wait(end)
+
+        # Every frame is kept, so the score settles after the first 90 frames, well before the upload ends
+        upload = WatchedUpload(expected_size=len(data))
+        with mock.patch.object(self.DeepLie, "SSIM_THRESHOLD", 1.01):
+            job = self.DeepLie.job_queue.submit(self.DeepLie.run_upload_analysis, upload, "stub-models", "keras",
+                                                tolerance=0.9, cleanup=upload.close)
+            upload.write(data[:len(data) * 6 // 10])
+            deadline = time.time() + 60
+            while not waiting_for_digest.is_set() and not job.done_event.is_set() and time.time() < deadline:
+                time.sleep(0.01)
+            self.assertFalse(job.done_event.is_set(), "The job finished without the upload's digest")
+            upload.write(data[len(data) * 6 // 10:])
+            digest = upload.finish()
+            self.assertTrue(job.wait(60))
+
+        self.assertEqual(job.status, "done", job.error)
+        self.assertTrue(job.result["stopped_early"])
+        key = cache_key(digest, self.DeepLie.analysis_params("keras", 1, 0.9), "stub-models")
+        self.assertEqual(self.DeepLie.result_cache.get(key)["prediction"], job.result["prediction"])
+
+    def test_bad_requests(self):
+        self.assertEqual(self.client.post("/api/predict", data={}).status_code, 400)
+        self.assertEqual(self.client.post("/api/predict", data=b"", content_type="video/mp4").status_code, 400)
+        response = self.client.post("/api/predict?backend=onnx", data=self.video, content_type="video/mp4")
+        self.assertEqual(response.status_code, 400)
+        response = self.client.post("/api/predict?max_subjects=99", data=self.video, content_type="video/mp4")
+        self.assertEqual(response.status_code, 400)
+        for path in ("/api/progress/missing", "/api/result/missing", "/api/visualization/missing"):
+            self.assertEqual(self.client.get(path).status_code, 404)
+
+    def test_metrics(self):
+        response = self.client.get("/metrics")
+        self.assertEqual(response.status_code, 200)
+        text = response.get_data(as_text=True)
+        self.assertIn("deeplie_models_ready 1", text)
+        self.assertIn("deeplie_jobs_queued", text)
+
+    def test_profiler_api(self):
+        self.assertEqual(self.client.post("/api/profiler", json={"enabled": True}).status_code, 404)
+        self.assertEqual(self.client.get("/api/profiler").status_code, 404)
+        with mock.patch.object(self.DeepLie, "PROFILER_API", True):
+            for interval in ("fast", None, [1], 5):
+                response = self.client.post("/api/profiler", json={"enabled": True, "interval": interval})
+                self.assertEqual(response.status_code, 400, interval)
+            try:
+                response = self.client.post("/api/profiler", json={"enabled": True, "interval": 0.01})
+                self.assertEqual(response.status_code, 200)
+                self.assertTrue(response.get_json()["running"])
+                self.assertEqual(self.client.get("/api/profiler").mimetype, "text/plain")
+            finally:
+                response = self.client.post("/api/profiler", json={"enabled": False})
+            self.assertFalse(response.get_json()["running"])
+
+    def test_codebook_etag(self):
+        path = os.path.join(self.temp_dir.name, "codebook.xlsx")
+        write_codebook(path)
+        with mock.patch.object(self.DeepLie, "codebook", Codebook(path)):
+            response = self.client.get("/api/codebook?columns=VideoID,Veracity&limit=2")
+            self.assertEqual(response.status_code, 200)
+            page = response.get_json()
+            self.assertEqual((page["total"], len(page["rows"])), (3, 2))
+            etag = response.headers["ETag"]
+
+            response = self.client.get("/api/codebook?columns=VideoID,Veracity&limit=2",
+                                       headers={"If-None-Match": etag})
+            self.assertEqual(response.status_code, 304)
+            response = self.client.get("/api/codebook?columns=VideoID&limit=2", headers={"If-None-Match": etag})
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(self.client.get("/api/codebook?sheet=missing").status_code, 400)
+
+    def test_stream(self):
+        response = self.client.post("/api/stream", json={"emit_every": 10})
+        self.assertEqual(response.status_code, 201)
+        session_id = response.get_json()["session_id"]
+
+        frames = [cv2.imencode(".jpg", frame)[1].tobytes() for frame in face_frames(200)][::10]
+
+        def post_frames(frames):
+            files = [(BytesIO(frame), f"{idx}.jpg") for idx, frame in enumerate(frames)]
+            return self.client.post(f"/api/stream/{session_id}/frames", data={"frames": files}).get_json()
+
+        # Only the counters until emit_every frames have arrived, then a rolling update
+        self.assertEqual(set(post_frames(frames[:5])), {"frames_received", "frames_used"})
+        update = post_frames(frames[5:])
+        self.assertEqual(update["frames_received"], 20)
+        self.assertEqual(update["clip"], 0)
+        self.assertGreater(update["frames_used"], 0)
+
+        clip = self.client.post(f"/api/stream/{session_id}/clip").get_json()
+        self.assertEqual(clip["clip"], 0)
+        final = self.client.delete(f"/api/stream/{session_id}").get_json()
+        self.assertEqual((final["clip"], final["frames_received"]), (1, 20))
+        self.assertEqual(self.client.delete(f"/api/stream/{session_id}").status_code, 404)
+
+        response = self.client.post("/api/stream/missing/frames", data={})
+        self.assertEqual(response.status_code, 404)
+        response = self.client.post("/api/stream", json={})
+        bad = self.client.post(f"/api/stream/{response.get_json()['session_id']}/frames",
+                               data={"frames": [(BytesIO(b"not an image"), "0.jpg")]})
+        self.assertEqual(bad.status_code, 400)
+
+if __name__ == "__main__":
+    unittest.main()
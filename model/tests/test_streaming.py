@@ -0,0 +1,219 @@
+import importlib.util
+import os
+import sys
+import time
+import unittest
+
+import numpy as np
+import tensorflow as tf
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+sys.path.insert(0, os.path.dirname(__file__))
+
+from StreamingInference import EarlyExit, StreamSession, StreamSessions, StreamingClassifier, score_crops
+from helpers import create_small_gru_model, face_frames
+
+class TestStreamingClassifier(unittest.TestCase):
+
+    def test_streamed_score_matches_full_model(self):
+        frames, dims = 60, 16
+        model = create_small_gru_model(frames, dims)
+        encodings = np.random.default_rng(0).normal(size=(frames, dims)).astype("float32")
+        expected = float(model(encodings[np.newaxis], training=False)[0, 0])
+
+        classifier = StreamingClassifier(model, reference_frames=frames)
+        state = classifier.new_state()
+        self.assertIsNone(classifier.score(state))
+        for start in range(0, frames, 7):
+            classifier.push(state, encodings[start:start + 7])
+            if start >= 5:
+                self.assertIsNotNone(classifier.score(state))
+
+        self.assertAlmostEqual(classifier.score(state), expected, places=5)
+
+    def test_rejects_models_without_recurrent_layer(self):
+        X_input = tf.keras.layers.Input(shape=(10, 4))
+        X = tf.keras.layers.Flatten()(X_input)
+        X = tf.keras.layers.Dense(1, activation="sigmoid")(X)
+        with self.assertRaises(ValueError):
+            StreamingClassifier(tf.keras.models.Model(inputs=X_input, outputs=X))
+
+class FirstPixelsEngine:
+    """FER engine stand-in whose encodings are the first pixels of each frame."""
+
+    def __init__(self, dims):
+        self.dims = dims
+
+    def run(self, frames_processed):
+        flat = frames_processed.reshape(len(frames_processed), -1)
+        return np.full((len(flat), 7), 1 / 7, dtype=np.float32), flat[:, :self.dims]
+
+class TestEarlyExit(unittest.TestCase):
+
+    def test_stops_once_the_score_is_stable(self):
+        early_exit = EarlyExit(tolerance=0.02, patience=2, min_frames=90)
+        self.assertFalse(early_exit.update(None, 30))
+        self.assertFalse(early_exit.update(0.60, 30))
+        self.assertFalse(early_exit.update(0.61, 60))
+        self.assertTrue(early_exit.update(0.605, 90))
+        self.assertFalse(early_exit.update(0.70, 120))
+
+        # Too few frames, scores on both sides of 0.5, or a tolerance of 0 never stop
+        early_exit = EarlyExit(tolerance=0.02, patience=1, min_frames=90)
+        self.assertFalse(early_exit.update(0.6, 30) or early_exit.update(0.6, 60))
+        self.assertFalse(early_exit.update(0.495, 90) or early_exit.update(0.505, 120))
+        early_exit = EarlyExit(tolerance=0, patience=1, min_frames=0)
+        self.assertFalse(early_exit.update(0.6, 30) or early_exit.update(0.6, 60))
+
+class TestScoreCrops(unittest.TestCase):
+
+    def setUp(self):
+        self.frames, self.dims = 60, 16
+        self.model = create_small_gru_model(self.frames, self.dims)
+        self.classifier = StreamingClassifier(self.model, reference_frames=self.frames)
+        self.engine = FirstPixelsEngine(self.dims)
+        self.mean_X = np.full((48, 48, 1), 128, dtype=np.float32)
+        self.std_X = np.full((48, 48, 1), 60, dtype=np.float32)
+        self.decoded = 0
+        self.closed = False
+
+    def crops(self, count):
+        """Generator of random crops that records how many were taken and whether it was closed."""
+        rng = np.random.default_rng(0)
+        try:
+            for _ in range(count):
+                self.decoded += 1
+                yield rng.integers(0, 256, (32, 32, 3), dtype=np.uint8)
+        finally:
+            self.closed = True
+
+    def test_scores_only_the_real_frames(self):
+        scored = score_crops(self.crops(100), self.engine, self.classifier, self.mean_X, self.std_X,
+                             max_frames=self.frames, chunk_frames=25)
+        self.assertEqual((scored["frames_used"], self.decoded, scored["stopped_early"]), (60, 60, False))
+        self.assertTrue(self.closed)
+        self.assertEqual(scored["encodings"].shape, (60, self.dims))
+        self.assertEqual(len(scored["scores"]), 3)
+        expected = float(self.model(scored["encodings"][np.newaxis], training=False)[0, 0])
+        self.assertAlmostEqual(scored["score"], expected, places=5)
+
+        # A short clip is scored on its own frames, without padding
+        scored = score_crops(self.crops(20), self.engine, self.classifier, self.mean_X, self.std_X,
+                             max_frames=self.frames, chunk_frames=25)
+        self.assertEqual(scored["frames_used"], 20)
+        self.assertEqual(scored["emotion_preds"].shape, (20, 7))
+
+    def test_early_exit_stops_decoding(self):
+        class StopAfter:
+            def update(self, score, frames_used):
+                return frames_used >= 20
+
+        progress = []
+        scored = score_crops(self.crops(100), self.engine, self.classifier, self.mean_X, self.std_X,
+                             chunk_frames=10, early_exit=StopAfter(), progress_callback=progress.append)
+        self.assertEqual((scored["frames_used"], scored["stopped_early"]), (20, True))
+        self.assertEqual(progress, [10, 20])
+        self.assertEqual(self.decoded, 20)
+        self.assertTrue(self.closed)
+
+class RecordingLock:
+    """Context manager standing in for the job queue's inference lock, recording whether it is held."""
+
+    def __init__(self):
+        self.held = False
+        self.acquisitions = 0
+
+    def __enter__(self):
+        self.held = True
+        self.acquisitions += 1
+
+    def __exit__(self, *exc_info):
+        self.held = False
+
+@unittest.skipUnless(importlib.util.find_spec("mediapipe"), "MediaPipe is not installed")
+class TestStreamSession(unittest.TestCase):
+
+    def setUp(self):
+        self.frames, self.dims = 60, 16
+        self.model = create_small_gru_model(self.frames, self.dims)
+        self.lock = RecordingLock()
+        self.encoded = []
+        test, engine, lock = self, FirstPixelsEngine(self.dims), self.lock
+
+        class LockCheckedEngine:
+            def run(self, frames_processed):
+                test.assertTrue(lock.held)
+                emotion_preds, encodings = engine.run(frames_processed)
+                test.encoded.append(encodings)
+                return emotion_preds, encodings
+
+        class LockCheckedClassifier(StreamingClassifier):
+            def push(self, state, encodings):
+                test.assertTrue(lock.held)
+                super().push(state, encodings)
+
+            def score(self, state):
+                test.assertTrue(lock.held)
+                return super().score(state)
+
+        self.classifier = LockCheckedClassifier(self.model, reference_frames=self.frames)
+        mean_X = np.full((48, 48, 1), 128, dtype=np.float32)
+        std_X = np.full((48, 48, 1), 60, dtype=np.float32)
+        # Every crop is kept (SSIM never reaches 1.01), so each clip uses all of its frames
+        self.session = StreamSession(LockCheckedEngine(), self.classifier, mean_X, std_X, emit_every=10,
+                                     ssim_threshold=1.01, inference_lock=self.lock)
+        self.addCleanup(self.session.close)
+
+    def expected_score(self, encodings):
+        classifier = StreamingClassifier(self.model, reference_frames=self.frames)
+        state = classifier.new_state()
+        classifier.push(state, encodings)
+        return classifier.score(state)
+
+    def test_clips_are_scored_on_their_own_frames(self):
+        frames = list(face_frames(40))
+        for start in range(0, 20, 5):
+            self.session.push_frames(frames[start:start + 5])
+        first = self.session.end_clip()
+        first_encodings = np.concatenate(self.encoded)
+        self.assertEqual((first["clip"], first["frames_used"], len(first["emotion_preds"])), (0, 20, 20))
+        self.assertAlmostEqual(first["score"], self.expected_score(first_encodings), places=5)
+
+        self.encoded.clear()
+        for start in range(20, 40, 5):
+            self.session.push_frames(frames[start:start + 5])
+        second = self.session.end_clip()
+        self.assertEqual((second["clip"], second["frames_used"], len(second["emotion_preds"])), (1, 20, 20))
+        # Not the cumulative score of all 40 frames
+        self.assertAlmostEqual(second["score"], self.expected_score(np.concatenate(self.encoded)), places=5)
+        self.assertGreater(self.lock.acquisitions, 8)
+
+class IdleSession:
+
+    def __init__(self, session_id, last_active):
+        self.session_id = session_id
+        self.last_active = last_active
+        self.closed = False
+
+    def close(self):
+        self.closed = True
+
+class TestStreamSessions(unittest.TestCase):
+
+    def test_idle_sessions_are_closed_on_lookup(self):
+        sessions = StreamSessions(max_sessions=2, idle_timeout=60)
+        active = sessions.add(IdleSession("active", time.time()))
+        idle = sessions.add(IdleSession("idle", time.time()))
+        idle.last_active -= 61
+
+        self.assertIsNone(sessions.get("idle"))
+        self.assertTrue(idle.closed)
+        self.assertIs(sessions.get("active"), active)
+        self.assertFalse(active.closed)
+        # The idle session's slot is free again
+        sessions.add(IdleSession("new", time.time()))
+        with self.assertRaises(RuntimeError):
+            sessions.add(IdleSession("extra", time.time()))
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,85 @@
+import os
+import sys
+import unittest
+
+import numpy as np
+import tensorflow as tf
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+sys.path.insert(0, os.path.dirname(__file__))
+
+from FeatureStore import Features
+from TrainingPipeline import augment_images, fer_dataset, sequence_dataset, train
+from helpers import create_small_gru_model
+
+def batches(dataset):
+    return [(x.numpy(), y.numpy()) for x, y in dataset]
+
+class TestTrainingPipeline(unittest.TestCase):
+
+    def setUp(self):
+        rng = np.random.default_rng(0)
+        self.images = rng.integers(0, 256, (40, 48, 48, 1), dtype=np.uint8)
+        self.labels = np.eye(7, dtype=np.float32)[rng.integers(0, 7, 40)]
+        self.mean_X = np.full((48, 48, 1), 128, dtype=np.float32)
+        self.std_X = np.full((48, 48, 1), 60, dtype=np.float32)
+
+    def test_augmentations_are_seeded_and_per_image(self):
+        images = tf.constant(self.images, tf.float32)
+        seed = tf.constant([1, 2], tf.int64)
+        augmented = augment_images(images, seed).numpy()
+        np.testing.assert_array_equal(augment_images(images, seed).numpy(), augmented)
+        self.assertFalse(np.array_equal(augment_images(images, tf.constant([3, 4], tf.int64)).numpy(), augmented))
+        self.assertEqual(augmented.shape, (40, 48, 48, 1))
+        self.assertTrue(0 <= augmented.min() and augmented.max() <= 255)
+
+        # Some images of the batch are changed and, with probability 0, none
+        changed = np.abs(augmented - self.images).reshape(40, -1).max(axis=1) > 0
+        self.assertTrue(0 < changed.sum() < 40)
+        np.testing.assert_allclose(augment_images(images, seed, probability=0.0).numpy(), images.numpy(), atol=1e-3)
+
+    def test_fer_dataset(self):
+        evaluation = batches(fer_dataset(self.images, self.labels, self.mean_X, self.std_X, batch_size=16))
+        self.assertEqual([len(x) for x, _ in evaluation], [16, 16, 8])
+        np.testing.assert_allclose(evaluation[0][0], (self.images[:16] - 128.0) / 60, rtol=1e-5)
+        np.testing.assert_array_equal(evaluation[2][1], self.labels[32:])
+
+        # Training epochs are reproducible for a seed and differ from one epoch to the next
+        dataset = fer_dataset(self.images, self.labels, self.mean_X, self.std_X, batch_size=16, training=True, seed=7)
+        first, second = batches(dataset), batches(dataset)
+        again = batches(fer_dataset(self.images, self.labels, self.mean_X, self.std_X, batch_size=16, training=True,
+                                    seed=7))
+        self.assertEqual(len(first), 2)
+        np.testing.assert_array_equal(first[0][0], again[0][0])
+        self.assertFalse(np.array_equal(first[0][0], second[0][0]))
+
+        # Face crops are converted to 48x48 grayscale like InferenceEngine.preprocess_frames
+        crops = np.repeat(np.repeat(self.images[:4], 2, axis=1), 2, axis=2).repeat(3, axis=3)
+        x, _ = next(iter(fer_dataset(crops, self.labels[:4], self.mean_X, self.std_X)))
+        np.testing.assert_allclose(x.numpy(), (self.images[:4] - 128.0) / 60, atol=0.05)
+
+    def test_trains_the_gru_from_stored_features(self):
+        rng = np.random.default_rng(1)
+        encodings = rng.normal(size=(10, 40, 16)).astype(np.float32)
+        labels = np.array([0, 1] * 5)
+        features = Features([f"V{idx}" for idx in range(10)], ["S"] * 10, encodings, None, labels, labels)
+
+        dataset = sequence_dataset(features, batch_size=4, training=True, seed=0)
+        seen = batches(dataset)
+        self.assertEqual([len(x) for x, _ in seen], [4, 4, 2])
+        for x, y in seen:
+            for sequence, label in zip(x, y):
+                idx = next(idx for idx in range(10) if np.array_equal(encodings[idx], sequence))
+                self.assertEqual(label, labels[idx])
+
+        model = create_small_gru_model(40, 16)
+        model.compile(loss="binary_crossentropy", optimizer="adam", metrics=["accuracy"])
+        history = train(model, dataset, epochs=2, validation_data=sequence_dataset(features, batch_size=4), log=None)
+        self.assertEqual(len(history), 2)
+        self.assertEqual(history[0]["steps"], 3)
+        for name in ("loss", "accuracy", "val_loss", "val_accuracy", "seconds", "input_stall_seconds"):
+            self.assertIn(name, history[1])
+        self.assertLessEqual(history[1]["input_stall_seconds"], history[1]["seconds"])
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,201 @@
+import hashlib
+import io
+import os
+import sys
+import tempfile
+import threading
+import time
+import unittest
+
+import cv2
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+sys.path.insert(0, os.path.dirname(__file__))
+
+from UploadIngestion import UploadAbortedError, UploadBuffer, open_upload_capture, streaming_decode_available
+from helpers import write_face_webm
+
+def write_test_video(path, count=12, size=(64, 48)):
+    """An MJPG AVI of count frames whose brightness rises with the frame index."""
+    writer = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*"MJPG"), 10, size)
+    for idx in range(count):
+        writer.write(np.full((size[1], size[0], 3), 10 + 20 * idx, dtype=np.uint8))
+    writer.release()
+
+def read_in_thread(function):
+    """Run function in a thread; returns the thread and a dict that gets its "result" or "error"."""
+    outcome = {}
+
+    def target():
+        try:
+            outcome["result"] = function()
+        except Exception as e:
+            outcome["error"] = e
+
+    thread = threading.Thread(target=target, daemon=True)
+    thread.start()
+    return thread, outcome
+
+class TestUploadIngestion(unittest.TestCase):
+
+    def test_reads_block_until_the_bytes_arrive(self):
+        upload = UploadBuffer()
+        reader = upload.open()
+        thread, outcome = read_in_thread(lambda: reader.read(6))
+        upload.write(b"abc")
+        time.sleep(0.05)
+        self.assertTrue(thread.is_alive())
+
+        upload.write(b"defgh")
+        thread.join(1)
+        self.assertEqual(outcome["result"], b"abcdef")
+        self.assertEqual(reader.tell(), 6)
+
+        # At the end of a complete upload reads are short, then empty
+        upload.finish()
+        self.assertEqual(reader.read(10), b"gh")
+        self.assertEqual(reader.read(10), b"")
+
+    def test_seeking_from_the_end_waits_for_completion(self):
+        upload = UploadBuffer()
+        reader = upload.open()
+        upload.write(b"0123")
+        thread, outcome = read_in_thread(lambda: reader.seek(-2, io.SEEK_END))
+        time.sleep(0.05)
+        self.assertTrue(thread.is_alive())
+
+        digest = upload.finish()
+        thread.join(1)
+        self.assertEqual(outcome["result"], 2)
+        self.assertEqual(reader.read(), b"23")
+        self.assertEqual(digest, hashlib.sha256(b"0123").hexdigest())
+        self.assertEqual(upload.digest, digest)
+
+    def test_expected_size_answers_seeks_from_the_end(self):
+        upload = UploadBuffer(expected_size=10)
+        reader = upload.open()
+        upload.write(b"0123")
+        self.assertEqual(reader.seek(-2, io.SEEK_END), 8)
+        self.assertEqual(reader.seek(0), 0)
+        self.assertEqual(reader.read(4), b"0123")
+
+    def test_receive_copies_a_stream_and_returns_its_digest(self):
+        data = os.urandom(100_000)
+        upload = UploadBuffer()
+        self.assertEqual(upload.receive(io.BytesIO(data), chunk_size=4096), hashlib.sha256(data).hexdigest())
+        self.assertTrue(upload.complete)
+        self.assertEqual(upload.size, len(data))
+        self.assertEqual(upload.open().read(), data)
+
+    def test_abort_fails_waiting_and_later_reads(self):
+        upload = UploadBuffer()
+        reader = upload.open()
+        thread, outcome = read_in_thread(lambda: reader.read(1))
+        upload.abort()
+        thread.join(1)
+        self.assertIsInstance(outcome["error"], UploadAbortedError)
+        with self.assertRaises(UploadAbortedError):
+            upload.open().read()
+
+    def test_a_failing_stream_aborts_readers(self):
+        class BrokenStream:
+            def read(self, size):
+                raise ConnectionResetError("client went away")
+
+        upload = UploadBuffer()
+        with self.assertRaises(ConnectionResetError):
+            upload.receive(BrokenStream())
+        with self.assertRaisesRegex(UploadAbortedError, "client went away"):
+            upload.open().read()
+
+    def test_large_uploads_spill_to_a_file(self):
+        data = os.urandom(10_000)
+        upload = UploadBuffer(memory_limit=4096)
+        reader = upload.open()
+        upload.write(data[:3000])
+        self.assertFalse(upload.spilled)
+        self.assertEqual(reader.read(2000), data[:2000])
+
+        for start in range(3000, len(data), 1500):
+            upload.write(data[start:start + 1500])
+        upload.finish()
+        self.assertTrue(upload.spilled)
+        self.assertEqual(upload.size, len(data))
+        self.assertEqual(reader.read(), data[2000:])
+        reader.seek(-100, io.SEEK_END)
+        self.assertEqual(reader.read(), data[-100:])
+
+        upload.close()
+        with self.assertRaises(UploadAbortedError):
+            upload.open().read(1)
+
+    def test_writes_after_close_are_only_hashed(self):
+        upload = UploadBuffer(memory_limit=10)
+        upload.write(b"0123456789abc")
+        upload.close()
+        self.assertEqual(upload.receive(io.BytesIO(b"def")), hashlib.sha256(b"0123456789abcdef").hexdigest())
+        self.assertEqual(upload.size, 16)
+
+    @unittest.skipUnless(streaming_decode_available(), "PyAV is not installed")
+    def test_capture_decodes_a_streamed_webm_before_it_is_complete(self):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            video_path = os.path.join(temp_dir, "video.webm")
+            write_face_webm(video_path, 300)
+            with open(video_path, "rb") as f:
+                data = f.read()
+
+        # Opening the container asks for its size; with the declared length that does not wait for the rest
+        upload = UploadBuffer(expected_size=len(data))
+        upload.write(data[:len(data) // 2])
+
+        def read_frames(count):
+            capture = open_upload_capture(upload)
+            return [capture.read()[0] for _ in range(count)]
+
+        thread, outcome = read_in_thread(lambda: read_frames(10))
+        thread.join(10)
+        upload.abort()
+        self.assertEqual(outcome.get("result"), [True] * 10, outcome.get("error"))
+
+    @unittest.skipUnless(streaming_decode_available(), "PyAV is not installed")
+    def test_capture_decodes_an_upload_while_it_arrives(self):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            video_path = os.path.join(temp_dir, "video.avi")
+            write_test_video(video_path)
+            with open(video_path, "rb") as f:
+                data = f.read()
+            expected = []
+            capture = cv2.VideoCapture(video_path)
+            ok, frame = capture.read()
+            while ok:
+                expected.append(frame)
+                ok, frame = capture.read()
+            capture.release()
+
+        upload = UploadBuffer()
+
+        def feed():
+            for start in range(0, len(data), 1024):
+                upload.write(data[start:start + 1024])
+                time.sleep(0.001)
+            upload.finish()
+
+        threading.Thread(target=feed, daemon=True).start()
+        capture = open_upload_capture(upload)
+        self.assertTrue(capture.isOpened())
+        self.assertEqual(capture.get(cv2.CAP_PROP_FRAME_WIDTH), 64)
+        frames = []
+        ok, frame = capture.read()
+        while ok:
+            frames.append(frame)
+            ok, frame = capture.read()
+        capture.release()
+
+        self.assertEqual(len(frames), len(expected))
+        for frame, expected_frame in zip(frames, expected):
+            self.assertEqual(frame.shape, expected_frame.shape)
+            self.assertLess(np.abs(frame.astype(int) - expected_frame.astype(int)).mean(), 2)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,47 @@
+import os
+import sys
+import unittest
+
+import cv2
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+
+from Visualization import MAX_RENDER_WIDTH, MIN_RENDER_WIDTH, render_png, render_width, select_tiles
+
+def make_tiles(frames=300, num_tiles=8):
+    rng = np.random.default_rng(0)
+    return select_tiles(rng.normal(size=(frames, 48, 48, 1)), rng.random((frames, 7)),
+                        rng.random((frames, 4608)), num_tiles)
+
+class TestVisualization(unittest.TestCase):
+
+    def test_select_tiles_spans_the_sequence(self):
+        frames = np.arange(300, dtype=np.float32)[:, None, None, None] * np.ones((1, 48, 48, 1))
+        tiles = select_tiles(frames, np.zeros((300, 7)), np.zeros((300, 4608)), 8)
+        self.assertEqual(tiles["frames"].shape, (8, 48, 48))
+        self.assertEqual(tiles["emotion_preds"].shape, (8, 7))
+        self.assertEqual(tiles["encodings"].shape, (8, 4608))
+        self.assertEqual(tiles["frames"][0, 0, 0], 0)
+        self.assertEqual(tiles["frames"][-1, 0, 0], 299)
+
+    def test_short_sequences_use_every_frame(self):
+        self.assertEqual(len(make_tiles(frames=3)["frames"]), 3)
+
+    def test_render_width_is_clamped_and_rounded(self):
+        self.assertEqual(render_width(800), 768)
+        self.assertEqual(render_width(10), MIN_RENDER_WIDTH)
+        self.assertEqual(render_width(100000), MAX_RENDER_WIDTH)
+
+    def test_render_png_decodes_at_requested_width(self):
+        png = render_png(make_tiles(), render_width(800))
+        image = cv2.imdecode(np.frombuffer(png, np.uint8), cv2.IMREAD_COLOR)
+        self.assertEqual(image.shape[1], 768)
+        self.assertGreater(image.shape[0], 0)
+
+    def test_render_accepts_float16_tiles(self):
+        tiles = {name: array.astype(np.float16) for name, array in make_tiles().items()}
+        self.assertTrue(render_png(tiles, 512).startswith(b"\x89PNG"))
+
+if __name__ == "__main__":
+    unittest.main()
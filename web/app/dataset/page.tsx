@@ -1,10 +1,6 @@
 "use client";
 
-import React, {useEffect, useState, useRef} from "react";
-import {useTheme} from "next-themes"; // Import useTheme
-// @ts-ignore
-import ExcelViewer from "excel-viewer";
-import "@/styles/excel-viewer.css";
+import React, {useEffect, useState} from "react";
 import {
 	AlertDialog,
 	AlertDialogAction,
@@ -13,73 +9,186 @@ import {
 	AlertDialogHeader,
 	AlertDialogTitle
 } from "@/components/ui/alert-dialog";
-import {AlertCircle} from "lucide-react";
+import {Button} from "@/components/ui/button";
+import {Input} from "@/components/ui/input";
+import {
+	Select,
+	SelectContent,
+	SelectItem,
+	SelectTrigger,
+	SelectValue,
+} from "@/components/ui/select";
+import {
+	Table,
+	TableBody,
+	TableCell,
+	TableHead,
+	TableHeader,
+	TableRow,
+} from "@/components/ui/table";
+import {AlertCircle, Download} from "lucide-react";
+
+const CODEBOOK_URL = "http://localhost:5001/api/codebook";
+
+// Rows fetched per page; the server only sends this slice of the codebook
+const PAGE_SIZE = 25;
+
+// Columns shown for each sheet (transcriptions are left out of the table)
+const SHEET_COLUMNS: Record<string, string[]> = {
+	videos: ["VideoID", "Subject", "Veracity", "Valence", "Sex", "Race", "VidLength_sec", "WordCount", "Accuracy",
+		"TruthProp", "Attractive", "Trustworthy", "Anxious"],
+	targets: ["TargetID", "Sex", "Race", "Age", "SchoolYear", "Major", "Sensitivity", "Criterion", "Accuracy",
+		"TruthProp", "Attractive", "Trustworthy", "Anxious"],
+};
+
+interface CodebookPage {
+	columns: string[];
+	total: number;
+	offset: number;
+	rows: Record<string, string | number | null>[];
+}
 
 export default function DatasetPage() {
 	const [isLoading, setIsLoading] = useState(true);
 	const [errorMessage, setErrorMessage] = useState<string | null>(null);
 	const [showError, setShowError] = useState<boolean>(false)
-	const {resolvedTheme} = useTheme(); // Get the resolved theme (light/dark)
-	const viewerContainerRef = useRef<HTMLDivElement>(null); // Ref for the container
+	const [sheet, setSheet] = useState("videos");
+	const [veracity, setVeracity] = useState("all");
+	const [valence, setValence] = useState("all");
+	const [subject, setSubject] = useState("");
+	const [offset, setOffset] = useState(0);
+	const [page, setPage] = useState<CodebookPage | null>(null);
 
 	useEffect(() => {
-		// Ensure this runs only client-side and theme is available
-		if (typeof window === "undefined" || !resolvedTheme || !viewerContainerRef.current) {
-			return;
-		}
-
-		// Clear previous viewer instance before creating a new one
-		if (viewerContainerRef.current) {
-			viewerContainerRef.current.innerHTML = '';
-		}
+		// Fetch only the rows on screen; unchanged pages are revalidated with their ETag and answered with 304
+		const params = new URLSearchParams({
+			sheet,
+			columns: SHEET_COLUMNS[sheet].join(","),
+			offset: String(offset),
+			limit: String(PAGE_SIZE),
+		});
+		if (sheet === "videos" && veracity !== "all") params.set("veracity", veracity);
+		if (sheet === "videos" && valence !== "all") params.set("valence", valence);
+		if (subject.trim()) params.set("subject", subject.trim());
 
+		const controller = new AbortController();
 		setIsLoading(true);
-		setErrorMessage(null);
-
-		const initializeExcelViewer = () => {
-			// Delay to ensure DOM is ready after theme change potentially re-renders
-			const timerId = setTimeout(() => {
-				try {
-					console.log(`Initializing ExcelViewer with theme: ${resolvedTheme}`);
-					const viewer = new ExcelViewer("#excel-view", "http://localhost:5001/api/codebook", {
-						theme: resolvedTheme === 'dark' ? 'dark' : 'light', // Use resolvedTheme
-						lang: "en"
-
-					});
-
-					if (!viewer) {
-						throw new Error("ExcelViewer constructor failed.");
-					}
-
-					console.log("ExcelViewer initialized.");
-					setIsLoading(false);
-				} catch (err: any) {
-					console.error("Excel viewer initialization error:", err);
-					setErrorMessage(`Failed to load Excel viewer: ${err.message || 'Unknown error'}`);
-					setShowError(true);
-					setIsLoading(false);
+		fetch(`${CODEBOOK_URL}?${params}`, {signal: controller.signal})
+			.then(async (response) => {
+				const data = await response.json();
+				if (!response.ok) {
+					throw new Error(`Server responded with ${response.status}: ${data.error || response.statusText}`);
 				}
-			}, 10);
+				setPage(data);
+				setIsLoading(false);
+			})
+			.catch((err) => {
+				if (err.name === "AbortError") return;
+				console.error("Codebook loading error:", err);
+				setErrorMessage(`Failed to load the codebook: ${err.message || 'Unknown error'}`);
+				setShowError(true);
+				setIsLoading(false);
+			});
+		return () => controller.abort();
+	}, [sheet, veracity, valence, subject, offset]);
 
-			return () => clearTimeout(timerId);
-		};
+	// Any change of sheet or filter starts again from the first page
+	const updateFilter = (setter: (value: string) => void) => (value: string) => {
+		setter(value);
+		setOffset(0);
+	};
 
-		// Directly call initializeExcelViewer and store its cleanup function
-		initializeExcelViewer();
-
-		return () => {
-			if (viewerContainerRef.current) {
-				// eslint-disable-next-line react-hooks/exhaustive-deps
-				viewerContainerRef.current.innerHTML = '';
-			}
-		};
-	}, [resolvedTheme]); // Re-run effect when resolvedTheme changes
+	const formatCell = (column: string, value: string | number | null) => {
+		if (value === null) return "";
+		if (column === "Veracity") return value === 1 ? "Truthful" : "Deceptive";
+		if (column === "Valence") return value === 1 ? "Positive" : "Negative";
+		return String(value);
+	};
 
 	return (
-		<div>
-			{isLoading && <p className="text-center">Loading codebook...</p>}
-			<div id="excel-view" ref={viewerContainerRef}
-			     style={{visibility: isLoading ? 'hidden' : 'visible'}}></div>
+		<div className="space-y-4">
+			<div className="flex flex-wrap items-center gap-3">
+				<Select value={sheet} onValueChange={updateFilter(setSheet)}>
+					<SelectTrigger className="w-[160px]">
+						<SelectValue/>
+					</SelectTrigger>
+					<SelectContent>
+						<SelectItem value="videos">Videos</SelectItem>
+						<SelectItem value="targets">Targets</SelectItem>
+					</SelectContent>
+				</Select>
+				{sheet === "videos" && (
+					<>
+						<Select value={veracity} onValueChange={updateFilter(setVeracity)}>
+							<SelectTrigger className="w-[160px]">
+								<SelectValue/>
+							</SelectTrigger>
+							<SelectContent>
+								<SelectItem value="all">Any veracity</SelectItem>
+								<SelectItem value="1">Truthful</SelectItem>
+								<SelectItem value="0">Deceptive</SelectItem>
+							</SelectContent>
+						</Select>
+						<Select value={valence} onValueChange={updateFilter(setValence)}>
+							<SelectTrigger className="w-[160px]">
+								<SelectValue/>
+							</SelectTrigger>
+							<SelectContent>
+								<SelectItem value="all">Any valence</SelectItem>
+								<SelectItem value="1">Positive</SelectItem>
+								<SelectItem value="0">Negative</SelectItem>
+							</SelectContent>
+						</Select>
+					</>
+				)}
+				<Input className="w-[200px]" placeholder="Subjects, e.g. BF001,BM002" value={subject}
+				       onChange={(event) => updateFilter(setSubject)(event.target.value)}/>
+				<Button variant="outline" asChild className="ml-auto">
+					<a href={`${CODEBOOK_URL}?format=xlsx`}>
+						<Download className="mr-2 h-4 w-4"/>
+						Download XLSX
+					</a>
+				</Button>
+			</div>
+
+			{isLoading && !page && <p className="text-center">Loading codebook...</p>}
+			{page && (
+				<div style={{opacity: isLoading ? 0.6 : 1}}>
+					<Table>
+						<TableHeader>
+							<TableRow>
+								{page.columns.map((column) => <TableHead key={column}>{column}</TableHead>)}
+							</TableRow>
+						</TableHeader>
+						<TableBody>
+							{page.rows.map((row, index) => (
+								<TableRow key={index}>
+									{page.columns.map((column) => (
+										<TableCell key={column}>{formatCell(column, row[column])}</TableCell>
+									))}
+								</TableRow>
+							))}
+						</TableBody>
+					</Table>
+					<div className="flex items-center justify-between pt-4">
+						<p className="text-sm text-muted-foreground">
+							{page.total === 0
+								? "No matching rows"
+								: `Rows ${page.offset + 1}-${page.offset + page.rows.length} of ${page.total}`}
+						</p>
+						<div className="flex gap-2">
+							<Button variant="outline" disabled={offset === 0}
+							        onClick={() => setOffset(Math.max(0, offset - PAGE_SIZE))}>
+								Previous
+							</Button>
+							<Button variant="outline" disabled={offset + PAGE_SIZE >= page.total}
+							        onClick={() => setOffset(offset + PAGE_SIZE)}>
+								Next
+							</Button>
+						</div>
+					</div>
+				</div>
+			)}
 			<AlertDialog open={showError} onOpenChange={setShowError}>
 				<AlertDialogContent className="max-w-md">
 					<AlertDialogHeader>
@@ -102,4 +211,4 @@ export default function DatasetPage() {
 			</AlertDialog>
 		</div>
 	);
-}
\ No newline at end of file
+}
@@ -87,6 +87,8 @@ export default function ModelPage() {
 	const [previewImageSrc, setPreviewImageSrc] = useState<string>("")
 	const [pdfBlob, setPdfBlob] = useState<Blob | null>(null)
 	const INTERVAL_TIME = 10
+	const STREAM_FPS = 10
+	const STREAM_BATCH = 5
 
 	const isCameraActiveRef = useRef(false)
 	const isMountedRef = useRef(false)
@@ -97,6 +99,10 @@ export default function ModelPage() {
 	const videoRef = useRef<HTMLVideoElement>(null)
 	const canvasRef = useRef<HTMLCanvasElement>(null)
 	const timerIntervalRef = useRef<NodeJS.Timeout | null>(null) // Rename from countdownIntervalRef
+	const streamSessionRef = useRef<string | null>(null)
+	const frameCaptureRef = useRef<NodeJS.Timeout | null>(null)
+	const pendingFramesRef = useRef<Blob[]>([])
+	const streamInFlightRef = useRef(false)
 
 	const COLORS = [
 		"rgba(0,0,0,0.7)",
@@ -142,61 +148,97 @@ export default function ModelPage() {
 	};
 
 	/**
-	 * startPredictProgressCheck:
-	 *   Starts polling the /api/progress endpoint every 500ms,
-	 *   updating the `progress` state until it reaches 100%.
-	 *   Returns the interval ID for cleanup.
+	 * waitForPredictionJob:
+	 *   Polls the /api/progress/<jobId> endpoint every 500ms, updating the
+	 *   `progress` state, and resolves with the job's result from
+	 *   /api/result/<jobId> once the job has finished.
+	 * @param jobId - The id returned by the /api/predict endpoint.
 	 */
-	const startPredictProgressCheck = () => {
+	const waitForPredictionJob = (jobId: string): Promise<any> => {
 		if (pollTimer) {
 			clearInterval(pollTimer)
 		}
 
-		const timer = setInterval(async () => {
-			try {
-				const res = await fetch("http://localhost:5001/api/progress")
-				const data = await res.json()
+		return new Promise((resolve, reject) => {
+			const timer = setInterval(async () => {
+				try {
+					const res = await fetch(`http://localhost:5001/api/progress/${jobId}`)
+					const data = await res.json()
+					if (!res.ok) {
+						throw new Error(`Server responded with ${res.status}: ${data.error || res.statusText}`)
+					}
 
-				if (data.progress !== undefined) {
-					setProgress(data.progress)
-					if (data.progress >= 100) {
+					if (data.progress !== undefined) {
+						setProgress(data.progress)
+					}
+					if (data.status === "done" || data.status === "failed" || data.status === "cancelled") {
 						clearInterval(timer)
 						setPollTimer(null)
+						const resultResponse = await fetch(`http://localhost:5001/api/result/${jobId}`)
+						const result = await resultResponse.json()
+						if (!resultResponse.ok) {
+							reject(new Error(`Server responded with ${resultResponse.status}: ${result.error || resultResponse.statusText}`))
+						} else {
+							resolve(result)
+						}
 					}
+				} catch (err) {
+					clearInterval(timer)
+					setPollTimer(null)
+					reject(err)
 				}
-			} catch (err) {
-				console.error("Progress poll error:", err)
-			}
-		}, 500)
+			}, 500)
 
-		setPollTimer(timer)
-		return timer
+			setPollTimer(timer)
+		})
+	}
+
+	/**
+	 * fetchVisualization:
+	 *   Downloads a job's visualization PNG into an object URL, so the history keeps showing it after
+	 *   the server has expired the job (an hour after it finished). Resolves with undefined if the
+	 *   image cannot be fetched; the result is still shown without it.
+	 * @param visualizationUrl - The result's visualization_url.
+	 */
+	const fetchVisualization = async (visualizationUrl: string): Promise<string | undefined> => {
+		try {
+			const response = await fetch(`http://localhost:5001${visualizationUrl}`)
+			if (!response.ok) {
+				return undefined
+			}
+			return URL.createObjectURL(await response.blob())
+		} catch (err) {
+			console.log(err)
+			return undefined
+		}
 	}
 
 	/**
 	 * sendVideoForPrediction:
-	 *   Uploads a video Blob or File to the /api/predict endpoint,
-	 *   handles errors, and updates `predictionResults`, `emotionData`,
+	 *   Uploads a video Blob or File to the /api/predict endpoint, waits for
+	 *   the queued analysis job to finish (unless the result was cached), handles errors, and updates `predictionResults`, `emotionData`,
 	 *   and `visualizationImg` based on the server response.
 	 *   Also stores the video blob/file with the result, even on failure.
 	 */
 	const sendVideoForPrediction = async (videoData: File | Blob) => {
-		startPredictProgressCheck();
-		const formData = new FormData();
+		setProgress(0);
 		const fileName = videoData instanceof File ? videoData.name : `live_recording_${new Date().toISOString()}.webm`;
-		formData.append("video", videoData, fileName);
 
 		let storedBlob = videoData; // Use the original Blob directly
 
 		try {
+			// Sent as the raw request body, so the server starts cropping faces while the video is still arriving
 			const response = await fetch("http://localhost:5001/api/predict", {
 				method: "POST",
-				body: formData,
+				headers: { "Content-Type": videoData.type || "application/octet-stream" },
+				body: videoData,
 			});
-			const data = await response.json();
+			const job = await response.json();
 			if (!response.ok) {
-				throw new Error(`Server responded with ${response.status}: ${data.error || response.statusText}`);
+				throw new Error(`Server responded with ${response.status}: ${job.error || response.statusText}`);
 			}
+			// Videos analysed before are answered from the server's cache without queueing a job
+			const data = job.cached ? job.result : await waitForPredictionJob(job.job_id);
 
 			const predictionResult: PredictionResult = {
 				time: new Date().toLocaleTimeString(),
@@ -204,7 +246,8 @@ export default function ModelPage() {
 				confidence: data.confidence || `${Math.round(Math.abs(data.prediction[0] - 0.5) * 200)}%`,
 				videoName: videoData instanceof File && videoData.name ? videoData.name : fileName,
 				emotions: data.emotions,
-				visualization: data.visualization ? `data:image/png;base64,${data.visualization}` : undefined,
+				// Rendered by the server on request rather than embedded in the result
+				visualization: data.visualization_url ? await fetchVisualization(data.visualization_url) : undefined,
 				videoBlob: storedBlob,
 				id: `pred_${Date.now()}_${Math.floor(Math.random() * 1000)}`,
 			};
@@ -282,6 +325,9 @@ export default function ModelPage() {
 	 *   Remove selected rows from prediction results
 	 */
 	const deleteSelected = () => {
+		predictionResults
+			.filter(result => result.id && selectedRows.has(result.id) && result.visualization)
+			.forEach(result => URL.revokeObjectURL(result.visualization!));
 		setPredictionResults(prev =>
 			prev.filter(result => !result.id || !selectedRows.has(result.id))
 		);
@@ -794,6 +840,159 @@ export default function ModelPage() {
 		return '';
 	}
 
+	/**
+	 * startFrameStreaming:
+	 *   Opens a /api/stream session and posts webcam frames to it as they are
+	 *   captured, so rolling emotions and a deception score arrive while recording.
+	 */
+	const startFrameStreaming = async () => {
+		try {
+			const response = await fetch("http://localhost:5001/api/stream", {
+				method: "POST",
+				headers: {"Content-Type": "application/json"},
+				body: JSON.stringify({emit_every: STREAM_BATCH * 2}),
+			})
+			const session = await response.json()
+			if (!response.ok) {
+				throw new Error(`Server responded with ${response.status}: ${session.error || response.statusText}`)
+			}
+			streamSessionRef.current = session.session_id
+		} catch (err) {
+			handleError("Could not start live analysis.", err)
+			return
+		}
+
+		frameCaptureRef.current = setInterval(() => {
+			const video = videoRef.current
+			const canvas = canvasRef.current
+			if (!video || !canvas || !isCameraActiveRef.current || video.videoWidth === 0) {
+				return
+			}
+			canvas.width = video.videoWidth
+			canvas.height = video.videoHeight
+			canvas.getContext("2d")?.drawImage(video, 0, 0)
+			canvas.toBlob((blob) => {
+				if (!blob) {
+					return
+				}
+				pendingFramesRef.current.push(blob)
+				if (pendingFramesRef.current.length >= STREAM_BATCH) {
+					sendStreamFrames()
+				}
+			}, "image/jpeg", 0.8)
+		}, 1000 / STREAM_FPS)
+	}
+
+	/**
+	 * sendStreamFrames:
+	 *   Posts the captured frames to the open stream session, one request at a
+	 *   time so frames arrive in order, and shows any rolling update as the
+	 *   live prediction.
+	 */
+	const sendStreamFrames = async () => {
+		const sessionId = streamSessionRef.current
+		if (!sessionId || streamInFlightRef.current || pendingFramesRef.current.length === 0) {
+			return
+		}
+		const frames = pendingFramesRef.current
+		pendingFramesRef.current = []
+		streamInFlightRef.current = true
+
+		const formData = new FormData()
+		frames.forEach((frame, index) => formData.append("frames", frame, `frame_${index}.jpg`))
+
+		try {
+			const response = await fetch(`http://localhost:5001/api/stream/${sessionId}/frames`, {
+				method: "POST",
+				body: formData,
+			})
+			const update = await response.json()
+			if (!response.ok) {
+				throw new Error(`Server responded with ${response.status}: ${update.error || response.statusText}`)
+			}
+			if (update.result && streamSessionRef.current === sessionId) {
+				setSelectedPrediction({
+					time: new Date().toLocaleTimeString(),
+					result: update.result,
+					confidence: update.confidence,
+					videoName: "Live camera",
+					emotions: update.emotions,
+					id: "live",
+				})
+			}
+		} catch (err) {
+			console.error("Stream frame upload error:", err)
+		} finally {
+			streamInFlightRef.current = false
+		}
+
+		if (pendingFramesRef.current.length >= STREAM_BATCH) {
+			sendStreamFrames()
+		}
+	}
+
+	/**
+	 * finishStreamClip:
+	 *   Ends the stream session's current clip once the frames captured so far
+	 *   are sent, and records that clip's own result with its recording, so each
+	 *   history entry is scored on its clip alone. Returns false when the clip has
+	 *   no score (e.g. no face yet), so the recording can be uploaded instead.
+	 */
+	const finishStreamClip = async (chunk: Blob) => {
+		const sessionId = streamSessionRef.current
+		if (!sessionId) {
+			return false
+		}
+		while (streamInFlightRef.current) {
+			await new Promise((resolve) => setTimeout(resolve, 20))
+		}
+		await sendStreamFrames()
+
+		try {
+			const response = await fetch(`http://localhost:5001/api/stream/${sessionId}/clip`, {method: "POST"})
+			const clip = await response.json()
+			if (!response.ok) {
+				throw new Error(`Server responded with ${response.status}: ${clip.error || response.statusText}`)
+			}
+			if (!clip.result) {
+				return false
+			}
+			const predictionResult: PredictionResult = {
+				time: new Date().toLocaleTimeString(),
+				result: clip.result,
+				confidence: clip.confidence,
+				videoName: `live_recording_${new Date().toISOString()}.webm`,
+				emotions: clip.emotions,
+				videoBlob: chunk,
+				id: `pred_${Date.now()}_${Math.floor(Math.random() * 1000)}`,
+			};
+			setPredictionResults((prev) => [...prev, predictionResult]);
+			return true
+		} catch (err) {
+			console.error("Stream clip error:", err)
+			return false
+		}
+	}
+
+	/**
+	 * stopFrameStreaming:
+	 *   Stops capturing frames and closes the stream session on the server.
+	 */
+	const stopFrameStreaming = () => {
+		if (frameCaptureRef.current) {
+			clearInterval(frameCaptureRef.current)
+			frameCaptureRef.current = null
+		}
+		pendingFramesRef.current = []
+
+		const sessionId = streamSessionRef.current
+		streamSessionRef.current = null
+		if (sessionId) {
+			fetch(`http://localhost:5001/api/stream/${sessionId}`, {method: "DELETE"})
+				.catch((err) => console.error("Failed to close stream:", err))
+		}
+	}
+
 	/**
 	 * stopCamera:
 	 *   Stops the MediaRecorder (if recording), stops all camera tracks,
@@ -814,6 +1013,8 @@ export default function ModelPage() {
 			console.log("stopCamera: Cleared elapsedTime timer.")
 		}
 
+		stopFrameStreaming()
+
 		// Stop recorder using the ref
 		const currentRecorder = recorderRef.current;
 		if (currentRecorder && currentRecorder.state === "recording") {
@@ -923,7 +1124,12 @@ export default function ModelPage() {
 					});
 
 					console.log("Created new blob:", chunk.size, "bytes, type:", chunk.type);
-					sendVideoForPrediction(chunk)
+					// The live stream has already analysed these frames, so record its result instead of re-uploading
+					finishStreamClip(chunk).then((recorded) => {
+						if (!recorded) {
+							sendVideoForPrediction(chunk)
+						}
+					})
 				} else {
 					console.warn("ondataavailable: Ignoring data - camera not active or data empty.")
 				}
@@ -995,6 +1201,7 @@ export default function ModelPage() {
 						console.log("startCamera: video playback started, calling createContinuousRecorder for initial setup.")
 						// Create the *first* recorder. useEffect[recorder] will start it.
 						createContinuousRecorder(mediaStream)
+						startFrameStreaming()
 					}).catch(e => {
 						handleError("Error playing camera preview.", e);
 						stopCamera();
@@ -1346,6 +1553,7 @@ export default function ModelPage() {
 											width={800}
 											height={600}
 											priority
+											unoptimized
 										/>
 									</div>
 								</>